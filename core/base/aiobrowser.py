@@ -1,16 +1,198 @@
-from typing import Optional
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
-from playwright.async_api import Browser, Playwright, async_playwright, Error
+from playwright.async_api import Browser, Error, Page, Playwright, ViewportSize, async_playwright
 
 from core.service import Service
 from utils.log import logger
 
+__all__ = ["AioBrowser", "PagePool"]
+
+ViewportKey = Optional[Tuple[int, int]]
+
+# 浏览器启动后预先创建的页面，对应默认大小与常用模板的截图大小
+WARMUP_VIEWPORTS: List[Optional[ViewportSize]] = [
+    None,
+    {"width": 600, "height": 548},
+    {"width": 580, "height": 610},
+    {"width": 650, "height": 800},
+]
+
+
+class _PooledPage:
+    """池中的页面及其使用情况"""
+
+    __slots__ = ("page", "uses", "created_at")
+
+    def __init__(self, page: Page):
+        self.page = page
+        self.uses = 0
+        self.created_at = time.monotonic()
+
+
+class PagePool:
+    """按 viewport 分组的 Playwright 页面池
+
+    页面在使用后会被重置并放回池中，超过最大使用次数、存活时间或健康检查失败的页面会被关闭并重新创建
+    """
+
+    def __init__(
+        self,
+        browser: "AioBrowser",
+        max_pages: int = 8,
+        max_idle_per_viewport: int = 2,
+        max_uses: int = 100,
+        max_age: float = 30 * 60,
+        health_check_timeout: float = 2,
+    ):
+        """
+        :param browser: 浏览器服务
+        :param max_pages: 同时处于使用状态的最大页面数
+        :param max_idle_per_viewport: 每种 viewport 最多保留的空闲页面数
+        :param max_uses: 单个页面最大使用次数，超过后回收
+        :param max_age: 单个页面最大存活时间（秒），超过后回收
+        :param health_check_timeout: 健康检查超时时间（秒）
+        """
+        self._browser = browser
+        self.max_pages = max_pages
+        self.max_idle_per_viewport = max_idle_per_viewport
+        self.max_uses = max_uses
+        self.max_age = max_age
+        self.health_check_timeout = health_check_timeout
+        self._semaphore = asyncio.Semaphore(max_pages)
+        self._idle: Dict[ViewportKey, List[_PooledPage]] = {}
+        self._waiting = 0
+        self._in_use = 0
+        self._acquired = 0
+        self._created = 0
+        self._recycled = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    @staticmethod
+    def _viewport_key(viewport: Optional[ViewportSize]) -> ViewportKey:
+        if viewport is None:
+            return None
+        return viewport["width"], viewport["height"]
+
+    async def _new_page(self, viewport: Optional[ViewportSize]) -> _PooledPage:
+        browser = await self._browser.get_browser()
+        page = await browser.new_page(viewport=viewport)
+        self._created += 1
+        return _PooledPage(page)
+
+    async def _is_healthy(self, pooled: _PooledPage) -> bool:
+        if pooled.page.is_closed():
+            return False
+        if pooled.uses >= self.max_uses or time.monotonic() - pooled.created_at >= self.max_age:
+            return False
+        try:
+            await asyncio.wait_for(pooled.page.evaluate("1"), self.health_check_timeout)
+        except (Error, asyncio.TimeoutError):
+            return False
+        return True
+
+    async def _discard(self, pooled: _PooledPage):
+        self._recycled += 1
+        if not pooled.page.is_closed():
+            try:
+                await pooled.page.close()
+            except Error as exc:
+                logger.warning("关闭页面失败 %s", str(exc))
+
+    async def _take(self, viewport: Optional[ViewportSize]) -> _PooledPage:
+        idle = self._idle.get(self._viewport_key(viewport), [])
+        while idle:
+            pooled = idle.pop()
+            if await self._is_healthy(pooled):
+                return pooled
+            await self._discard(pooled)
+        return await self._new_page(viewport)
+
+    async def _give_back(self, viewport: Optional[ViewportSize], pooled: _PooledPage):
+        pooled.uses += 1
+        idle = self._idle.setdefault(self._viewport_key(viewport), [])
+        if pooled.page.is_closed() or pooled.uses >= self.max_uses or len(idle) >= self.max_idle_per_viewport:
+            await self._discard(pooled)
+            return
+        try:
+            # 清空页面内容，释放上一次渲染占用的资源
+            await pooled.page.goto("about:blank")
+        except Error:
+            await self._discard(pooled)
+            return
+        idle.append(pooled)
+
+    @asynccontextmanager
+    async def page(self, viewport: Optional[ViewportSize] = None) -> AsyncIterator[Page]:
+        """从池中取出一个页面，使用结束后自动放回
+        :param viewport: 页面大小
+        """
+        self._waiting += 1
+        start_time = time.monotonic()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        wait_time = time.monotonic() - start_time
+        self._total_wait += wait_time
+        self._max_wait = max(self._max_wait, wait_time)
+        self._acquired += 1
+        self._in_use += 1
+        pooled: Optional[_PooledPage] = None
+        try:
+            pooled = await self._take(viewport)
+            yield pooled.page
+        except BaseException:
+            # 出错的页面状态未知，直接丢弃
+            if pooled is not None:
+                await self._discard(pooled)
+                pooled = None
+            raise
+        finally:
+            try:
+                if pooled is not None:
+                    await self._give_back(viewport, pooled)
+            finally:
+                self._in_use -= 1
+                self._semaphore.release()
+
+    async def warmup(self, viewports: List[Optional[ViewportSize]]):
+        """预先创建页面"""
+        for viewport in viewports:
+            idle = self._idle.setdefault(self._viewport_key(viewport), [])
+            if len(idle) < self.max_idle_per_viewport:
+                idle.append(await self._new_page(viewport))
+
+    async def close(self):
+        """关闭池中所有空闲页面"""
+        for idle in self._idle.values():
+            while idle:
+                await self._discard(idle.pop())
+        self._idle.clear()
+
+    def statistics(self) -> Dict[str, float]:
+        """页面池的运行指标"""
+        return {
+            "idle": sum(len(i) for i in self._idle.values()),
+            "in_use": self._in_use,
+            "waiting": self._waiting,
+            "acquired": self._acquired,
+            "created": self._created,
+            "recycled": self._recycled,
+            "avg_wait": self._total_wait / self._acquired if self._acquired else 0.0,
+            "max_wait": self._max_wait,
+        }
+
 
 class AioBrowser(Service):
     def __init__(self, loop=None):
         self.browser: Optional[Browser] = None
         self._playwright: Optional[Playwright] = None
         self._loop = loop
+        self.page_pool = PagePool(self)
 
     async def start(self):
         if self._playwright is None:
@@ -22,6 +204,10 @@ class AioBrowser(Service):
             try:
                 self.browser = await self._playwright.chromium.launch(timeout=5000)
                 logger.success("[blue]Browser[/] 启动成功", extra={"markup": True})
+                try:
+                    await self.page_pool.warmup(WARMUP_VIEWPORTS)
+                except Error as exc:
+                    logger.warning("预先创建页面失败 %s", str(exc))
             except Error as err:
                 if "playwright install" in str(err):
                     logger.error(
@@ -36,6 +222,7 @@ class AioBrowser(Service):
         return self.browser
 
     async def stop(self):
+        await self.page_pool.close()
         if self.browser is not None:
             await self.browser.close()
         if self._playwright is not None:
@@ -45,3 +232,9 @@ class AioBrowser(Service):
         if self.browser is None:
             await self.start()
         return self.browser
+
+    def page(self, viewport: Optional[ViewportSize] = None):
+        """从页面池中取出一个页面，需配合 `async with` 使用
+        :param viewport: 页面大小
+        """
+        return self.page_pool.page(viewport)
@@ -3,18 +3,31 @@ from __future__ import annotations
 
 import asyncio
 import re
+import time
 from abc import ABC, abstractmethod
-from functools import cached_property, lru_cache, partial
+from functools import cached_property, partial
 from multiprocessing import RLock as Lock
 from pathlib import Path
 from ssl import SSLZeroReturnError
-from typing import AsyncIterator, Awaitable, Callable, ClassVar, Dict, Optional, TYPE_CHECKING, TypeVar, Union
-
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    ClassVar,
+    Dict,
+    Iterable,
+    Optional,
+    TYPE_CHECKING,
+    TypeVar,
+    Union,
+)
+
+import ujson as json
 from aiofiles import open as async_open
 from aiofiles.os import remove as async_remove
 from enkanetwork import Assets as EnkaAssets
 from enkanetwork.model.assets import CharacterAsset as EnkaCharacterAsset
-from httpx import AsyncClient, HTTPError, HTTPStatusError, TransportError, URL
+from httpx import AsyncClient, HTTPError, TransportError, URL
 from typing_extensions import Self
 
 from core.service import Service
@@ -53,6 +66,100 @@ class AssetsCouldNotFound(AssetsServiceError):
         super().__init__(f"{message}: target={message}")
 
 
+class _SourceHealth:
+    """图标来源的健康状况，用于决定各来源的尝试顺序"""
+
+    __slots__ = ("latency", "requests", "errors")
+
+    def __init__(self):
+        self.latency = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def record(self, latency: float, ok: bool) -> None:
+        # 使用指数加权平均，使近期的延迟占更大的比重
+        self.latency = latency if self.requests == 0 else self.latency * 0.8 + latency * 0.2
+        self.requests += 1
+        if not ok:
+            self.errors += 1
+
+    @property
+    def score(self) -> float:
+        """分数越低越优先"""
+        if self.requests == 0:
+            return 0.0
+        return self.latency * (1 + 4 * self.errors / self.requests)
+
+
+class AssetsManifest:
+    """本地图标文件的索引
+
+    以 `(type, id, icon_type)` 为键记录已下载图标的路径，并持久化为单个 JSON 文件，使图标查找无需访问文件系统
+    """
+
+    def __init__(self, root: Path = ASSETS_PATH, file: Optional[Path] = None):
+        self.root = root
+        self.file = file or root.joinpath("manifest.json")
+        self._data: dict[tuple[str, int, str], Path] = {}
+        self._dirty = False
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, assets_type: str, target: int, item: str) -> Path | None:
+        return self._data.get((assets_type, target, item))
+
+    def set(self, assets_type: str, target: int, item: str, path: Path) -> None:
+        self._data[(assets_type, target, item)] = path
+        self._dirty = True
+
+    def remove(self, assets_type: str, target: int, item: str) -> None:
+        if self._data.pop((assets_type, target, item), None) is not None:
+            self._dirty = True
+
+    def scan(self) -> None:
+        """遍历图标文件夹重建索引"""
+        self._data.clear()
+        for type_dir in filter(Path.is_dir, self.root.iterdir()):
+            for target_dir in filter(Path.is_dir, type_dir.iterdir()):
+                if not target_dir.name.isnumeric():
+                    continue
+                for path in filter(Path.is_file, target_dir.iterdir()):
+                    self._data[(type_dir.name, int(target_dir.name), path.stem)] = path.resolve()
+        self._dirty = True
+
+    def load(self) -> None:
+        """读取索引文件，文件不存在或已损坏时重新扫描图标文件夹"""
+        try:
+            with open(self.file, encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            self.scan()
+            self.save()
+            return
+        self._data.clear()
+        for key, value in data.items():
+            assets_type, target, item = key.split("/", 2)
+            if (path := self.root.joinpath(value)).exists():
+                self._data[(assets_type, int(target), item)] = path.resolve()
+            else:
+                self._dirty = True
+
+    def save(self) -> None:
+        """将索引写入文件"""
+        if not self._dirty:
+            return
+        data = {
+            f"{assets_type}/{target}/{item}": path.relative_to(self.root).as_posix()
+            for (assets_type, target, item), path in self._data.items()
+        }
+        temp_file = self.file.with_suffix(".tmp")
+        with open(temp_file, "w", encoding="utf-8") as file:
+            json.dump(data, file, ensure_ascii=False, escape_forward_slashes=False)
+        temp_file.replace(self.file)
+        self._dirty = False
+
+
 class _AssetsService(ABC):
     _lock: ClassVar["RLock"] = Lock()
     _dir: ClassVar[Path]
@@ -60,6 +167,16 @@ class _AssetsService(ABC):
 
     _client: Optional[AsyncClient] = None
     _links: dict[str, str] = {}
+    _manifest: ClassVar[AssetsManifest] = AssetsManifest()
+    _link_cache: ClassVar[dict[str, tuple[float, bool]]] = {}
+    """链接的探测结果及其过期时间"""
+    _source_health: ClassVar[dict[str, _SourceHealth]] = {}
+    link_ttl: ClassVar[float] = 24 * 60 * 60
+    """可用链接的缓存时间"""
+    negative_link_ttl: ClassVar[float] = 10 * 60
+    """不可用链接的缓存时间"""
+    _downloading: ClassVar[dict[tuple[str, int, str], "asyncio.Future[Path | None]"]] = {}
+    """正在下载中的图标，用于合并对同一图标的并发请求"""
 
     id: int
     type: str
@@ -80,9 +197,7 @@ class _AssetsService(ABC):
     @property
     def path(self) -> Path:
         """当前资源的文件夹"""
-        result = self._dir.joinpath(str(self.id)).resolve()
-        result.mkdir(exist_ok=True, parents=True)
-        return result
+        return self._dir.joinpath(str(self.id)).resolve()
 
     @property
     def client(self) -> AsyncClient:
@@ -115,9 +230,15 @@ class _AssetsService(ABC):
 
     async def _request(self, url: str, interval: float = 0.2) -> "Response":
         error = None
+        headers = {"user-agent": "TGPaimonBot/3.0"} if URL(url).host == "enka.network" else None
         for _ in range(5):
             try:
-                return await self.client.get(url, follow_redirects=False)
+                response = await self.client.head(url, follow_redirects=False, headers=headers)
+                if not response.is_success:
+                    # 部分 CDN 不支持 HEAD 请求，返回 403、404 或 405，改用 GET 确认，只读取响应头
+                    async with self.client.stream("GET", url, follow_redirects=False, headers=headers) as response:
+                        pass
+                return response
             except (TransportError, SSLZeroReturnError) as e:
                 error = e
                 await asyncio.sleep(interval)
@@ -129,13 +250,13 @@ class _AssetsService(ABC):
         """从 url 下载图标至 path"""
         logger.debug(f"正在从 {url} 下载图标至 {path}")
         headers = {"user-agent": "TGPaimonBot/3.0"} if URL(url).host == "enka.network" else None
-        for time in range(retry):
+        for count in range(retry):
             try:
                 response = await self.client.get(url, follow_redirects=False, headers=headers)
             except Exception as error:  # pylint: disable=W0703
                 if not isinstance(error, (HTTPError, SSLZeroReturnError)):
                     logger.error(error)  # 打印未知错误
-                if time != retry - 1:  # 未达到重试次数
+                if count != retry - 1:  # 未达到重试次数
                     await asyncio.sleep(1)
                 else:
                     raise error
@@ -160,17 +281,39 @@ class _AssetsService(ABC):
             yield HONEY_HOST.join(f"img/{honey_name}.png")
             yield HONEY_HOST.join(f"img/{honey_name}.webp")
 
+    def _sources(self) -> list[tuple[str, Callable[[str], AsyncIterator[str | None]]]]:
+        """获取当前 `AssetsService` 的所有爬虫，按来源的健康状况排序"""
+        names = sorted(x[len("_get_from_") :] for x in dir(self) if x.startswith("_get_from_"))
+        for name in names:
+            self._source_health.setdefault(name, _SourceHealth())
+        names.sort(key=lambda x: self._source_health[x].score)
+        return [(name, getattr(self, f"_get_from_{name}")) for name in names]
+
+    async def _probe(self, source: str, url: str) -> bool:
+        """探测链接是否可用，结果会被缓存"""
+        now = time.monotonic()
+        if (cache := self._link_cache.get(url)) is not None and cache[0] > now:
+            return cache[1]
+        health = self._source_health[source]
+        try:
+            response = await self._request(url)
+        except (TransportError, SSLZeroReturnError):
+            health.record(time.monotonic() - now, False)
+            return False
+        health.record(time.monotonic() - now, response.status_code < 500)
+        ok = response.status_code == 200
+        self._link_cache[url] = (now + (self.link_ttl if ok else self.negative_link_ttl), ok)
+        return ok
+
+    def _invalidate_link(self, url: str) -> None:
+        """将链接标记为不可用"""
+        self._link_cache[url] = (time.monotonic() + self.negative_link_ttl, False)
+
     async def _download_url_generator(self, item: str) -> AsyncIterator[str]:
-        # 获取当前 `AssetsService` 的所有爬虫
-        for func in map(lambda x: getattr(self, x), sorted(filter(lambda x: x.startswith("_get_from_"), dir(self)))):
+        for source, func in self._sources():
             async for url in func(item):
-                if url is not None:
-                    try:
-                        response = await self._request(url := str(url))
-                        response.raise_for_status()
-                        yield url
-                    except HTTPStatusError:
-                        continue
+                if url is not None and await self._probe(source, url := str(url)):
+                    yield url
 
     async def _get_download_url(self, item: str) -> str | None:
         """获取图标的下载链接"""
@@ -180,22 +323,38 @@ class _AssetsService(ABC):
 
     async def _get_img(self, overwrite: bool = False, *, item: str) -> Path | None:
         """获取图标"""
-        path = next(filter(lambda x: x.stem == item, self.path.iterdir()), None)
-        if not overwrite and path:  # 如果需要下载的图标存在且不覆盖( overwrite )
-            return path.resolve()
+        path = self._manifest.get(self.type, self.id, item)
+        if not overwrite and path is not None:  # 如果需要下载的图标存在且不覆盖( overwrite )
+            return path
+        if path is None and self.path.exists():  # 索引中没有时再查找本地文件
+            path = next(filter(lambda x: x.stem == item, self.path.iterdir()), None)
         if path is not None and path.exists():
             if overwrite:  # 如果覆盖
                 await async_remove(path)  # 删除已存在的图标
+                self._manifest.remove(self.type, self.id, item)
             else:
+                path = path.resolve()
+                self._manifest.set(self.type, self.id, item, path)
                 return path
+        key = (self.type, self.id, item)
+        if (future := self._downloading.get(key)) is None:  # 同一图标同时只会有一个下载任务
+            future = asyncio.ensure_future(self._download_img(item))
+            self._downloading[key] = future
+            future.add_done_callback(lambda _: self._downloading.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def _download_img(self, item: str) -> Path | None:
+        """下载图标"""
         # 依次从使用当前 assets class 中的爬虫下载图标，顺序为爬虫名的字母顺序
         async for url in self._download_url_generator(item):
             if url is not None:
+                self.path.mkdir(exist_ok=True, parents=True)
                 path = self.path.joinpath(f"{item}{Path(url).suffix}")
                 if (result := await self._download(url, path)) is not None:
+                    self._manifest.set(self.type, self.id, item, result)
                     return result
+                self._invalidate_link(url)
 
-    @lru_cache
     async def get_link(self, item: str) -> str | None:
         """获取相应图标链接"""
         return await self._get_download_url(item)
@@ -517,12 +676,62 @@ class AssetsService(Service):
         ):
             setattr(self, attr, globals()[assets_type_name]())
 
+    async def prefetch(
+        self,
+        types: Iterable[str] = ("avatar", "weapon", "material", "namecard"),
+        concurrency: int = 16,
+        progress: Optional[Callable[[int, int], Optional[Awaitable[None]]]] = None,
+    ) -> tuple[int, int]:
+        """批量预下载图标
+        :param types: 需要预下载的 asset 类型
+        :param concurrency: 最大并发下载数
+        :param progress: 进度回调，参数为已完成数和总数
+        :return: 成功数与失败数
+        """
+        targets: list[tuple[_AssetsService, str]] = []
+        for assets_type in types:
+            assets: _AssetsService = getattr(self, assets_type)
+            data = NAMECARD_DATA if assets_type == "namecard" else DATA_MAP[assets_type]
+            for target in list(data.keys()):
+                try:
+                    asset = assets(int(target))
+                except (AssetsCouldNotFound, ValueError):
+                    continue
+                targets.extend((asset, item) for item in asset.icon_types)
+
+        semaphore = asyncio.Semaphore(concurrency)
+        total = len(targets)
+        done = success = 0
+
+        async def _task(asset: _AssetsService, item: str):
+            nonlocal done, success
+            async with semaphore:
+                try:
+                    if await getattr(asset, item)() is not None:
+                        success += 1
+                except Exception as exc:  # pylint: disable=W0703
+                    logger.debug(f"预下载图标 {asset.type}[{asset.id}].{item} 失败: {exc}")
+            done += 1
+            if progress is not None and (result := progress(done, total)) is not None:
+                await result
+
+        logger.info(f"正在预下载 {total} 个图标")
+        await asyncio.gather(*(_task(asset, item) for asset, item in targets))
+        _AssetsService._manifest.save()
+        logger.success(f"图标预下载完成，成功 {success} 个，失败 {total - success} 个")
+        return success, total - success
+
     async def start(self):  # pylint: disable=R0201
         logger.info("正在刷新元数据")
         await update_metadata_from_github(False)
         await update_metadata_from_ambr(False)
         await update_honey_metadata(False)
         logger.info("刷新元数据成功")
+        _AssetsService._manifest.load()
+        logger.info(f"已载入 {len(_AssetsService._manifest)} 个本地图标的索引")
+
+    async def stop(self):  # pylint: disable=R0201
+        _AssetsService._manifest.save()
 
 
 AssetsServiceType = TypeVar("AssetsServiceType", bound=_AssetsService)
@@ -14,8 +14,8 @@ def create_cookie_service(mysql: MySQL):
 
 
 @init_service
-def create_public_cookie_service(mysql: MySQL, redis: RedisDB):
+def create_public_cookie_service(mysql: MySQL, redis: RedisDB, cookies_service: CookiesService = None):
     _repository = CookiesRepository(mysql)
     _cache = PublicCookiesCache(redis)
-    _service = PublicCookiesService(_repository, _cache)
+    _service = PublicCookiesService(_repository, _cache, cookies_service)
     return _service
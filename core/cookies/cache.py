@@ -1,4 +1,6 @@
-from typing import List, Union
+from typing import List, Tuple, Union
+
+from redis.exceptions import ResponseError
 
 from core.base.redisdb import RedisDB
 from utils.error import RegionNotFoundError
@@ -6,6 +8,17 @@ from utils.models.base import RegionEnum
 from .error import CookiesCachePoolExhausted
 
 
+# 取出使用次数最少的 Cookies 并增加其使用次数，在一次调用中完成，并发请求不会拿到同一个 Cookies
+CHECKOUT_SCRIPT = """
+local item = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+if #item == 0 then
+    return nil
+end
+local score = redis.call('ZINCRBY', KEYS[1], 1, item[1])
+return {item[1], score}
+"""
+
+
 class PublicCookiesCache:
     """使用优先级(score)进行排序，对使用次数最少的Cookies进行审核"""
 
@@ -15,6 +28,8 @@ class PublicCookiesCache:
         self.user_times_qname = "cookie:public:times"
         self.end = 20
         self.user_times_ttl = 60 * 60 * 24
+        self._checkout_script = self.client.register_script(CHECKOUT_SCRIPT)
+        self._script_available = True
 
     def get_public_cookies_queue_name(self, region: RegionEnum):
         if region == RegionEnum.HYPERION:
@@ -57,12 +72,23 @@ class PublicCookiesCache:
             add, count = await pipe.execute()
             return int(add), count
 
-    async def get_public_cookies(self, region: RegionEnum):
-        """从缓存列表获取
+    async def get_public_cookies(self, region: RegionEnum) -> Tuple[int, int]:
+        """从缓存列表获取使用次数最少的Cookies，并增加其使用次数
         :param region:
-        :return:
+        :return: 用户ID与增加后的使用次数
         """
         qname = self.get_public_cookies_queue_name(region)
+        if self._script_available:
+            try:
+                result = await self._checkout_script(keys=[qname])
+            except (ResponseError, ImportError):
+                # fakeredis 在没有安装 lupa 时不支持脚本
+                self._script_available = False
+            else:
+                if not result:
+                    raise CookiesCachePoolExhausted
+                key, score = result
+                return int(key), int(float(score))
         scores = await self.client.zrange(qname, 0, self.end, withscores=True, score_cast_func=int)
         if len(scores) <= 0:
             raise CookiesCachePoolExhausted
@@ -79,6 +105,16 @@ class PublicCookiesCache:
             await pipe.zrem(qname, uid)
             return await pipe.execute()
 
+    async def get_all_public_cookies(self, region: RegionEnum) -> List[int]:
+        """获取公共Cookies池中的所有用户ID"""
+        qname = self.get_public_cookies_queue_name(region)
+        return [int(uid) for uid in await self.client.zrange(qname, 0, -1)]
+
+    async def count_public_cookies(self, region: RegionEnum) -> int:
+        """获取公共Cookies池的大小"""
+        qname = self.get_public_cookies_queue_name(region)
+        return await self.client.zcard(qname)
+
     async def get_public_cookies_count(self, limit: bool = True):
         async with self.client.pipeline(transaction=True) as pipe:
             if limit:
@@ -1,60 +1,233 @@
-from typing import List
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
 
 import genshin
 from genshin import GenshinException, InvalidCookies, TooManyRequests, types, Game
 
+from utils.cache import TTLCache
 from utils.log import logger
 from utils.models.base import RegionEnum
 from .cache import PublicCookiesCache
 from .error import TooManyRequestPublicCookies, CookieServiceError
-from .models import CookiesStatusEnum
+from .models import Cookies, CookiesStatusEnum
 from .repositories import CookiesNotFoundError, CookiesRepository
 
 
 class CookiesService:
     def __init__(self, cookies_repository: CookiesRepository) -> None:
         self._repository: CookiesRepository = cookies_repository
+        # 几乎每个命令都需要读取用户的Cookies，修改时使缓存失效
+        self._cache: TTLCache[Tuple[int, RegionEnum], Cookies] = TTLCache(ttl=10 * 60, maxsize=4096)
 
     async def update_cookies(self, user_id: int, cookies: dict, region: RegionEnum):
-        await self._repository.update_cookies(user_id, cookies, region)
+        try:
+            await self._repository.update_cookies(user_id, cookies, region)
+        finally:
+            self._cache.pop((user_id, region))
 
     async def add_cookies(self, user_id: int, cookies: dict, region: RegionEnum):
-        await self._repository.add_cookies(user_id, cookies, region)
+        try:
+            await self._repository.add_cookies(user_id, cookies, region)
+        finally:
+            self._cache.pop((user_id, region))
 
-    async def get_cookies(self, user_id: int, region: RegionEnum):
-        return await self._repository.get_cookies(user_id, region)
+    async def update_cookies_ex(self, cookies: Cookies, region: RegionEnum):
+        """保存修改后的Cookies
+        :param cookies: Cookies
+        :param region: 注册的服务器
+        """
+        try:
+            await self._repository.update_cookies_ex(cookies, region)
+        finally:
+            self._cache.pop((cookies.user_id, region))
+
+    async def get_cookies(self, user_id: int, region: RegionEnum) -> Cookies:
+        """获取用户的Cookies，短时间内再次获取时使用缓存
+        :param user_id: 用户ID
+        :param region: 注册的服务器
+        :return: Cookies
+        """
+        if (cookies := self._cache.get((user_id, region))) is not None:
+            return cookies
+        generation = self._cache.generation
+        cookies = await self._repository.get_cookies(user_id, region)
+        self._cache.set((user_id, region), cookies, generation)
+        return cookies
 
     async def del_cookies(self, user_id: int, region: RegionEnum):
-        return await self._repository.del_cookies(user_id, region)
+        try:
+            return await self._repository.del_cookies(user_id, region)
+        finally:
+            self._cache.pop((user_id, region))
+
+
+class PublicCookiesHealth:
+    """单个公共Cookies的验证记录
+
+    连续验证失败时按指数退避暂停使用，暂停结束后由定时检查重新验证，验证成功后恢复使用
+    """
+
+    def __init__(self):
+        self.success: int = 0
+        self.too_many_requests: int = 0
+        self.challenge: int = 0
+        self.error: int = 0
+        self.failures: int = 0  # 连续失败次数
+        self.benched_until: float = 0
+        self.verified_time: Optional[float] = None
+
+    def is_benched(self, now: float) -> bool:
+        return now < self.benched_until
+
+    def record_success(self, now: float):
+        self.success += 1
+        self.failures = 0
+        self.benched_until = 0
+        self.verified_time = now
+
+    def record_failure(self, now: float, base_delay: float, max_delay: float) -> float:
+        """记录一次失败并暂停使用
+        :return: 暂停的秒数
+        """
+        self.failures += 1
+        self.verified_time = None
+        delay = min(base_delay * 2 ** (self.failures - 1), max_delay)
+        self.benched_until = now + delay
+        return delay
 
 
 class PublicCookiesService:
-    def __init__(self, cookies_repository: CookiesRepository, public_cookies_cache: PublicCookiesCache):
+    def __init__(
+        self,
+        cookies_repository: CookiesRepository,
+        public_cookies_cache: PublicCookiesCache,
+        cookies_service: Optional[CookiesService] = None,
+    ):
         self._cache = public_cookies_cache
         self._repository: CookiesRepository = cookies_repository
+        # 通过 CookiesService 读取时使用其缓存，用户修改或删除Cookies时缓存会失效
+        self._cookies_service = cookies_service
         self.count: int = 0
         self.user_times_limiter = 3 * 3
+        # 已验证可用的公共Cookies与最后验证的时间，在有效期内再次取出时无需查询数据库与重新验证
+        self._verified: Dict[Tuple[RegionEnum, int], Tuple[Cookies, float]] = {}
+        self._health: Dict[Tuple[RegionEnum, int], PublicCookiesHealth] = {}
+        self.verify_ttl = 30 * 60
+        # 暂停使用的时间从 bench_delay 开始，每次连续失败翻倍，最长为 bench_max_delay
+        self.bench_delay = 10 * 60
+        self.bench_max_delay = 24 * 60 * 60
+        # 定时检查时同时验证的数量与每个验证之间的间隔，避免短时间内请求过多
+        self.check_concurrency = 4
+        self.check_interval = 2
+
+    def _is_benched(self, public_id: int, region: RegionEnum) -> bool:
+        health = self._health.get((region, public_id))
+        return health is not None and health.is_benched(time.monotonic())
+
+    @staticmethod
+    def _is_available(cookies: Cookies) -> bool:
+        # 旧版本会将查询次数过多的Cookies标记为 TOO_MANY_REQUESTS 并不再使用，现在改为暂停使用
+        return cookies.status in (None, CookiesStatusEnum.STATUS_SUCCESS, CookiesStatusEnum.TOO_MANY_REQUESTS)
 
     async def refresh(self):
         """刷新公共Cookies 定时任务
         :return:
         """
-        user_list: List[int] = []
-        cookies_list = await self._repository.get_all_cookies(RegionEnum.HYPERION)  # 从数据库获取2
-        for cookies in cookies_list:
-            if cookies.status is None or cookies.status == CookiesStatusEnum.STATUS_SUCCESS:
-                user_list.append(cookies.user_id)
-        if len(user_list) > 0:
-            add, count = await self._cache.add_public_cookies(user_list, RegionEnum.HYPERION)
-            logger.info(f"国服公共Cookies池已经添加[{add}]个 当前成员数为[{count}]")
-        user_list.clear()
-        cookies_list = await self._repository.get_all_cookies(RegionEnum.HOYOLAB)
-        for cookies in cookies_list:
-            if cookies.status is None or cookies.status == CookiesStatusEnum.STATUS_SUCCESS:
-                user_list.append(cookies.user_id)
-        if len(user_list) > 0:
-            add, count = await self._cache.add_public_cookies(user_list, RegionEnum.HOYOLAB)
-            logger.info(f"国际服公共Cookies池已经添加[{add}]个 当前成员数为[{count}]")
+        for region, name in ((RegionEnum.HYPERION, "国服"), (RegionEnum.HOYOLAB, "国际服")):
+            cookies_list = await self._repository.get_all_cookies(region)
+            user_list: List[int] = [
+                cookies.user_id
+                for cookies in cookies_list
+                if self._is_available(cookies) and not self._is_benched(cookies.user_id, region)
+            ]
+            if len(user_list) > 0:
+                add, count = await self._cache.add_public_cookies(user_list, region)
+                logger.info(f"{name}公共Cookies池已经添加[{add}]个 当前成员数为[{count}]")
+
+    async def _remove(self, public_id: int, region: RegionEnum):
+        self._verified.pop((region, public_id), None)
+        self._health.pop((region, public_id), None)
+        await self._cache.delete_public_cookies(public_id, region)
+
+    async def _bench(self, public_id: int, region: RegionEnum):
+        """暂停使用Cookies，移出公共Cookies池但保留数据库中的状态"""
+        health = self._health.setdefault((region, public_id), PublicCookiesHealth())
+        delay = health.record_failure(time.monotonic(), self.bench_delay, self.bench_max_delay)
+        logger.info("用户 [%s] 的公共Cookies暂停使用 %s 秒", public_id, int(delay))
+        self._verified.pop((region, public_id), None)
+        await self._cache.delete_public_cookies(public_id, region)
+
+    async def _update_cookies(self, cookies: Cookies, region: RegionEnum):
+        # Cookies可能是 CookiesService 缓存中的对象，通过 CookiesService 保存使缓存失效
+        if self._cookies_service is not None:
+            await self._cookies_service.update_cookies_ex(cookies, region)
+        else:
+            await self._repository.update_cookies_ex(cookies, region)
+
+    async def _verify(self, public_id: int, cookies: Cookies, region: RegionEnum) -> bool:
+        """验证Cookies是否可用，无效时移出公共Cookies池，暂时不可用时暂停使用
+        :param public_id: Cookies所属的用户ID
+        :param cookies: Cookies
+        :param region: 注册的服务器
+        :return: 是否可用
+        """
+        if region == RegionEnum.HYPERION:
+            client = genshin.Client(cookies=cookies.cookies, game=types.Game.GENSHIN, region=types.Region.CHINESE)
+        elif region == RegionEnum.HOYOLAB:
+            client = genshin.Client(
+                cookies=cookies.cookies, game=types.Game.GENSHIN, region=types.Region.OVERSEAS, lang="zh-cn"
+            )
+        else:
+            raise CookieServiceError
+        health = self._health.setdefault((region, public_id), PublicCookiesHealth())
+        try:
+            record_card = await client.get_record_card()
+            if record_card.game == Game.GENSHIN and region == RegionEnum.HYPERION:
+                await client.get_partial_genshin_user(record_card.uid)
+        except InvalidCookies as exc:
+            if exc.retcode in (10001, -100):
+                logger.warning("用户 [%s] Cookies无效", public_id)
+            elif exc.retcode == 10103:
+                logger.warning("用户 [%s] Cookie有效，但没有绑定到游戏帐户", public_id)
+            else:
+                logger.warning("Cookies无效 ")
+                logger.exception(exc)
+            cookies.status = CookiesStatusEnum.INVALID_COOKIES
+            await self._update_cookies(cookies, region)
+            await self._remove(public_id, region)
+            return False
+        except TooManyRequests:
+            logger.warning("用户 [%s] 查询次数太多或操作频繁", public_id)
+            health.too_many_requests += 1
+            await self._bench(public_id, region)
+            return False
+        except GenshinException as exc:
+            if exc.retcode == 1034:
+                logger.warning("用户 [%s] 触发验证", public_id)
+                health.challenge += 1
+            else:
+                logger.warning("用户 [%s] 获取账号信息发生错误，错误信息为", public_id)
+                logger.exception(exc)
+                health.error += 1
+            await self._bench(public_id, region)
+            return False
+        except Exception as exc:
+            health.error += 1
+            await self._bench(public_id, region)
+            raise exc
+        now = time.monotonic()
+        health.record_success(now)
+        if cookies.status == CookiesStatusEnum.TOO_MANY_REQUESTS:
+            cookies.status = CookiesStatusEnum.STATUS_SUCCESS
+            await self._update_cookies(cookies, region)
+        self._verified[(region, public_id)] = (cookies, now)
+        return True
+
+    async def _get_user_cookies(self, public_id: int, region: RegionEnum) -> Cookies:
+        if self._cookies_service is not None:
+            return await self._cookies_service.get_cookies(public_id, region)
+        return await self._repository.get_cookies(public_id, region)
 
     async def get_cookies(self, user_id: int, region: RegionEnum = RegionEnum.NULL):
         """获取公共Cookies
@@ -68,51 +241,90 @@ class PublicCookiesService:
             raise TooManyRequestPublicCookies(user_id)
         while True:
             public_id, count = await self._cache.get_public_cookies(region)
+            # 每次都确认用户的Cookies仍然存在且没有被修改，已删除的Cookies不能再作为公共Cookies使用
             try:
-                cookies = await self._repository.get_cookies(public_id, region)
+                cookies = await self._get_user_cookies(public_id, region)
             except CookiesNotFoundError:
-                await self._cache.delete_public_cookies(public_id, region)
-                continue
-            if region == RegionEnum.HYPERION:
-                client = genshin.Client(cookies=cookies.cookies, game=types.Game.GENSHIN, region=types.Region.CHINESE)
-            elif region == RegionEnum.HOYOLAB:
-                client = genshin.Client(
-                    cookies=cookies.cookies, game=types.Game.GENSHIN, region=types.Region.OVERSEAS, lang="zh-cn"
-                )
-            else:
-                raise CookieServiceError
-            try:
-                record_card = await client.get_record_card()
-                if record_card.game == Game.GENSHIN and region == RegionEnum.HYPERION:
-                    await client.get_partial_genshin_user(record_card.uid)
-            except InvalidCookies as exc:
-                if exc.retcode in (10001, -100):
-                    logger.warning("用户 [%s] Cookies无效", public_id)
-                elif exc.retcode == 10103:
-                    logger.warning("用户 [%s] Cookie有效，但没有绑定到游戏帐户", public_id)
-                else:
-                    logger.warning("Cookies无效 ")
-                    logger.exception(exc)
-                cookies.status = CookiesStatusEnum.INVALID_COOKIES
-                await self._repository.update_cookies_ex(cookies, region)
-                await self._cache.delete_public_cookies(cookies.user_id, region)
-                continue
-            except TooManyRequests:
-                logger.warning("用户 [%s] 查询次数太多或操作频繁", public_id)
-                cookies.status = CookiesStatusEnum.TOO_MANY_REQUESTS
-                await self._repository.update_cookies_ex(cookies, region)
-                await self._cache.delete_public_cookies(cookies.user_id, region)
+                await self._remove(public_id, region)
                 continue
-            except GenshinException as exc:
-                if exc.retcode == 1034:
-                    logger.warning("用户 [%s] 触发验证", public_id)
-                else:
-                    logger.warning("用户 [%s] 获取账号信息发生错误，错误信息为", public_id)
-                    logger.exception(exc)
-                await self._cache.delete_public_cookies(cookies.user_id, region)
+            verified = self._verified.get((region, public_id))
+            if (
+                verified is not None
+                and time.monotonic() - verified[1] < self.verify_ttl
+                and verified[0].cookies == cookies.cookies
+            ):
+                cookies = verified[0]
+            elif not await self._verify(public_id, cookies, region):
                 continue
-            except Exception as exc:
-                await self._cache.delete_public_cookies(cookies.user_id, region)
-                raise exc
             logger.info("用户 user_id[%s] 请求用户 user_id[%s] 的公共Cookies 该Cookie使用次数为%s次 ", user_id, public_id, count)
             return cookies
+
+    async def revalidate(self):
+        """检查公共Cookies池 定时任务
+
+        只验证公共Cookies池中距离上次验证超过有效期的Cookies，以及暂停结束的Cookies，验证成功的重新加入公共Cookies池。
+        候选从 Redis 中的公共Cookies池读取，不再扫描数据库；从未验证过的Cookies在取出时验证，避免频繁请求导致账号被风控
+        :return:
+        """
+        semaphore = asyncio.Semaphore(self.check_concurrency)
+
+        async def _check(_public_id: int, _region: RegionEnum) -> bool:
+            async with semaphore:
+                try:
+                    try:
+                        _cookies = await self._get_user_cookies(_public_id, _region)
+                    except CookiesNotFoundError:
+                        await self._remove(_public_id, _region)
+                        return False
+                    if not self._is_available(_cookies):
+                        await self._remove(_public_id, _region)
+                        return False
+                    return await self._verify(_public_id, _cookies, _region)
+                except Exception as exc:  # pylint: disable=W0703
+                    logger.warning("用户 [%s] 的公共Cookies验证失败 %s", _public_id, repr(exc))
+                    return False
+                finally:
+                    await asyncio.sleep(self.check_interval)
+
+        for region in (RegionEnum.HYPERION, RegionEnum.HOYOLAB):
+            now = time.monotonic()
+            pending: List[int] = []
+            for public_id in await self._cache.get_all_public_cookies(region):
+                health = self._health.get((region, public_id))
+                if (
+                    health is not None
+                    and health.verified_time is not None
+                    and now - health.verified_time >= self.verify_ttl
+                ):
+                    pending.append(public_id)
+            # 暂停使用的Cookies已经移出公共Cookies池，暂停结束后重新验证
+            for (_region, public_id), health in self._health.items():
+                if _region == region and health.failures and not health.is_benched(now) and public_id not in pending:
+                    pending.append(public_id)
+            if not pending:
+                continue
+            results = await asyncio.gather(*(_check(public_id, region) for public_id in pending))
+            user_list = [public_id for public_id, result in zip(pending, results) if result]
+            if user_list:
+                # 暂停结束的Cookies重新加入公共Cookies池，已在池中的不会重置使用次数
+                await self._cache.add_public_cookies(user_list, region)
+            logger.info("公共Cookies池 [%s] 已验证 %s 个 可用 %s 个", region.name, len(pending), len(user_list))
+
+    async def get_health(self) -> Dict[RegionEnum, Dict[str, int]]:
+        """获取公共Cookies池的统计信息
+        :return: 各服务器的统计信息
+        """
+        now = time.monotonic()
+        data: Dict[RegionEnum, Dict[str, int]] = {}
+        for region in (RegionEnum.HYPERION, RegionEnum.HOYOLAB):
+            health_list = [health for (_region, _), health in self._health.items() if _region == region]
+            data[region] = {
+                "pool": await self._cache.count_public_cookies(region),
+                "verified": sum(1 for health in health_list if health.verified_time is not None),
+                "benched": sum(1 for health in health_list if health.is_benched(now)),
+                "success": sum(health.success for health in health_list),
+                "too_many_requests": sum(health.too_many_requests for health in health_list),
+                "challenge": sum(health.challenge for health in health_list),
+                "error": sum(health.error for health in health_list),
+            }
+        return data
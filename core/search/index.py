@@ -0,0 +1,126 @@
+"""搜索条目的索引
+
+条目加入时记录标题与标签的精确匹配，以及参与模糊匹配的文本的字符 n-gram 倒排索引。
+搜索时只对与搜索文本有共同 n-gram 的少量候选条目计算模糊匹配的分数。
+"""
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set
+
+from core.search.models import BaseEntry
+
+__all__ = ("SearchIndex",)
+
+
+def _normalize(text: str) -> str:
+    return text.strip().lower()
+
+
+def _grams(text: str, size: int) -> Set[str]:
+    """文本中长度为 size 的字符片段，空白字符不参与匹配"""
+    text = "".join(_normalize(text).split())
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i : i + size] for i in range(len(text) - size + 1)}
+
+
+class SearchIndex:
+    """搜索条目的倒排索引
+
+    :param gram_size: 倒排索引使用的字符片段长度，中文以两个字为宜
+    :param shortlist_size: 按 n-gram 命中数量选出的候选条目数量上限
+    """
+
+    def __init__(self, gram_size: int = 2, shortlist_size: int = 64):
+        self.gram_size = gram_size
+        self.shortlist_size = shortlist_size
+        self._entries: Dict[str, BaseEntry] = {}
+        self._exact: Dict[str, Set[str]] = {}
+        self._grams: Dict[str, Set[str]] = {}
+        self._chars: Dict[str, Set[str]] = {}
+        self._keys: Dict[str, Dict[str, Set[str]]] = {}
+        # 条目加入的顺序，分数相同时按加入顺序排列
+        self._order: Dict[str, int] = {}
+        self._sequence = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def get(self, key: str) -> Optional[BaseEntry]:
+        return self._entries.get(key)
+
+    def values(self) -> List[BaseEntry]:
+        return sorted(self._entries.values(), key=lambda entry: self._order[entry.key])
+
+    def _tokens(self, entry: BaseEntry) -> Dict[str, Set[str]]:
+        names = {_normalize(name) for name in [entry.title, *(entry.tags or [])] if name and _normalize(name)}
+        texts = entry.search_texts()
+        return {
+            "exact": names,
+            "grams": set().union(*(_grams(text, self.gram_size) for text in texts)),
+            "chars": set().union(*(_grams(text, 1) for text in texts)),
+        }
+
+    def _tables(self) -> Dict[str, Dict[str, Set[str]]]:
+        return {"exact": self._exact, "grams": self._grams, "chars": self._chars}
+
+    def add(self, entry: BaseEntry):
+        """添加条目，已有相同 key 的条目时在原来的位置替换"""
+        order = self._order.get(entry.key)
+        self.remove(entry.key)
+        tokens = self._tokens(entry)
+        for name, table in self._tables().items():
+            for token in tokens[name]:
+                table.setdefault(token, set()).add(entry.key)
+        self._keys[entry.key] = tokens
+        self._entries[entry.key] = entry
+        if order is None:
+            order = self._sequence
+            self._sequence += 1
+        self._order[entry.key] = order
+
+    def remove(self, key: str):
+        tokens = self._keys.pop(key, None)
+        if tokens is None:
+            return
+        for name, table in self._tables().items():
+            for token in tokens[name]:
+                keys = table[token]
+                keys.discard(key)
+                if not keys:
+                    del table[token]
+        del self._entries[key]
+        del self._order[key]
+
+    def clear(self):
+        self._entries.clear()
+        self._keys.clear()
+        self._order.clear()
+        for table in self._tables().values():
+            table.clear()
+
+    def candidates(self, search_query: str, limit: Optional[int] = None) -> List[BaseEntry]:
+        """可能与搜索文本相关的条目
+
+        包括标题或标签与搜索文本相同的条目，以及共同 n-gram 最多的 limit 个条目。
+        与搜索文本没有任何共同字符的条目模糊匹配的分数为 0，不会成为候选
+        :param search_query: 搜索文本
+        :param limit: 候选条目数量上限，默认为 shortlist_size
+        """
+        limit = max(limit or 0, self.shortlist_size)
+        query = _normalize(search_query)
+        keys: Set[str] = set(self._exact.get(query, ()))
+        counter = Counter(key for gram in _grams(query, self.gram_size) for key in self._grams.get(gram, ()))
+        if len(counter) < limit:
+            # n-gram 命中的条目不足时用单个字符的命中补足，排在命中 n-gram 的条目之后
+            chars = Counter(key for char in _grams(query, 1) for key in self._chars.get(char, ()))
+            for key, count in chars.items():
+                counter[key] += count / (len(query) + 1)
+        keys.update(key for key, _ in counter.most_common(limit))
+        return [self._entries[key] for key in sorted(keys, key=self._order.__getitem__)]
+
+    def extend(self, entries: Iterable[BaseEntry]):
+        for entry in entries:
+            self.add(entry)
@@ -22,6 +22,10 @@ class BaseEntry(BaseModel):
     photo_url: Optional[str] = None
     photo_file_id: Optional[str] = None
 
+    def search_texts(self) -> List[str]:
+        """参与模糊匹配的文本，用于建立搜索索引"""
+        return list(self.tags or [])
+
     @abstractmethod
     def compare_to_query(self, search_query: str) -> float:
         """返回一个数字 ∈[0,100] 描述搜索查询与此条目的相似程度。
@@ -30,6 +34,9 @@ class BaseEntry(BaseModel):
 
 
 class WeaponEntry(BaseEntry):
+    def search_texts(self) -> List[str]:
+        return [*(self.tags or []), self.description]
+
     def compare_to_query(self, search_query: str) -> float:
         score = 0.0
         if search_query == self.title:
@@ -8,9 +8,10 @@ from pathlib import Path
 from typing import Tuple, List, Optional, Dict
 
 import aiofiles
-from async_lru import alru_cache
 
+from core.search.index import SearchIndex
 from core.search.models import WeaponEntry, BaseEntry, WeaponsEntry, StrategyEntry, StrategyEntryList
+from utils.cache import TTLCache
 from utils.const import PROJECT_ROOT
 
 ENTRY_DAYA_PATH = PROJECT_ROOT.joinpath("data", "entry")
@@ -20,8 +21,11 @@ ENTRY_DAYA_PATH.mkdir(parents=True, exist_ok=True)
 class SearchServices:
     def __init__(self):
         self._lock = asyncio.Lock()  # 访问和修改操作成员变量必须加锁操作
-        self.weapons: List[WeaponEntry] = []
-        self.strategy: List[StrategyEntry] = []
+        self.weapons: Dict[str, WeaponEntry] = {}
+        self.strategy: Dict[str, StrategyEntry] = {}
+        self._index = SearchIndex()
+        # 搜索结果缓存，条目发生任何变化时清空
+        self._search_cache: TTLCache[Tuple[str, int], Tuple[BaseEntry, ...]] = TTLCache(ttl=24 * 60 * 60, maxsize=1024)
         self.entry_data_path: Path = ENTRY_DAYA_PATH
         self.weapons_entry_data_path = self.entry_data_path / "weapon.json"
         self.strategy_entry_data_path = self.entry_data_path / "strategy.json"
@@ -43,12 +47,14 @@ class SearchServices:
                 weapon_json = await self.load_json(self.weapons_entry_data_path)
                 weapons = WeaponsEntry.parse_obj(weapon_json)
                 for weapon in weapons.data:
-                    self.weapons.append(weapon.copy())
+                    self.weapons[weapon.key] = weapon.copy()
             if self.strategy_entry_data_path.exists():
                 strategy_json = await self.load_json(self.strategy_entry_data_path)
                 strategy = StrategyEntryList.parse_obj(strategy_json)
                 for strategy in strategy.data:
-                    self.strategy.append(strategy.copy())
+                    self.strategy[strategy.key] = strategy.copy()
+            self._index.extend(itertools.chain(self.weapons.values(), self.strategy.values()))
+            self._search_cache.clear()
 
     async def save_entry(self) -> None:
         """保存条目
@@ -56,10 +62,10 @@ class SearchServices:
         """
         async with self._lock:
             if len(self.weapons) > 0:
-                weapons = WeaponsEntry(data=self.weapons)
+                weapons = WeaponsEntry(data=list(self.weapons.values()))
                 await self.save_json(self.weapons_entry_data_path, weapons.json())
             if len(self.strategy) > 0:
-                strategy = StrategyEntryList(data=self.strategy)
+                strategy = StrategyEntryList(data=list(self.strategy.values()))
                 await self.save_json(self.strategy_entry_data_path, strategy.json())
 
     async def add_entry(self, entry: BaseEntry, update: bool = False, ttl: int = 3600):
@@ -74,42 +80,40 @@ class SearchServices:
             if replace_time and replace_time <= time.time() + ttl:
                 return
             if isinstance(entry, WeaponEntry):
-                for index, value in enumerate(self.weapons):
-                    if value.key == entry.key:
-                        if update:
-                            self.replace_time[entry.key] = time.time()
-                            self.weapons[index] = entry
-                        break
-                else:
-                    self.weapons.append(entry)
+                entries = self.weapons
             elif isinstance(entry, StrategyEntry):
-                for index, value in enumerate(self.strategy):
-                    if value.key == entry.key:
-                        if update:
-                            self.replace_time[entry.key] = time.time()
-                            self.strategy[index] = entry
-                        break
-                else:
-                    self.strategy.append(entry)
+                entries = self.strategy
+            else:
+                return
+            if entry.key in entries:
+                if not update:
+                    return
+                self.replace_time[entry.key] = time.time()
+            entries[entry.key] = entry
+            self._index.add(entry)
+            self._search_cache.clear()
 
     async def remove_all_entry(self):
         """移除全部条目
         :return: None
         """
         async with self._lock:
-            self.weapons = []
+            self.weapons = {}
             if self.weapons_entry_data_path.exists():
                 os.remove(self.weapons_entry_data_path)
-            self.strategy = []
+            self.strategy = {}
             if self.strategy_entry_data_path.exists():
                 os.remove(self.strategy_entry_data_path)
+            self._index.clear()
+            self._search_cache.clear()
 
     @staticmethod
     def _sort_key(entry: BaseEntry, search_query: str) -> float:
         return entry.compare_to_query(search_query)
 
-    @alru_cache(maxsize=64)
-    async def multi_search_combinations(self, search_queries: Tuple[str], results_per_query: int = 3):
+    async def multi_search_combinations(
+        self, search_queries: Tuple[str, ...], results_per_query: int = 3
+    ) -> Dict[str, Tuple[BaseEntry, ...]]:
         """多个关键词搜索
         :param search_queries: 搜索文本
         :param results_per_query: 约定返回的数目
@@ -120,29 +124,48 @@ class SearchServices:
         for query in effective_queries:
             if res := await self.search(search_query=query, amount=results_per_query):
                 results[query] = res
+        return results
 
-    @alru_cache(maxsize=64)
-    async def search(self, search_query: Optional[str], amount: int = None) -> Optional[List[BaseEntry]]:
+    async def search(self, search_query: Optional[str], amount: int = None) -> Tuple[BaseEntry, ...]:
         """在所有可用条目中搜索适当的结果
         :param search_query: 搜索文本
         :param amount: 约定返回的数目
         :return: 搜索结果
         """
-        # search_entries: Iterable[BaseEntry] = []
+        key = (search_query or "", amount or 0)
+        if (result := self._search_cache.get(key)) is not None:
+            return result
         async with self._lock:
-            search_entries = itertools.chain(self.weapons, self.strategy)
-
-            if not search_query:
-                return search_entries if isinstance(search_entries, list) else list(search_entries)
-
-            if not amount:
-                return sorted(
-                    search_entries,
-                    key=lambda entry: self._sort_key(entry, search_query),  # type: ignore
-                    reverse=True,
-                )
-            return heapq.nlargest(
-                amount,
+            generation = self._search_cache.generation
+            result = tuple(self._search(search_query, amount))
+            self._search_cache.set(key, result, generation)
+        return result
+
+    def _search(self, search_query: Optional[str], amount: Optional[int]) -> List[BaseEntry]:
+        if not search_query:
+            return self._index.values()
+
+        # 只对索引选出的候选条目计算分数，需要的数目超过候选数量上限时扩大候选范围
+        search_entries = self._index.candidates(search_query, amount)
+        if not amount:
+            return sorted(
                 search_entries,
-                key=lambda entry: self._sort_key(entry, search_query),  # type: ignore[arg-type]
+                key=lambda entry: self._sort_key(entry, search_query),  # type: ignore
+                reverse=True,
             )
+        return heapq.nlargest(
+            amount,
+            search_entries,
+            key=lambda entry: self._sort_key(entry, search_query),  # type: ignore[arg-type]
+        )
+
+    def get_cache_statistics(self) -> Dict[str, float]:
+        """搜索结果缓存的统计信息"""
+        cache = self._search_cache
+        total = cache.hits + cache.misses
+        return {
+            "size": len(cache),
+            "hits": cache.hits,
+            "misses": cache.misses,
+            "hit_rate": cache.hits / total if total else 0.0,
+        }
@@ -1,10 +1,13 @@
-from typing import List, Optional, cast
+from typing import AsyncIterator, Collection, List, Optional, Tuple, cast
 
-from sqlalchemy import select
+from sqlalchemy import func, or_, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from core.base.mysql import MySQL
-from .models import Sign
+from core.cookies.models import Cookies, HoyolabCookie, HyperionCookie
+from core.user.models import User
+from utils.models.base import RegionEnum
+from .models import Sign, SignStatusEnum
 
 
 class SignRepository:
@@ -30,6 +33,12 @@ class SignRepository:
             await session.commit()
             await session.refresh(sign)
 
+    async def update_many(self, signs: List[Sign]):
+        async with self.mysql.Session() as session:
+            session = cast(AsyncSession, session)
+            session.add_all(signs)
+            await session.commit()
+
     async def get_by_user_id(self, user_id: int) -> Optional[Sign]:
         async with self.mysql.Session() as session:
             session = cast(AsyncSession, session)
@@ -51,3 +60,55 @@ class SignRepository:
             results = await session.exec(query)
             signs = results.all()
             return [sign[0] for sign in signs]
+
+    @staticmethod
+    def _status_filter(statuses: Collection[Optional[SignStatusEnum]]):
+        condition = Sign.status.in_([status for status in statuses if status is not None])
+        if None in statuses:
+            condition = or_(condition, Sign.status.is_(None))
+        return condition
+
+    async def count(self, statuses: Optional[Collection[Optional[SignStatusEnum]]] = None) -> int:
+        async with self.mysql.Session() as session:
+            session = cast(AsyncSession, session)
+            # 与 iter_with_accounts 一致，不统计没有用户信息的记录
+            statement = select(func.count(Sign.id)).join(User, User.user_id == Sign.user_id)
+            if statuses is not None:
+                statement = statement.where(self._status_filter(statuses))
+            results = await session.execute(statement)
+            return results.scalar_one()
+
+    async def iter_with_accounts(
+        self, statuses: Optional[Collection[Optional[SignStatusEnum]]] = None, page_size: int = 1000
+    ) -> AsyncIterator[List[Tuple[Sign, User, Optional[Cookies]]]]:
+        """分页读取签到记录，每条记录与用户信息、用户所在服务器的Cookies在同一个查询中取出
+        :param statuses: 只读取这些状态的记录，None 表示未签到过的记录
+        :param page_size: 每页的数量
+        :return: 每次返回一页 (签到记录, 用户信息, Cookies)
+        """
+        last_id = 0
+        while True:
+            async with self.mysql.Session() as session:
+                session = cast(AsyncSession, session)
+                statement = (
+                    select(Sign, User, HyperionCookie, HoyolabCookie)
+                    .join(User, User.user_id == Sign.user_id)
+                    .outerjoin(HyperionCookie, HyperionCookie.user_id == Sign.user_id)
+                    .outerjoin(HoyolabCookie, HoyolabCookie.user_id == Sign.user_id)
+                    .where(Sign.id > last_id)
+                    .order_by(Sign.id)
+                    .limit(page_size)
+                )
+                if statuses is not None:
+                    statement = statement.where(self._status_filter(statuses))
+                results = await session.execute(statement)
+                rows = results.all()
+            if not rows:
+                return
+            last_id = rows[-1][0].id
+            yield [
+                (sign, user, hyperion_cookies if user.region == RegionEnum.HYPERION else hoyolab_cookies)
+                for sign, user, hyperion_cookies, hoyolab_cookies in rows
+            ]
+            if len(rows) < page_size:
+                return
@@ -1,4 +1,8 @@
-from .models import Sign
+from typing import AsyncIterator, Collection, List, Optional, Tuple
+
+from core.cookies.models import Cookies
+from core.user.models import User
+from .models import Sign, SignStatusEnum
 from .repositories import SignRepository
 
 
@@ -9,6 +13,14 @@ class SignServices:
     async def get_all(self):
         return await self._repository.get_all()
 
+    async def count(self, statuses: Optional[Collection[Optional[SignStatusEnum]]] = None) -> int:
+        return await self._repository.count(statuses)
+
+    def iter_with_accounts(
+        self, statuses: Optional[Collection[Optional[SignStatusEnum]]] = None, page_size: int = 1000
+    ) -> AsyncIterator[List[Tuple[Sign, User, Optional[Cookies]]]]:
+        return self._repository.iter_with_accounts(statuses, page_size)
+
     async def add(self, sign: Sign):
         return await self._repository.add(sign)
 
@@ -18,6 +30,9 @@ class SignServices:
     async def update(self, sign: Sign):
         return await self._repository.update(sign)
 
+    async def update_many(self, signs: List[Sign]):
+        return await self._repository.update_many(signs)
+
     async def get_by_user_id(self, user_id: int):
         return await self._repository.get_by_user_id(user_id)
 
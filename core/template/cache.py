@@ -1,7 +1,14 @@
 import gzip
 import pickle  # nosec B403
+from collections import OrderedDict
+from datetime import date, datetime, time
+from enum import Enum
 from hashlib import sha256
-from typing import Any, Optional
+from pathlib import PurePath
+from typing import Any, Dict, Optional, Tuple
+
+import ujson as json
+from pydantic import BaseModel
 
 from core.base.redisdb import RedisDB
 
@@ -50,3 +57,125 @@ class HtmlToFileIdCache:
     def cache_key(self, html: str, file_type: str) -> str:
         key = sha256(html.encode()).hexdigest()
         return f"{self.qname}:{file_type}:{key}"
+
+
+def _canonicalize(data: Any) -> Any:
+    """将模板数据转换为可稳定序列化的结构，无法转换时抛出 TypeError"""
+    if data is None or isinstance(data, (str, int, float, bool)):
+        return data
+    if isinstance(data, bytes):
+        return sha256(data).hexdigest()
+    if isinstance(data, dict):
+        return {str(key): _canonicalize(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [_canonicalize(value) for value in data]
+    if isinstance(data, (set, frozenset)):
+        return sorted((_canonicalize(value) for value in data), key=repr)
+    if isinstance(data, BaseModel):
+        return _canonicalize(data.dict())
+    if isinstance(data, Enum):
+        return _canonicalize(data.value)
+    if isinstance(data, (datetime, date, time)):
+        return data.isoformat()
+    if isinstance(data, PurePath):
+        return str(data)
+    raise TypeError(f"无法序列化类型 {type(data).__name__}")
+
+
+class RenderResultCache:
+    """模板渲染结果的缓存
+
+    第一级为进程内按字节数限制大小的 LRU，第二级为 Redis。缓存键由模板名、模板数据与截图参数计算得出，
+    命中时可以跳过 jinja2 渲染与浏览器截图。
+
+    :param max_bytes: 进程内缓存的总大小上限
+    :param max_item_bytes: 进程内缓存单个结果的大小上限
+    :param max_redis_item_bytes: Redis 中单个结果的大小上限，较大的结果只缓存在进程内
+    """
+
+    def __init__(
+        self,
+        redis: RedisDB,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_item_bytes: int = 8 * 1024 * 1024,
+        max_redis_item_bytes: int = 1024 * 1024,
+    ):
+        self.client = redis.client
+        self.qname = "bot:template:render-result"
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self.max_redis_item_bytes = max_redis_item_bytes
+        self._lru: "OrderedDict[str, Tuple[str, bytes]]" = OrderedDict()
+        self._size = 0
+        self.memory_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def render_key(template_name: str, template_data: dict, **options: Any) -> Optional[str]:
+        """计算渲染结果的缓存键，模板数据无法序列化时返回 None 表示不缓存"""
+        try:
+            payload = json.dumps(
+                [template_name, _canonicalize(template_data), _canonicalize(options)],
+                sort_keys=True,
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+        except (TypeError, ValueError):
+            return None
+        return sha256(payload.encode()).hexdigest()
+
+    def cache_key(self, key: str) -> str:
+        return f"{self.qname}:{key}"
+
+    def _put_memory(self, key: str, html: str, png: bytes):
+        size = len(html) + len(png)
+        if size > self.max_item_bytes:
+            return
+        old = self._lru.pop(key, None)
+        if old is not None:
+            self._size -= len(old[0]) + len(old[1])
+        self._lru[key] = (html, png)
+        self._size += size
+        while self._size > self.max_bytes and self._lru:
+            _, (old_html, old_png) = self._lru.popitem(last=False)
+            self._size -= len(old_html) + len(old_png)
+
+    async def get_data(self, key: str) -> Optional[Tuple[str, bytes]]:
+        """获取缓存的 html 与图片"""
+        data = self._lru.get(key)
+        if data is not None:
+            self._lru.move_to_end(key)
+            self.memory_hits += 1
+            return data
+        html, png = await self.client.hmget(self.cache_key(key), "html", "png")
+        if html is None or png is None:
+            self.misses += 1
+            return None
+        self.redis_hits += 1
+        html = gzip.decompress(html).decode()
+        self._put_memory(key, html, png)
+        return html, png
+
+    async def set_data(self, key: str, html: str, png: bytes, ttl: int = 24 * 60 * 60):
+        """缓存 html 与图片"""
+        if len(html) + len(png) > self.max_item_bytes:
+            return
+        self._put_memory(key, html, png)
+        html_data = gzip.compress(html.encode())
+        if len(html_data) + len(png) > self.max_redis_item_bytes:
+            return
+        ck = self.cache_key(key)
+        await self.client.hset(ck, mapping={"html": html_data, "png": png})
+        if ttl != -1:
+            await self.client.expire(ck, ttl)
+
+    def statistics(self) -> Dict[str, int]:
+        """缓存命中情况"""
+        return {
+            "memory_hits": self.memory_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "items": len(self._lru),
+            "bytes": self._size,
+        }
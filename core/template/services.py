@@ -1,3 +1,4 @@
+import os
 import time
 from typing import Optional
 from urllib.parse import (
@@ -25,6 +26,7 @@ from core.base.webserver import webapp
 from core.bot import bot
 from core.template.cache import (
     HtmlToFileIdCache,
+    RenderResultCache,
     TemplatePreviewCache,
 )
 from core.template.error import QuerySelectorNotFound
@@ -35,6 +37,9 @@ from core.template.models import (
 from utils.const import PROJECT_ROOT
 from utils.log import logger
 
+# 模板引用的 html、css 与 js，修改后渲染结果缓存失效
+TEMPLATE_SOURCE_SUFFIXES = (".html", ".css", ".js")
+
 
 class TemplateService:
     def __init__(
@@ -42,6 +47,7 @@ class TemplateService:
         browser: AioBrowser,
         html_to_file_id_cache: HtmlToFileIdCache,
         preview_cache: TemplatePreviewCache,
+        render_result_cache: Optional[RenderResultCache] = None,
         template_dir: str = "resources",
     ):
         self._browser = browser
@@ -57,10 +63,25 @@ class TemplateService:
         self.previewer = TemplatePreviewer(self, preview_cache)
 
         self.html_to_file_id_cache = html_to_file_id_cache
+        self.render_result_cache = render_result_cache
+        # 非调试模式下 jinja2 不会重新加载修改后的模板，模板文件的版本同样只在启动时统计一次
+        self.template_version = self._scan_template_version()
 
     def get_template(self, template_name: str) -> Template:
         return self._jinja2_env.get_template(template_name)
 
+    def _scan_template_version(self) -> int:
+        """模板文件夹中 html、css 与 js 的最新修改时间
+
+        模板会 include 其他模板、引用其他文件夹的样式，只用模板文件本身的修改时间不能让缓存失效。
+        """
+        version = 0
+        for root, _, files in os.walk(self.template_dir):
+            for name in files:
+                if name.endswith(TEMPLATE_SOURCE_SUFFIXES):
+                    version = max(version, os.stat(os.path.join(root, name)).st_mtime_ns)
+        return version
+
     async def render_async(self, template_name: str, template_data: dict) -> str:
         """模板渲染
         :param template_name: 模板文件名
@@ -107,8 +128,24 @@ class TemplateService:
             preview_url = await self.previewer.get_preview_url(template_name, template_data)
             logger.debug(f"调试模板 URL: {preview_url}")
 
-        html = await template.render_async(**template_data)
-        logger.debug(f"{template_name} 模板渲染使用了 {str(time.time() - start_time)}")
+        render_key = None
+        png_data = None
+        if self.render_result_cache is not None and not bot.config.debug:
+            render_key = self.render_result_cache.render_key(
+                template_name,
+                template_data,
+                template_version=self.template_version,
+                viewport=viewport,
+                full_page=full_page,
+                evaluate=evaluate,
+                query_selector=query_selector,
+            )
+        if render_key is not None and (cached := await self.render_result_cache.get_data(render_key)):
+            html, png_data = cached
+            logger.debug(f"{template_name} 命中渲染结果缓存")
+        else:
+            html = await template.render_async(**template_data)
+            logger.debug(f"{template_name} 模板渲染使用了 {str(time.time() - start_time)}")
 
         file_id = await self.html_to_file_id_cache.get_data(html, file_type.name)
         if file_id and not bot.config.debug:
@@ -124,28 +161,40 @@ class TemplateService:
                 filename=filename,
             )
 
-        browser = await self._browser.get_browser()
+        if png_data is not None:
+            return RenderResult(
+                html=html,
+                photo=png_data,
+                file_type=file_type,
+                cache=self.html_to_file_id_cache,
+                ttl=ttl,
+                caption=caption,
+                parse_mode=parse_mode,
+                filename=filename,
+            )
+
         start_time = time.time()
-        page = await browser.new_page(viewport=viewport)
-        uri = (PROJECT_ROOT / template.filename).as_uri()
-        await page.goto(uri)
-        await page.set_content(html, wait_until="networkidle")
-        if evaluate:
-            await page.evaluate(evaluate)
-        clip = None
-        if query_selector:
-            try:
-                card = await page.query_selector(query_selector)
-                if not card:
-                    raise QuerySelectorNotFound
-                clip = await card.bounding_box()
-                if not clip:
-                    raise QuerySelectorNotFound
-            except QuerySelectorNotFound:
-                logger.warning(f"未找到 {query_selector} 元素")
-        png_data = await page.screenshot(clip=clip, full_page=full_page)
-        await page.close()
+        async with self._browser.page(viewport) as page:
+            uri = (PROJECT_ROOT / template.filename).as_uri()
+            await page.goto(uri)
+            await page.set_content(html, wait_until="networkidle")
+            if evaluate:
+                await page.evaluate(evaluate)
+            clip = None
+            if query_selector:
+                try:
+                    card = await page.query_selector(query_selector)
+                    if not card:
+                        raise QuerySelectorNotFound
+                    clip = await card.bounding_box()
+                    if not clip:
+                        raise QuerySelectorNotFound
+                except QuerySelectorNotFound:
+                    logger.warning(f"未找到 {query_selector} 元素")
+            png_data = await page.screenshot(clip=clip, full_page=full_page)
         logger.debug(f"{template_name} 图片渲染使用了 {str(time.time() - start_time)}")
+        if render_key is not None:
+            await self.render_result_cache.set_data(render_key, html, png_data, ttl)
         return RenderResult(
             html=html,
             photo=png_data,
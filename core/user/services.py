@@ -1,3 +1,4 @@
+from utils.cache import TTLCache
 from .models import User
 from .repositories import UserRepository
 
@@ -5,19 +6,35 @@ from .repositories import UserRepository
 class UserService:
     def __init__(self, user_repository: UserRepository) -> None:
         self._repository: UserRepository = user_repository
+        # 几乎每个命令都需要读取用户信息，修改时使缓存失效
+        self._cache: TTLCache[int, User] = TTLCache(ttl=10 * 60, maxsize=4096)
 
     async def get_user_by_id(self, user_id: int) -> User:
-        """从数据库获取用户信息
+        """从数据库获取用户信息，短时间内再次获取时使用缓存
         :param user_id:用户ID
         :return: User
         """
-        return await self._repository.get_by_user_id(user_id)
+        if (user := self._cache.get(user_id)) is not None:
+            return user
+        generation = self._cache.generation
+        user = await self._repository.get_by_user_id(user_id)
+        self._cache.set(user_id, user, generation)
+        return user
 
     async def del_user_by_id(self, user_id: int) -> User:
-        return await self._repository.del_user_by_id(user_id)
+        try:
+            return await self._repository.del_user_by_id(user_id)
+        finally:
+            self._cache.pop(user_id)
 
     async def update_user(self, user: User) -> User:
-        return await self._repository.update_user(user)
+        try:
+            return await self._repository.update_user(user)
+        finally:
+            self._cache.pop(user.user_id)
 
     async def add_user(self, user: User) -> User:
-        return await self._repository.add_user(user)
+        try:
+            return await self._repository.add_user(user)
+        finally:
+            self._cache.pop(user.user_id)
@@ -1,3 +1,5 @@
+from typing import Dict, Tuple, Union
+
 import ujson as json
 
 from core.base.redisdb import RedisDB
@@ -32,3 +34,51 @@ class WikiCache:
             for num, item in enumerate(result):
                 result[num] = json.loads(item)
         return result
+
+    async def set_entries(self, key: str, entries: Dict[str, str], names: Dict[str, str]):
+        """保存条目，每个条目以 JSON 文本保存在 Hash 中，条目名称另存一份用于建立索引
+        :param key: 条目类型
+        :param entries: ID 与条目 JSON 文本
+        :param names: ID 与条目名称
+        """
+        data_qname = f"{self.qname}:{key}:data"
+        names_qname = f"{self.qname}:{key}:names"
+        async with self.client.pipeline(transaction=True) as pipe:
+            await pipe.delete(data_qname, names_qname)
+            if entries:
+                await pipe.hset(data_qname, mapping=entries)
+                await pipe.hset(names_qname, mapping=names)
+            await pipe.execute()
+
+    async def get_entries(self, key: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+        """读取条目，没有新格式的数据时转换旧格式的数据
+        :param key: 条目类型
+        :return: ID 与条目 JSON 文本，ID 与条目名称
+        """
+        data_qname = f"{self.qname}:{key}:data"
+        names_qname = f"{self.qname}:{key}:names"
+        async with self.client.pipeline(transaction=True) as pipe:
+            await pipe.hgetall(data_qname)
+            await pipe.hgetall(names_qname)
+            data, names = await pipe.execute()
+        entries = {_decode(id_): _decode(value) for id_, value in data.items()}
+        names = {_decode(id_): _decode(value) for id_, value in names.items()}
+        if not entries:
+            entries, names = await self._migrate(key)
+        return entries, names
+
+    async def _migrate(self, key: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+        """旧格式的数据是由条目 JSON 文本组成的 JSON 列表"""
+        entries, names = {}, {}
+        for raw in await self.get(key):
+            item = json.loads(raw) if isinstance(raw, str) else raw
+            entries[item["id"]] = json.dumps(item, ensure_ascii=False)
+            names[item["id"]] = item["name"]
+        if entries:
+            await self.set_entries(key, entries, names)
+            await self.delete(key)
+        return entries, names
+
+
+def _decode(value: Union[bytes, str]) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
@@ -1,20 +1,30 @@
 from typing import List, NoReturn, Optional
 
 from core.wiki.cache import WikiCache
+from core.wiki.store import WikiStore
+from metadata.shortname import roles, weapons
+from modules.wiki.base import PageCache, WikiModel
 from modules.wiki.character import Character
 from modules.wiki.weapon import Weapon
+from utils.const import PROJECT_ROOT
 from utils.log import logger
 
+WIKI_PAGE_CACHE_PATH = PROJECT_ROOT.joinpath("data", "wiki")
+
 
 class WikiService:
     def __init__(self, cache: WikiCache):
         self._cache = cache
         """Redis 在这里的作用是作为持久化"""
-        self._character_list = []
-        self._character_name_list = []
-        self._weapon_name_list = []
-        self._weapon_list = []
+        self._characters: WikiStore[Character] = WikiStore(Character)
+        self._weapons: WikiStore[Weapon] = WikiStore(Weapon)
         self.first_run = True
+        if WikiModel.page_cache is None:
+            WikiModel.page_cache = PageCache(WIKI_PAGE_CACHE_PATH)
+
+    def _add_aliases(self):
+        self._weapons.add_aliases(weapons)
+        self._characters.add_aliases({value[0]: value[1:] for value in roles.values()})
 
     async def refresh_weapon(self) -> NoReturn:
         weapon_name_list = await Weapon.get_name_list()
@@ -29,9 +39,9 @@ class WikiService:
                 logger.info(f"现在已经获取到 {num} 把武器信息")
 
         logger.info("写入武器信息到Redis")
-        self._weapon_list = weapon_list
-        await self._cache.delete("weapon")
-        await self._cache.set("weapon", [i.json() for i in weapon_list])
+        self._weapons.load_models(weapon_list)
+        self._weapons.add_aliases(weapons)
+        await self._cache.set_entries("weapon", self._weapons.dump(), {i.id: i.name for i in weapon_list})
 
     async def refresh_characters(self) -> NoReturn:
         character_name_list = await Character.get_name_list()
@@ -46,55 +56,76 @@ class WikiService:
                 logger.info(f"现在已经获取到 {num} 个角色信息")
 
         logger.info("写入角色信息到Redis")
-        self._character_list = character_list
-        await self._cache.delete("characters")
-        await self._cache.set("characters", [i.json() for i in character_list])
+        self._characters.load_models(character_list)
+        self._characters.add_aliases({value[0]: value[1:] for value in roles.values()})
+        await self._cache.set_entries("characters", self._characters.dump(), {i.id: i.name for i in character_list})
 
-    async def refresh_wiki(self) -> NoReturn:
+    async def refresh_wiki(self, offline: bool = False) -> NoReturn:
         """
-        用于把Redis的缓存全部加载进Python
+        重新爬取Wiki并写入Redis，没有变化的页面会跳过解析
+        :param offline: 只使用本地的页面缓存，不发起请求
         :return:
         """
-        logger.info("正在重新获取Wiki")
-        logger.info("正在重新获取武器信息")
-        await self.refresh_weapon()
-        logger.info("正在重新获取角色信息")
-        await self.refresh_characters()
+        logger.info("正在重新获取Wiki%s", "（离线）" if offline else "")
+        WikiModel.offline = offline
+        try:
+            logger.info("正在重新获取武器信息")
+            await self.refresh_weapon()
+            logger.info("正在重新获取角色信息")
+            await self.refresh_characters()
+        finally:
+            WikiModel.offline = False
+            WikiModel.clear_parsed()
         logger.info("刷新成功")
 
     async def init(self) -> NoReturn:
         """
-        用于把Redis的缓存全部加载进Python
+        用于把Redis的缓存全部加载进Python，条目在第一次读取时才会解析
         :return:
         """
         if self.first_run:
-            weapon_dict = await self._cache.get("weapon")
-            self._weapon_list = [Weapon.parse_obj(obj) for obj in weapon_dict]
-            self._weapon_name_list = [weapon.name for weapon in self._weapon_list]
-            characters_dict = await self._cache.get("characters")
-            self._character_list = [Character.parse_obj(obj) for obj in characters_dict]
-            self._character_name_list = [character.name for character in self._character_list]
-
+            self._weapons.load(*await self._cache.get_entries("weapon"))
+            self._characters.load(*await self._cache.get_entries("characters"))
+            self._add_aliases()
+            logger.debug("Wiki 武器内存占用 %s", self._weapons.memory_usage())
+            logger.debug("Wiki 角色内存占用 %s", self._characters.memory_usage())
             self.first_run = False
 
     async def get_weapons(self, name: str) -> Optional[Weapon]:
+        """通过名称或简称获取武器"""
         await self.init()
-        if len(self._weapon_list) == 0:
-            return None
-        return next((weapon for weapon in self._weapon_list if weapon.name == name), None)
+        return self._weapons.get_by_name(name)
+
+    async def get_weapons_by_id(self, id_: str) -> Optional[Weapon]:
+        await self.init()
+        return self._weapons.get_by_id(id_)
 
     async def get_weapons_name_list(self) -> List[str]:
         await self.init()
-        return self._weapon_name_list
+        return self._weapons.names()
 
     async def get_weapons_list(self) -> List[Weapon]:
         await self.init()
-        return self._weapon_list
+        return self._weapons.values()
+
+    async def get_characters(self, name: str) -> Optional[Character]:
+        """通过名称或简称获取角色"""
+        await self.init()
+        return self._characters.get_by_name(name)
+
+    async def get_characters_by_id(self, id_: str) -> Optional[Character]:
+        await self.init()
+        return self._characters.get_by_id(id_)
 
     async def get_characters_list(self) -> List[Character]:
         await self.init()
-        return self._character_list
+        return self._characters.values()
 
     async def get_characters_name_list(self) -> List[str]:
         await self.init()
-        return self._character_name_list
+        return self._characters.names()
+
+    async def get_memory_usage(self) -> dict:
+        """Wiki 数据的内存占用"""
+        await self.init()
+        return {"weapon": self._weapons.memory_usage(), "characters": self._characters.memory_usage()}
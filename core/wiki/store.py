@@ -0,0 +1,96 @@
+import sys
+from typing import Dict, Generic, Iterable, List, Optional, Type, TypeVar
+
+from modules.wiki.base import WikiModel
+
+__all__ = ("WikiStore",)
+
+T = TypeVar("T", bound=WikiModel)
+
+
+class WikiStore(Generic[T]):
+    """Wiki 条目的内存存储
+
+    条目以 JSON 文本保存，按名称、ID 与简称建立索引，第一次读取某个条目时才解析为对应的 Model
+
+    :param model: 条目的类型
+    """
+
+    def __init__(self, model: Type[T]):
+        self.model = model
+        self._raw: Dict[str, str] = {}
+        self._models: Dict[str, T] = {}
+        self._names: Dict[str, str] = {}
+        self._by_name: Dict[str, str] = {}
+        self._by_alias: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._raw)
+
+    def load(self, entries: Dict[str, str], names: Dict[str, str]):
+        """加载条目
+        :param entries: ID 与条目 JSON 文本
+        :param names: ID 与条目名称
+        """
+        self._raw = dict(entries)
+        self._models = {}
+        self._names = {id_: names[id_] for id_ in self._raw if id_ in names}
+        self._by_name = {name: id_ for id_, name in self._names.items()}
+        self._by_alias = {}
+
+    def load_models(self, models: Iterable[T]):
+        """使用已经解析的 Model 加载条目"""
+        models = list(models)
+        self.load({model.id: model.json() for model in models}, {model.id: model.name for model in models})
+        self._models = {model.id: model for model in models}
+
+    def add_aliases(self, aliases: Dict[str, Iterable[str]]):
+        """添加简称
+        :param aliases: 条目名称与对应的简称
+        """
+        for name, names in aliases.items():
+            if (id_ := self._by_name.get(name)) is None:
+                continue
+            for alias in names:
+                self._by_alias.setdefault(str.casefold(alias), id_)
+
+    def _hydrate(self, id_: str) -> Optional[T]:
+        if (model := self._models.get(id_)) is not None:
+            return model
+        if (raw := self._raw.get(id_)) is None:
+            return None
+        model = self._models[id_] = self.model.parse_raw(raw)
+        return model
+
+    def get_by_id(self, id_: str) -> Optional[T]:
+        return self._hydrate(id_)
+
+    def get_by_name(self, name: str) -> Optional[T]:
+        """通过名称或简称获取条目"""
+        id_ = self._by_name.get(name)
+        if id_ is None:
+            id_ = self._by_alias.get(str.casefold(name))
+        return None if id_ is None else self._hydrate(id_)
+
+    def names(self) -> List[str]:
+        return list(self._names.values())
+
+    def values(self) -> List[T]:
+        return [self._hydrate(id_) for id_ in self._raw]
+
+    def dump(self) -> Dict[str, str]:
+        """ID 与条目 JSON 文本，用于持久化"""
+        return self._raw
+
+    def memory_usage(self) -> Dict[str, int]:
+        """内存占用的统计，单位为字节，已解析条目的大小只计算 Model 本身"""
+        return {
+            "entries": len(self._raw),
+            "hydrated": len(self._models),
+            "raw_bytes": sum(sys.getsizeof(raw) for raw in self._raw.values()),
+            "index_bytes": sum(
+                sys.getsizeof(index) + sum(sys.getsizeof(key) for key in index)
+                for index in (self._names, self._by_name, self._by_alias)
+            ),
+            "hydrated_bytes": sum(sys.getsizeof(model.__dict__) for model in self._models.values()),
+        }
@@ -1,10 +1,10 @@
 from enum import Enum
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 from modules.gacha.error import GachaIllegalArgument
-from modules.gacha.utils import lerp
+from modules.gacha.utils import lerp, lerp_table, set_subtract
 
 
 class BannerType(Enum):
@@ -49,6 +49,13 @@ class GachaBanner(BaseModel):
     fallback_items4_pool1: List[int] = []  # 基础四星角色
     fallback_items4_pool2: List[int] = []  # 基础四星武器
     auto_strip_rate_up_from_fallback: bool = True
+    _compiled: Optional["CompiledBanner"] = PrivateAttr(None)
+
+    def compile(self) -> "CompiledBanner":
+        """编译卡池，结果会被缓存，编译后不应再修改卡池"""
+        if self._compiled is None:
+            self._compiled = CompiledBanner.from_banner(self)
+        return self._compiled
 
     def get_weight(self, rarity: int, pity: int) -> int:
         if rarity == 4:
@@ -78,3 +85,97 @@ class GachaBanner(BaseModel):
             return lerp(pity, self.pool_balance_weights5)
         else:
             raise GachaIllegalArgument
+
+
+class CompiledBanner(BaseModel):
+    """编译后的卡池
+
+    权重按保底计数展开为数组，查表即可得到权重；各卡池的物品为不可变的元组，并已去除 UP 物品。
+    同一个卡池的所有玩家共用一个编译结果。
+    """
+
+    banner_type: BannerType
+    wish_max_progress: int
+    weight4: Tuple[int, ...]
+    weight5: Tuple[int, ...]
+    pool_balance_weights4: Tuple[int, ...]
+    pool_balance_weights5: Tuple[int, ...]
+    event_chance4: int
+    event_chance5: int
+    event_chance: int
+    rate_up_items5: Tuple[int, ...]
+    fallback_items5_pool1: Tuple[int, ...]
+    fallback_items5_pool2: Tuple[int, ...]
+    rate_up_items4: Tuple[int, ...]
+    fallback_items4_pool1: Tuple[int, ...]
+    fallback_items4_pool2: Tuple[int, ...]
+    fallback_items3: Tuple[int, ...]
+
+    class Config:
+        frozen = True
+
+    @classmethod
+    def from_banner(cls, banner: GachaBanner) -> "CompiledBanner":
+        fallback_items5_pool1 = banner.fallback_items5_pool1
+        fallback_items5_pool2 = banner.fallback_items5_pool2
+        fallback_items4_pool1 = banner.fallback_items4_pool1
+        fallback_items4_pool2 = banner.fallback_items4_pool2
+        if banner.auto_strip_rate_up_from_fallback:  # 把UP物品从非UP物品中排除
+            fallback_items5_pool1 = set_subtract(fallback_items5_pool1, banner.rate_up_items5)
+            fallback_items5_pool2 = set_subtract(fallback_items5_pool2, banner.rate_up_items5)
+            fallback_items4_pool1 = set_subtract(fallback_items4_pool1, banner.rate_up_items4)
+            fallback_items4_pool2 = set_subtract(fallback_items4_pool2, banner.rate_up_items4)
+        return cls(
+            banner_type=banner.banner_type,
+            wish_max_progress=banner.wish_max_progress,
+            weight4=lerp_table(banner.weight4),
+            weight5=lerp_table(banner.weight5),
+            pool_balance_weights4=lerp_table(banner.pool_balance_weights4),
+            pool_balance_weights5=lerp_table(banner.pool_balance_weights5),
+            event_chance4=banner.event_chance4,
+            event_chance5=banner.event_chance5,
+            event_chance=banner.event_chance,
+            rate_up_items5=banner.rate_up_items5,
+            fallback_items5_pool1=fallback_items5_pool1,
+            fallback_items5_pool2=fallback_items5_pool2,
+            rate_up_items4=banner.rate_up_items4,
+            fallback_items4_pool1=fallback_items4_pool1,
+            fallback_items4_pool2=fallback_items4_pool2,
+            fallback_items3=banner.fallback_items3,
+        )
+
+    @staticmethod
+    def _lookup(table: Tuple[int, ...], pity: int) -> int:
+        return table[pity if pity < len(table) else -1]
+
+    def get_weight(self, rarity: int, pity: int) -> int:
+        if rarity == 4:
+            return self._lookup(self.weight4, pity)
+        elif rarity == 5:
+            return self._lookup(self.weight5, pity)
+        else:
+            raise GachaIllegalArgument
+
+    def has_epitomized(self):
+        return self.banner_type == BannerType.WEAPON
+
+    def get_event_chance(self, rarity: int) -> int:
+        if rarity == 4:
+            return self.event_chance4
+        elif rarity == 5:
+            return self.event_chance5
+        elif self.event_chance >= -1:
+            return self.event_chance
+        else:
+            raise GachaIllegalArgument
+
+    def get_pool_balance_weight(self, rarity: int, pity: int) -> int:
+        if rarity == 4:
+            return self._lookup(self.pool_balance_weights4, pity)
+        elif rarity == 5:
+            return self._lookup(self.pool_balance_weights5, pity)
+        else:
+            raise GachaIllegalArgument
+
+
+GachaBanner.update_forward_refs()
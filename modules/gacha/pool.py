@@ -1,27 +1,23 @@
-from typing import List
+from typing import Tuple
 
 from modules.gacha.banner import GachaBanner
-from modules.gacha.utils import set_subtract
 
 
 class BannerPool:
-    rate_up_items5: List[int] = []
-    fallback_items5_pool1: List[int] = []
-    fallback_items5_pool2: List[int] = []
-    rate_up_items4: List[int] = []
-    fallback_items4_pool1: List[int] = []
-    fallback_items4_pool2: List[int] = []
+    """卡池中各星级的物品，来自卡池的编译结果"""
 
-    def __init__(self, banner: GachaBanner):
-        self.rate_up_items4 = banner.rate_up_items4
-        self.rate_up_items5 = banner.rate_up_items5
-        self.fallback_items5_pool1 = banner.fallback_items5_pool1
-        self.fallback_items5_pool2 = banner.fallback_items5_pool2
-        self.fallback_items4_pool1 = banner.fallback_items4_pool1
-        self.fallback_items4_pool2 = banner.fallback_items4_pool2
+    rate_up_items5: Tuple[int, ...] = ()
+    fallback_items5_pool1: Tuple[int, ...] = ()
+    fallback_items5_pool2: Tuple[int, ...] = ()
+    rate_up_items4: Tuple[int, ...] = ()
+    fallback_items4_pool1: Tuple[int, ...] = ()
+    fallback_items4_pool2: Tuple[int, ...] = ()
 
-        if banner.auto_strip_rate_up_from_fallback:  # 把UP四星从非UP四星排除
-            self.fallback_items5_pool1 = set_subtract(banner.fallback_items5_pool1, banner.rate_up_items5)
-            self.fallback_items5_pool2 = set_subtract(banner.fallback_items5_pool2, banner.rate_up_items5)
-            self.fallback_items4_pool1 = set_subtract(banner.fallback_items4_pool1, banner.rate_up_items4)
-            self.fallback_items4_pool2 = set_subtract(banner.fallback_items4_pool2, banner.rate_up_items4)
+    def __init__(self, banner: GachaBanner):
+        compiled = banner.compile()
+        self.rate_up_items4 = compiled.rate_up_items4
+        self.rate_up_items5 = compiled.rate_up_items5
+        self.fallback_items5_pool1 = compiled.fallback_items5_pool1
+        self.fallback_items5_pool2 = compiled.fallback_items5_pool2
+        self.fallback_items4_pool1 = compiled.fallback_items4_pool1
+        self.fallback_items4_pool2 = compiled.fallback_items4_pool2
@@ -0,0 +1,242 @@
+"""抽卡模拟的批量计算
+
+`BannerSystem` 一次只模拟一位玩家的一抽，用于计算“抽到几命/几精需要多少抽”这类问题时太慢。
+这里用数组保存大量独立玩家的保底、UP 与定轨状态，每一步让所有玩家同时抽一次，
+抽卡规则与 `BannerSystem` 完全一致。
+"""
+from typing import Dict, Iterable, Optional, Sequence
+
+from modules.gacha.banner import BannerType, GachaBanner
+from modules.gacha.error import GachaException, GachaIllegalArgument
+from modules.gacha.player.banner import PlayerGachaBannerInfo
+from modules.gacha.system import BannerSystem
+
+try:
+    import numpy as np
+
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+__all__ = ("NUMPY_AVAILABLE", "GachaSimulation", "SimulationResult")
+
+# draw_roulette 的随机数上限，见 `BannerSystem.draw_roulette`
+ROULETTE_CUTOFF = 10000
+
+
+def _lookup(table: "np.ndarray", pity: "np.ndarray") -> "np.ndarray":
+    return table[np.minimum(pity, len(table) - 1)]
+
+
+class SimulationResult:
+    """模拟结果
+
+    :param pulls: 每位玩家达成目标所用的抽数，未达成时为 -1
+    :param max_pulls: 每位玩家最多抽卡的次数
+    """
+
+    def __init__(self, pulls: "np.ndarray", max_pulls: int):
+        self.pulls = pulls
+        self.max_pulls = max_pulls
+
+    @property
+    def players(self) -> int:
+        return len(self.pulls)
+
+    @property
+    def completed(self) -> "np.ndarray":
+        return self.pulls[self.pulls >= 0]
+
+    @property
+    def success_rate(self) -> float:
+        """在 max_pulls 抽内达成目标的比例"""
+        return len(self.completed) / self.players if self.players else 0.0
+
+    @property
+    def mean(self) -> float:
+        """达成目标的玩家平均所用抽数"""
+        return float(self.completed.mean()) if len(self.completed) else 0.0
+
+    def percentiles(self, q: Iterable[float] = (10, 25, 50, 75, 90, 99)) -> Dict[float, int]:
+        """所用抽数的分位数，未达成目标的玩家按 max_pulls + 1 计算"""
+        pulls = np.where(self.pulls >= 0, self.pulls, self.max_pulls + 1)
+        q = list(q)
+        return dict(zip(q, np.percentile(pulls, q, method="higher").astype(int).tolist()))
+
+    def probability_within(self, pulls: int) -> float:
+        """在指定抽数内达成目标的概率"""
+        return float(np.count_nonzero((self.pulls >= 0) & (self.pulls <= pulls))) / self.players
+
+    def histogram(self, bin_size: int = 10) -> Dict[int, int]:
+        """按抽数分组统计达成目标的人数，键为每组的起始抽数"""
+        bins, counts = np.unique(self.completed // bin_size * bin_size, return_counts=True)
+        return dict(zip(bins.tolist(), counts.tolist()))
+
+
+class _State:
+    """所有玩家的抽卡状态，每个字段对应 `PlayerGachaBannerInfo` 的一个字段"""
+
+    FIELDS = (
+        "pity5",
+        "pity4",
+        "pity4_pool1",
+        "pity4_pool2",
+        "pity5_pool1",
+        "pity5_pool2",
+        "failed_chosen_item_pulls",
+        "failed_featured4_item_pulls",
+        "failed_featured_item_pulls",
+    )
+
+    def __init__(self, players: int, info: Optional[PlayerGachaBannerInfo]):
+        info = info or PlayerGachaBannerInfo()
+        for field in self.FIELDS:
+            setattr(self, field, np.full(players, getattr(info, field), dtype=np.int64))
+
+    def pity_pool(self, rarity: int, pool: int) -> "np.ndarray":
+        return getattr(self, f"pity{rarity}_pool{pool}")
+
+    def failed_featured(self, rarity: int) -> "np.ndarray":
+        return self.failed_featured4_item_pulls if rarity == 4 else self.failed_featured_item_pulls
+
+
+class GachaSimulation:
+    """同时模拟大量玩家在同一卡池中独立抽卡
+
+    :param banner: 卡池
+    :param players: 玩家数量
+    :param seed: 随机数种子
+    """
+
+    def __init__(self, banner: GachaBanner, players: int = 10000, seed: Optional[int] = None):
+        if not NUMPY_AVAILABLE:
+            raise GachaException("批量抽卡模拟需要安装 numpy")
+        if players < 1:
+            raise GachaIllegalArgument("players must be positive")
+        self.banner = banner
+        self.players = players
+        self.rng = np.random.default_rng(seed)
+        compiled = banner.compile()
+        self.weight = {4: self._items(compiled.weight4), 5: self._items(compiled.weight5)}
+        self.pool_balance_weight = {
+            4: self._items(compiled.pool_balance_weights4),
+            5: self._items(compiled.pool_balance_weights5),
+        }
+        self.event_chance = {4: compiled.get_event_chance(4), 5: compiled.get_event_chance(5)}
+        self.featured = {4: self._items(compiled.rate_up_items4), 5: self._items(compiled.rate_up_items5)}
+        self.fallback = {
+            4: (self._items(compiled.fallback_items4_pool1), self._items(compiled.fallback_items4_pool2)),
+            5: (self._items(compiled.fallback_items5_pool1), self._items(compiled.fallback_items5_pool2)),
+        }
+        self.fallback_default = {
+            4: self._items(BannerSystem.fallback_items4_pool2_default),
+            5: self._items(BannerSystem.fallback_items5_pool2_default),
+        }
+        self.fallback3 = self._items(compiled.fallback_items3)
+
+    @staticmethod
+    def _items(items: Sequence[int]) -> "np.ndarray":
+        return np.array(items, dtype=np.int64)
+
+    def _choice(self, items: "np.ndarray", size: int) -> "np.ndarray":
+        return items[self.rng.integers(0, len(items), size)]
+
+    def _fallback_pull(self, state: _State, rarity: int, index: "np.ndarray") -> "np.ndarray":
+        pool1, pool2 = self.fallback[rarity]
+        if len(pool1) < 1:
+            return self._choice(pool2 if len(pool2) else self.fallback_default[rarity], len(index))
+        if len(pool2) < 1:
+            return self._choice(pool1, len(index))
+        pity_pool1, pity_pool2 = state.pity_pool(rarity, 1), state.pity_pool(rarity, 2)
+        weight1 = _lookup(self.pool_balance_weight[rarity], pity_pool1[index])
+        weight2 = _lookup(self.pool_balance_weight[rarity], pity_pool2[index])
+        total = weight1 + weight2
+        roll = self.rng.integers(0, np.minimum(total, ROULETTE_CUTOFF), endpoint=True)
+        # 权重大的卡池排在前面；随机数等于权重之和时 draw_roulette 返回第一项
+        first_is_pool1 = weight1 >= weight2
+        hit_first = (roll < np.maximum(weight1, weight2)) | (roll >= total)
+        chosen_pool1 = hit_first == first_is_pool1
+        items = np.empty(len(index), dtype=np.int64)
+        items[chosen_pool1] = self._choice(pool1, np.count_nonzero(chosen_pool1))
+        items[~chosen_pool1] = self._choice(pool2, np.count_nonzero(~chosen_pool1))
+        pity_pool1[index[chosen_pool1]] = 0
+        pity_pool2[index[~chosen_pool1]] = 0
+        return items
+
+    def _rare_pull(self, state: _State, rarity: int, index: "np.ndarray", wish_item_id: int) -> "np.ndarray":
+        size = len(index)
+        failed_featured = state.failed_featured(rarity)
+        epitomized = self.banner.has_epitomized() and rarity == 5 and wish_item_id != 0
+        if epitomized:
+            pity_epitomized = state.failed_chosen_item_pulls[index] >= self.banner.wish_max_progress
+        else:
+            pity_epitomized = np.zeros(size, dtype=bool)
+        pity_featured = failed_featured[index] >= 1
+        roll_featured = self.rng.integers(1, 100, size, endpoint=True) <= self.event_chance[rarity]
+        pull_featured = (pity_featured | roll_featured) & ~pity_epitomized
+        if len(self.featured[rarity]) < 1:
+            pull_featured[:] = False
+        fallback = ~(pity_epitomized | pull_featured)
+
+        items = np.empty(size, dtype=np.int64)
+        items[pity_epitomized] = wish_item_id
+        items[pull_featured] = self._choice(self.featured[rarity], np.count_nonzero(pull_featured))
+        items[fallback] = self._fallback_pull(state, rarity, index[fallback])
+        failed_featured[index] = np.where(fallback, failed_featured[index] + 1, 0)
+        if epitomized:
+            state.failed_chosen_item_pulls[index] = np.where(
+                items == wish_item_id, 0, state.failed_chosen_item_pulls[index] + 1
+            )
+        return items
+
+    def _pull(self, state: _State, wish_item_id: int) -> "np.ndarray":
+        """所有玩家同时抽一次，返回每位玩家抽到的物品"""
+        for field in _State.FIELDS[:6]:
+            getattr(state, field)[:] += 1
+        weight5 = _lookup(self.weight[5], state.pity5)
+        weight4 = _lookup(self.weight[4], state.pity4)
+        # 权重之和至少为 10000，随机数范围固定为 [0, 10000]
+        roll = self.rng.integers(0, ROULETTE_CUTOFF, self.players, endpoint=True)
+        is5 = roll < weight5
+        is4 = ~is5 & (roll < weight5 + weight4)
+        is3 = ~(is5 | is4)
+        items = np.empty(self.players, dtype=np.int64)
+        items[is3] = self._choice(self.fallback3, np.count_nonzero(is3))
+        index5, index4 = np.flatnonzero(is5), np.flatnonzero(is4)
+        state.pity5[index5] = 0
+        state.pity4[index4] = 0
+        items[index5] = self._rare_pull(state, 5, index5, wish_item_id)
+        items[index4] = self._rare_pull(state, 4, index4, wish_item_id)
+        return items
+
+    def run(
+        self,
+        target_item: int,
+        copies: int = 1,
+        max_pulls: int = 2000,
+        wish_item_id: Optional[int] = None,
+        info: Optional[PlayerGachaBannerInfo] = None,
+    ) -> SimulationResult:
+        """模拟所有玩家抽卡，直到抽到指定数量的目标物品
+        :param target_item: 目标物品 ID
+        :param copies: 目标物品数量，例如满命为 7，满精为 5
+        :param max_pulls: 每位玩家最多抽卡的次数
+        :param wish_item_id: 武器池定轨的物品 ID，默认为玩家当前的定轨，没有定轨时为武器池的目标物品
+        :param info: 玩家当前的抽卡状态，默认为新玩家
+        :return: 模拟结果
+        """
+        if wish_item_id is None:
+            if info is not None and info.wish_item_id:
+                wish_item_id = info.wish_item_id
+            else:
+                wish_item_id = target_item if self.banner.banner_type == BannerType.WEAPON else 0
+        state = _State(self.players, info)
+        obtained = np.zeros(self.players, dtype=np.int64)
+        pulls = np.full(self.players, -1, dtype=np.int64)
+        for count in range(1, max_pulls + 1):
+            obtained += self._pull(state, wish_item_id) == target_item
+            done = (obtained >= copies) & (pulls < 0)
+            pulls[done] = count
+            if np.all(pulls >= 0):
+                break
+        return SimulationResult(pulls, max_pulls)
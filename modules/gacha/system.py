@@ -1,11 +1,10 @@
 import random
-from typing import Tuple, List
+from typing import List, Sequence, Tuple
 
-from modules.gacha.banner import GachaBanner
+from modules.gacha.banner import CompiledBanner, GachaBanner
 from modules.gacha.error import GachaInvalidTimes, GachaIllegalArgument
 from modules.gacha.player.info import PlayerGachaBannerInfo
 from modules.gacha.player.info import PlayerGachaInfo
-from modules.gacha.pool import BannerPool
 
 
 class BannerSystem:
@@ -38,13 +37,13 @@ class BannerSystem:
 
         gacha_info = player_gacha_info.get_banner_info(banner)
         gacha_info.add_total_pulls(times)
-        pools = BannerPool(banner)
+        compiled = banner.compile()
         for _ in range(times):
-            item_id = self.do_pull(banner, gacha_info, pools)
+            item_id = self.do_pull(compiled, gacha_info)
             item_list.append(item_id)
         return item_list
 
-    def do_pull(self, banner: GachaBanner, gacha_info: PlayerGachaBannerInfo, pools: BannerPool) -> int:
+    def do_pull(self, banner: CompiledBanner, gacha_info: PlayerGachaBannerInfo) -> int:
         gacha_info.inc_pity_all()
         # 对玩家卡池信息的计数全部加1，方便计算
         # 就这么说吧，如果你加之前比已经四星9发没出，那么这个能让你下次权重必定让你出四星的角色
@@ -56,12 +55,12 @@ class BannerSystem:
             # print(f"已经获得五星，当前五星权重为{weights[0]}")
             gacha_info.pity5 = 0
             return self.do_rare_pull(
-                pools.rate_up_items5, pools.fallback_items5_pool1, pools.fallback_items5_pool2, 5, banner, gacha_info
+                banner.rate_up_items5, banner.fallback_items5_pool1, banner.fallback_items5_pool2, 5, banner, gacha_info
             )
         elif leval_won == 4:
             gacha_info.pity4 = 0
             return self.do_rare_pull(
-                pools.rate_up_items4, pools.fallback_items4_pool1, pools.fallback_items4_pool2, 4, banner, gacha_info
+                banner.rate_up_items4, banner.fallback_items4_pool1, banner.fallback_items4_pool2, 4, banner, gacha_info
             )
         else:
             return self.get_random(banner.fallback_items3)
@@ -83,11 +82,11 @@ class BannerSystem:
 
     def do_rare_pull(
         self,
-        featured: List[int],
-        fallback1: List[int],
-        fallback2: List[int],
+        featured: Sequence[int],
+        fallback1: Sequence[int],
+        fallback2: Sequence[int],
         rarity: int,
-        banner: GachaBanner,
+        banner: CompiledBanner,
         gacha_info: PlayerGachaBannerInfo,
     ) -> int:
         # 以下是防止点炒饭
@@ -115,10 +114,10 @@ class BannerSystem:
 
     def do_fallback_rare_pull(
         self,
-        fallback1: List[int],
-        fallback2: List[int],
+        fallback1: Sequence[int],
+        fallback2: Sequence[int],
         rarity: int,
-        banner: GachaBanner,
+        banner: CompiledBanner,
         gacha_info: PlayerGachaBannerInfo,
     ) -> int:
         if len(fallback1) < 1:
@@ -1,5 +1,5 @@
 import contextlib
-from typing import List
+from typing import List, Tuple
 
 
 def lerp(x: int, x_y_array) -> int:
@@ -22,5 +22,11 @@ def lerp(x: int, x_y_array) -> int:
     return 0
 
 
+def lerp_table(x_y_array) -> Tuple[int, ...]:
+    """将 lerp 的分段线性表展开为以 x 为下标的数组，x 超出最后一项时取最后一项"""
+    return tuple(lerp(x, x_y_array) for x in range(x_y_array[-1][0] + 1))
+
+
 def set_subtract(minuend: List[int], subtrahend: List[int]) -> List[int]:
+    subtrahend = set(subtrahend)
     return [i for i in minuend if i not in subtrahend]
@@ -1,3 +1,13 @@
+import asyncio
+import json
+import re
+import time
+from typing import Any, IO, Iterator, Tuple
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_DECODER = json.JSONDecoder()
+
+
 def from_url_get_authkey(url: str) -> str:
     """从 UEL 解析 authkey
     :param url: URL
@@ -7,3 +17,104 @@ def from_url_get_authkey(url: str) -> str:
         return url.split("authkey=")[1].split("&")[0]
     except IndexError:
         return url
+
+
+class RateLimiter:
+    """限制请求频率，两次请求之间至少间隔 `interval` 秒"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = asyncio.Lock()
+        self._last = 0.0
+
+    async def __aenter__(self):
+        async with self._lock:
+            if (wait := self._last + self.interval - time.monotonic()) > 0:
+                await asyncio.sleep(wait)
+            self._last = time.monotonic()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class _JsonReader:
+    """按块读取文本，逐个解析 JSON 值"""
+
+    def __init__(self, fp: IO[str], chunk_size: int):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """丢弃已解析的部分并读取下一块"""
+        chunk = self.fp.read(self.chunk_size)
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        if not chunk:
+            self.eof = True
+        return bool(chunk)
+
+    def peek(self) -> str:
+        """跳过空白并返回下一个字符，读取完毕时返回空字符串"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self.fill():
+                return self.buffer[self.pos : self.pos + 1]
+
+    def expect(self, chars: str) -> str:
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"JSON 格式错误，位置 {self.pos} 处应为 {chars!r}")
+        self.pos += 1
+        return char
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # 当前块中的值不完整
+                if self.fill():
+                    continue
+                raise
+            if end == len(self.buffer) and not self.eof and self.fill():
+                # 位于块末尾的数字可能被截断
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_object(fp: IO[str], stream_key: str, chunk_size: int = 64 * 1024) -> Iterator[Tuple[str, Any]]:
+    """逐项读取 JSON 对象，内存占用与文件大小无关
+
+    `stream_key` 对应的数组逐个元素返回 `(stream_key, 元素)`，其余键返回 `(键, 完整的值)`。
+    :param fp: 文本文件
+    :param stream_key: 需要逐个读取元素的数组的键
+    :param chunk_size: 每次读取的字符数
+    :return: 键与值
+    """
+    reader = _JsonReader(fp, chunk_size)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        key = reader.value()
+        if not isinstance(key, str):
+            raise ValueError("JSON 格式错误，对象的键必须为字符串")
+        reader.expect(":")
+        if key == stream_key and reader.peek() == "[":
+            reader.pos += 1
+            if reader.peek() == "]":
+                reader.pos += 1
+            else:
+                while True:
+                    yield key, reader.value()
+                    if reader.expect(",]") == "]":
+                        break
+        else:
+            yield key, reader.value()
+        if reader.expect(",}") == "}":
+            return
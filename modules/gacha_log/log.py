@@ -1,9 +1,11 @@
+import asyncio
 import contextlib
 import datetime
+import io
 import json
 from os import PathLike
 from pathlib import Path
-from typing import Dict, IO, List, Optional, Tuple, Union
+from typing import Dict, IO, Iterator, List, Optional, Tuple, Union
 
 import aiofiles
 from genshin import Client, InvalidAuthkey, AuthkeyTimeout
@@ -11,7 +13,6 @@ from genshin.models import BannerType
 from openpyxl import load_workbook
 
 from core.base.assets import AssetsService
-from metadata.pool.pool import get_pool_by_id
 from metadata.shortname import roleToId, weaponToId
 from modules.gacha_log.const import GACHA_TYPE_LIST, PAIMONMOE_VERSION
 from modules.gacha_log.error import (
@@ -24,6 +25,7 @@ from modules.gacha_log.error import (
     PaimonMoeGachaLogFileError,
     GachaLogAuthkeyTimeout,
 )
+from modules.gacha_log.helpers import RateLimiter, iter_json_object
 from modules.gacha_log.models import (
     FiveStarItem,
     FourStarItem,
@@ -31,11 +33,19 @@ from modules.gacha_log.models import (
     GachaLogInfo,
     ImportType,
     ItemType,
-    Pool,
     UIGFGachaType,
     UIGFInfo,
     UIGFItem,
-    UIGFModel,
+)
+from modules.gacha_log.storage import GachaLogStorage, POOL_FILE_NAMES
+from modules.gacha_log.summary import (
+    GachaLogSummary,
+    PoolSummary,
+    SUMMARY_VERSION,
+    UpPoolSummary,
+    build_pool_summary,
+    check_avatar_up,
+    update_pool_summary,
 )
 from utils.const import PROJECT_ROOT
 
@@ -46,6 +56,7 @@ GACHA_LOG_PATH.mkdir(parents=True, exist_ok=True)
 class GachaLog:
     def __init__(self, gacha_log_path: Path = GACHA_LOG_PATH):
         self.gacha_log_path = gacha_log_path
+        self.storage = GachaLogStorage(gacha_log_path)
 
     @staticmethod
     async def load_json(path):
@@ -68,15 +79,27 @@ class GachaLog:
         :param only_status: 是否只读取状态
         :return: 抽卡记录数据
         """
-        file_path = self.gacha_log_path / f"{user_id}-{uid}.json"
         if only_status:
-            return None, file_path.exists()
-        if not file_path.exists():
-            return GachaLogInfo(user_id=user_id, uid=uid, update_time=datetime.datetime.now()), False
+            return None, self.storage.exists(user_id, uid)
+        try:
+            if (gacha_log := await self.storage.load(user_id, uid)) is not None:
+                return gacha_log, True
+        except ValueError:
+            pass
+        return GachaLogInfo(user_id=user_id, uid=uid, update_time=datetime.datetime.now()), False
+
+    async def load_history_status(self, user_id: str, uid: str) -> Tuple[GachaLogInfo, bool]:
+        """读取历史抽卡记录的账号信息，不读取抽卡记录
+        :param user_id: 用户id
+        :param uid: 原神uid
+        :return: 账号信息
+        """
         try:
-            return GachaLogInfo.parse_obj(await self.load_json(file_path)), True
-        except json.decoder.JSONDecodeError:
-            return GachaLogInfo(user_id=user_id, uid=uid, update_time=datetime.datetime.now()), False
+            if (gacha_log := await self.storage.load_info(user_id, uid)) is not None:
+                return gacha_log, True
+        except ValueError:
+            pass
+        return GachaLogInfo(user_id=user_id, uid=uid, update_time=datetime.datetime.now()), False
 
     async def remove_history_info(self, user_id: str, uid: str) -> bool:
         """删除历史抽卡记录数据
@@ -84,73 +107,116 @@ class GachaLog:
         :param uid: 原神uid
         :return: 是否删除成功
         """
-        file_path = self.gacha_log_path / f"{user_id}-{uid}.json"
         file_bak_path = self.gacha_log_path / f"{user_id}-{uid}.json.bak"
         file_export_path = self.gacha_log_path / f"{user_id}-{uid}-uigf.json"
         with contextlib.suppress(Exception):
             file_bak_path.unlink(missing_ok=True)
         with contextlib.suppress(Exception):
             file_export_path.unlink(missing_ok=True)
-        if file_path.exists():
-            try:
-                file_path.unlink()
-            except PermissionError:
-                return False
-            return True
-        return False
+        try:
+            return await self.storage.remove(user_id, uid)
+        except PermissionError:
+            return False
 
-    async def save_gacha_log_info(self, user_id: str, uid: str, info: GachaLogInfo):
-        """保存抽卡记录数据
+    async def load_summary(self, user_id: str, uid: str) -> GachaLogSummary:
+        """读取预计算的统计数据，不存在或已过期时根据抽卡记录重新计算
         :param user_id: 用户id
         :param uid: 原神uid
-        :param info: 抽卡记录数据
+        :return: 统计数据
+        """
+        summary = None
+        if (data := await self.storage.load_summary(user_id, uid)) is not None:
+            with contextlib.suppress(ValueError):
+                summary = GachaLogSummary.parse_raw(data)
+        if summary is None or summary.version != SUMMARY_VERSION or summary.pools.keys() != POOL_FILE_NAMES.keys():
+            summary = GachaLogSummary(
+                pools={
+                    pool_name: build_pool_summary(pool_name, await self.storage.load_pool(user_id, uid, pool_name))
+                    for pool_name in POOL_FILE_NAMES
+                }
+            )
+            await self.storage.save_summary(user_id, uid, summary.json())
+        return summary
+
+    async def append_gacha_log_items(self, info: GachaLogInfo, new_items: Dict[str, List[GachaItem]]):
+        """追加新的抽卡记录，并更新账号信息与统计数据
+        :param info: 账号信息
+        :param new_items: 各卡池新增的抽卡记录
         """
-        save_path = self.gacha_log_path / f"{user_id}-{uid}.json"
-        save_path_bak = self.gacha_log_path / f"{user_id}-{uid}.json.bak"
-        # 将旧数据备份一次
-        with contextlib.suppress(PermissionError):
-            if save_path.exists():
-                if save_path_bak.exists():
-                    save_path_bak.unlink()
-                save_path.rename(save_path.parent / f"{save_path.name}.bak")
-        # 写入数据
-        await self.save_json(save_path, info.json())
-
-    async def gacha_log_to_uigf(self, user_id: str, uid: str) -> Optional[Path]:
+        summary = await self.load_summary(info.user_id, info.uid)
+        rebuild = []
+        for pool_name, items in new_items.items():
+            if not items:
+                continue
+            items = sorted(items, key=lambda x: (x.time, x.id))
+            await self.storage.append(info.user_id, info.uid, pool_name, items)
+            pool_summary = summary.pools[pool_name]
+            if pool_summary.last_time is None or (items[0].time, items[0].id) > (
+                pool_summary.last_time,
+                pool_summary.last_id,
+            ):
+                # 新增记录都在已有记录之后，直接累加
+                update_pool_summary(pool_name, pool_summary, items)
+            else:
+                rebuild.append(pool_name)
+        await self.storage.compact(info.user_id, info.uid)
+        for pool_name in rebuild:
+            summary.pools[pool_name] = build_pool_summary(
+                pool_name, await self.storage.load_pool(info.user_id, info.uid, pool_name)
+            )
+        await self.storage.save_summary(info.user_id, info.uid, summary.json())
+        await self.storage.save_info(info)
+
+    async def gacha_log_to_uigf(self, user_id: str, uid: str, batch_size: int = 1000) -> Optional[Path]:
         """抽卡日记转换为 UIGF 格式
+
+        逐条读取记录并分批写入文件，内存占用与记录数量无关。
         :param user_id: 用户ID
         :param uid: 游戏UID
+        :param batch_size: 每次写入的记录数
         :return: 转换是否成功、转换信息、UIGF文件目录
         """
-        data, state = await self.load_history_info(user_id, uid)
+        _, state = await self.load_history_status(user_id, uid)
         if not state:
             raise GachaLogNotFound
+        await self.storage.compact(user_id, uid)
         save_path = self.gacha_log_path / f"{user_id}-{uid}-uigf.json"
-        info = UIGFModel(
-            info=UIGFInfo(uid=uid, export_app=ImportType.TGPaimonBot.value, export_app_version="v3"), list=[]
-        )
-        for items in data.item_list.values():
-            for item in items:
-                info.list.append(
-                    UIGFItem(
-                        id=item.id,
-                        name=item.name,
-                        gacha_type=item.gacha_type,
-                        item_type=item.item_type,
-                        rank_type=item.rank_type,
-                        time=item.time.strftime("%Y-%m-%d %H:%M:%S"),
-                        uigf_gacha_type=item.gacha_type,
+        temp_path = save_path.with_name(f"{save_path.name}.tmp")
+        info = UIGFInfo(uid=uid, export_app=ImportType.TGPaimonBot.value, export_app_version="v3")
+        info_text = json.dumps(json.loads(info.json()), ensure_ascii=False, indent=4).replace("\n", "\n    ")
+        async with aiofiles.open(temp_path, "w", encoding="utf-8") as f:
+            await f.write(f'{{\n    "info": {info_text},\n    "list": [')
+            # 每条记录写为一行，带缩进的 json.dumps 无法使用 C 实现，速度慢很多
+            batch, separator = [], "\n        "
+            for pool_name in POOL_FILE_NAMES:
+                async for item in self.storage.iter_pool(user_id, uid, pool_name):
+                    item_text = json.dumps(
+                        {
+                            "id": item.id,
+                            "name": item.name,
+                            "count": "1",
+                            "gacha_type": item.gacha_type,
+                            "item_id": "",
+                            "item_type": item.item_type,
+                            "rank_type": item.rank_type,
+                            "time": item.time.strftime("%Y-%m-%d %H:%M:%S"),
+                            "uigf_gacha_type": item.gacha_type,
+                        },
+                        ensure_ascii=False,
                     )
-                )
-        await self.save_json(save_path, json.loads(info.json()))
+                    batch.append(separator + item_text)
+                    separator = ",\n        "
+                    if len(batch) >= batch_size:
+                        await f.write("".join(batch))
+                        batch.clear()
+            await f.write("".join(batch))
+            await f.write("\n    ]\n}\n")
+        temp_path.replace(save_path)
         return save_path
 
     @staticmethod
-    async def verify_data(data: List[GachaItem]) -> bool:
+    def verify_count(total: int, five_star: int, four_star: int) -> bool:
         try:
-            total = len(data)
-            five_star = len([i for i in data if i.rank_type == "5"])
-            four_star = len([i for i in data if i.rank_type == "4"])
             if total > 50:
                 if total <= five_star * 15:
                     raise GachaLogFileError("检测到您将要导入的抽卡记录中五星数量过多，可能是由于文件错误导致的，请检查后重新导入。")
@@ -161,43 +227,67 @@ class GachaLog:
             raise GachaLogFileError from exc
 
     async def import_gacha_log_data(self, user_id: int, client: Client, data: dict, verify_uid: bool = True) -> int:
+        """导入 UIGF 格式的抽卡记录
+
+        `data["list"]` 可以是逐条读取的生成器，只有新增的记录会保留在内存中。
+        :param user_id: 用户id
+        :param client: genshin client
+        :param data: UIGF 格式数据
+        :param verify_uid: 是否检查文件中的 uid 与绑定的 uid 一致
+        :return: 新增记录数
+        """
         new_num = 0
         try:
-            uid = data["info"]["uid"]
-            if not verify_uid:
-                uid = client.uid
-            elif int(uid) != client.uid:
+            # 文件中的 uid 必须与绑定的 uid 一致，记录总是导入到绑定的账号中
+            gacha_log, status = await self.load_history_status(str(user_id), str(client.uid))
+            temp_id_data = {
+                pool_name: await self.storage.load_ids(gacha_log.user_id, gacha_log.uid, pool_name)
+                for pool_name in gacha_log.item_list
+            }
+            new_items: Dict[str, List[GachaItem]] = {pool_name: [] for pool_name in gacha_log.item_list}
+            total = five_star = four_star = 0
+            for item_data in data["list"]:
+                if total == 0 and verify_uid and "uid" in data["info"] and int(data["info"]["uid"]) != client.uid:
+                    # info 位于 list 之前时尽早检查
+                    raise GachaLogAccountNotFound
+                # 检查导入数据是否合法
+                item_info = GachaItem(**item_data)
+                total += 1
+                if item_info.rank_type == "5":
+                    five_star += 1
+                elif item_info.rank_type == "4":
+                    four_star += 1
+                pool_name = GACHA_TYPE_LIST[BannerType(int(item_info.gacha_type))]
+                if item_info.id not in temp_id_data[pool_name]:
+                    new_items[pool_name].append(item_info)
+                    temp_id_data[pool_name].add(item_info.id)
+                    new_num += 1
+            self.verify_count(total, five_star, four_star)
+            # 读取完记录后 info 才保证完整
+            if verify_uid and int(data["info"]["uid"]) != client.uid:
                 raise GachaLogAccountNotFound
             try:
                 import_type = ImportType(data["info"]["export_app"])
             except ValueError:
                 import_type = ImportType.UNKNOWN
-            # 检查导入数据是否合法
-            all_items = [GachaItem(**i) for i in data["list"]]
-            await self.verify_data(all_items)
-            gacha_log, status = await self.load_history_info(str(user_id), uid)
             if import_type == ImportType.PAIMONMOE:
                 if status and gacha_log.get_import_type != ImportType.PAIMONMOE:
                     raise GachaLogMixedProvider
             elif status and gacha_log.get_import_type == ImportType.PAIMONMOE:
                 raise GachaLogMixedProvider
-            # 将唯一 id 放入临时数据中，加快查找速度
-            temp_id_data = {
-                pool_name: [i.id for i in pool_data] for pool_name, pool_data in gacha_log.item_list.items()
-            }
-            for item_info in all_items:
-                pool_name = GACHA_TYPE_LIST[BannerType(int(item_info.gacha_type))]
-                if item_info.id not in temp_id_data[pool_name]:
-                    gacha_log.item_list[pool_name].append(item_info)
-                    temp_id_data[pool_name].append(item_info.id)
-                    new_num += 1
-            for i in gacha_log.item_list.values():
-                # 检查导入后的数据是否合法
-                await self.verify_data(i)
-                i.sort(key=lambda x: (x.time, x.id))
+            summary = await self.load_summary(gacha_log.user_id, gacha_log.uid)
+            for pool_name, items in new_items.items():
+                if items:
+                    # 检查导入后的数据是否合法
+                    pool_summary = summary.pools[pool_name]
+                    self.verify_count(
+                        pool_summary.total + len(items),
+                        pool_summary.five_total + len([i for i in items if i.rank_type == "5"]),
+                        pool_summary.four_total + len([i for i in items if i.rank_type == "4"]),
+                    )
             gacha_log.update_time = datetime.datetime.now()
             gacha_log.import_type = import_type.value
-            await self.save_gacha_log_info(str(user_id), uid, gacha_log)
+            await self.append_gacha_log_items(gacha_log, new_items)
             return new_num
         except GachaLogAccountNotFound as e:
             raise GachaLogAccountNotFound("导入失败，文件包含的祈愿记录所属 uid 与你当前绑定的 uid 不同") from e
@@ -206,22 +296,77 @@ class GachaLog:
         except Exception as exc:
             raise GachaLogException from exc
 
-    async def get_gacha_log_data(self, user_id: int, client: Client, authkey: str) -> int:
+    async def get_gacha_log_data(
+        self,
+        user_id: int,
+        client: Client,
+        authkey: str,
+        request_interval: float = 0.3,
+        checkpoint_pages: int = 10,
+    ) -> int:
         """使用authkey获取抽卡记录数据，并合并旧数据
+
+        各卡池并发获取，遇到已有的记录即停止翻页。获取过程中会定期保存已获取的记录与翻页位置，
+        中断后再次获取时会从上次的位置继续。
         :param user_id: 用户id
         :param client: genshin client
         :param authkey: authkey
+        :param request_interval: 同一账号两次请求之间的最小间隔
+        :param checkpoint_pages: 每获取多少页保存一次
         :return: 更新结果
         """
         new_num = 0
-        gacha_log, _ = await self.load_history_info(str(user_id), str(client.uid))
+        gacha_log, _ = await self.load_history_status(str(user_id), str(client.uid))
         if gacha_log.get_import_type == ImportType.PAIMONMOE:
             raise GachaLogMixedProvider
-        # 将唯一 id 放入临时数据中，加快查找速度
-        temp_id_data = {pool_name: [i.id for i in pool_data] for pool_name, pool_data in gacha_log.item_list.items()}
-        try:
-            for pool_id, pool_name in GACHA_TYPE_LIST.items():
-                async for data in client.wish_history(pool_id, authkey=authkey):
+        user_id, uid = gacha_log.user_id, gacha_log.uid
+        temp_id_data = {
+            pool_name: await self.storage.load_ids(user_id, uid, pool_name) for pool_name in gacha_log.item_list
+        }
+        # 本次获取前已有的记录，用于判断是否停止翻页
+        known_id_data = {pool_name: set(ids) for pool_name, ids in temp_id_data.items()}
+        new_items: Dict[str, List[GachaItem]] = {pool_name: [] for pool_name in gacha_log.item_list}
+        checkpoint: Dict[str, List[Optional[int]]] = await self.storage.load_checkpoint(user_id, uid)
+        rate_limiter = RateLimiter(request_interval)
+        flushed = False
+        flush_lock = asyncio.Lock()
+
+        async def write():
+            """保存已获取的记录与翻页位置"""
+            nonlocal flushed
+            async with flush_lock:
+                items = {pool_name: pool_items for pool_name, pool_items in new_items.items() if pool_items}
+                for pool_name in items:
+                    new_items[pool_name] = []
+                # 已完成的翻页位置为 None，还没有获取任何一页的位置为 0，都不需要保存
+                current_checkpoint = {
+                    key: [end_id for end_id in cursors if end_id] for key, cursors in checkpoint.items() if any(cursors)
+                }
+                if not flushed:
+                    # 中途写入的记录未计入统计，需要重新计算
+                    await self.storage.remove_summary(user_id, uid)
+                    flushed = True
+                for pool_name, pool_items in items.items():
+                    await self.storage.append(user_id, uid, pool_name, pool_items)
+                await self.storage.save_checkpoint(user_id, uid, current_checkpoint)
+                # 第一次获取中断时也要保存账号信息，否则已保存的记录会被认为不存在
+                gacha_log.update_time = datetime.datetime.now()
+                gacha_log.import_type = ImportType.UIGF.value
+                await self.storage.save_info(gacha_log)
+
+        async def flush():
+            # 取出的记录必须写完，任务被取消时也不能中断
+            await asyncio.shield(write())
+
+        async def fetch_pages(pool_id: BannerType, pool_name: str, cursors: List[Optional[int]], index: int) -> None:
+            """从 cursors[index] 开始向前翻页，直到遇到已有的记录，每次翻页只更新自己的位置"""
+            nonlocal new_num
+            end_id = cursors[index]
+            pages = 0
+            while True:
+                async with rate_limiter:
+                    page = [i async for i in client.wish_history(pool_id, limit=20, authkey=authkey, end_id=end_id)]
+                for data in page:
                     item = GachaItem(
                         id=str(data.id),
                         name=data.name,
@@ -237,111 +382,101 @@ class GachaLog:
                             data.time.second,
                         ),
                     )
-
+                    if item.id in known_id_data[pool_name]:
+                        cursors[index] = None
+                        return
                     if item.id not in temp_id_data[pool_name]:
-                        gacha_log.item_list[pool_name].append(item)
-                        temp_id_data[pool_name].append(item.id)
+                        new_items[pool_name].append(item)
+                        temp_id_data[pool_name].add(item.id)
                         new_num += 1
-        except AuthkeyTimeout as exc:
-            raise GachaLogAuthkeyTimeout from exc
-        except InvalidAuthkey as exc:
-            raise GachaLogInvalidAuthkey from exc
-        for i in gacha_log.item_list.values():
-            i.sort(key=lambda x: (x.time, x.id))
+                if len(page) < 20:
+                    cursors[index] = None
+                    return
+                end_id = cursors[index] = page[-1].id
+                pages += 1
+                if pages % checkpoint_pages == 0:
+                    await flush()
+
+        async def fetch_pool(pool_id: BannerType, pool_name: str) -> None:
+            key = str(pool_id.value)
+            saved = checkpoint.get(key) or []
+            # 旧版本只保存一个翻页位置
+            saved = [saved] if isinstance(saved, int) else saved
+            # 先获取最新的记录，再依次继续之前每次中断的位置，每个位置在完成前都会保存，中断多次也不会遗漏
+            cursors: List[Optional[int]] = [0, *saved]
+            checkpoint[key] = cursors
+            for index in range(len(cursors)):
+                await fetch_pages(pool_id, pool_name, cursors, index)
+            checkpoint.pop(key, None)
+
+        tasks = [asyncio.create_task(fetch_pool(pool_id, pool_name)) for pool_id, pool_name in GACHA_TYPE_LIST.items()]
+        try:
+            await asyncio.gather(*tasks)
+        except Exception as exc:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await flush()
+            if isinstance(exc, AuthkeyTimeout):
+                raise GachaLogAuthkeyTimeout from exc
+            if isinstance(exc, InvalidAuthkey):
+                raise GachaLogInvalidAuthkey from exc
+            raise exc
         gacha_log.update_time = datetime.datetime.now()
         gacha_log.import_type = ImportType.UIGF.value
-        await self.save_gacha_log_info(str(user_id), str(client.uid), gacha_log)
+        await self.append_gacha_log_items(gacha_log, new_items)
+        await self.storage.remove_checkpoint(user_id, uid)
         return new_num
 
     @staticmethod
     def check_avatar_up(name: str, gacha_time: datetime.datetime) -> bool:
-        if name in {"莫娜", "七七", "迪卢克", "琴"}:
-            return False
-        elif name == "刻晴":
-            start_time = datetime.datetime.strptime("2021-02-17 18:00:00", "%Y-%m-%d %H:%M:%S")
-            end_time = datetime.datetime.strptime("2021-03-02 15:59:59", "%Y-%m-%d %H:%M:%S")
-            if not (start_time < gacha_time < end_time):
-                return False
-        elif name == "提纳里":
-            start_time = datetime.datetime.strptime("2022-08-24 06:00:00", "%Y-%m-%d %H:%M:%S")
-            end_time = datetime.datetime.strptime("2022-09-09 17:59:59", "%Y-%m-%d %H:%M:%S")
-            if not (start_time < gacha_time < end_time):
-                return False
-        return True
-
-    async def get_all_5_star_items(self, data: List[GachaItem], assets: AssetsService, pool_name: str = "角色祈愿"):
-        """
-        获取所有5星角色
-        :param data: 抽卡记录
-        :param assets: 资源服务
-        :param pool_name: 池子名称
-        :return: 5星角色列表
-        """
-        count = 0
-        result = []
-        for item in data:
-            count += 1
-            if item.rank_type == "5":
-                if item.item_type == "角色" and pool_name in {"角色祈愿", "常驻祈愿"}:
-                    data = {
-                        "name": item.name,
-                        "icon": (await assets.avatar(roleToId(item.name)).icon()).as_uri(),
-                        "count": count,
-                        "type": "角色",
-                        "isUp": self.check_avatar_up(item.name, item.time) if pool_name == "角色祈愿" else False,
-                        "isBig": (not result[-1].isUp) if result and pool_name == "角色祈愿" else False,
-                        "time": item.time,
-                    }
-                    result.append(FiveStarItem.construct(**data))
-                elif item.item_type == "武器" and pool_name in {"武器祈愿", "常驻祈愿"}:
-                    data = {
-                        "name": item.name,
-                        "icon": (await assets.weapon(weaponToId(item.name)).icon()).as_uri(),
-                        "count": count,
-                        "type": "武器",
-                        "isUp": False,
-                        "isBig": False,
-                        "time": item.time,
-                    }
-                    result.append(FiveStarItem.construct(**data))
-                count = 0
-        result.reverse()
-        return result, count
+        """五星角色是否为 UP 角色，见 `modules.gacha_log.summary.check_avatar_up`"""
+        return check_avatar_up(name, gacha_time)
 
     @staticmethod
-    async def get_all_4_star_items(data: List[GachaItem], assets: AssetsService):
+    async def get_icon(assets: AssetsService, item_type: str, name: str) -> str:
+        """获取角色或武器的图标
+        :param assets: 资源服务
+        :param item_type: 物品类型
+        :param name: 名称
+        :return: 图标 URI
         """
-        获取 no_fout_star
-        :param data: 抽卡记录
+        if item_type == "角色":
+            return (await assets.avatar(roleToId(name)).icon()).as_uri()
+        return (await assets.weapon(weaponToId(name)).icon()).as_uri()
+
+    async def get_summary_star_items(
+        self, pool_summary: PoolSummary, assets: AssetsService, four_icon_limit: Optional[int] = None
+    ) -> Tuple[List[FiveStarItem], List[FourStarItem]]:
+        """将统计数据中的五星与四星转换为渲染使用的数据，按时间倒序排列
+        :param pool_summary: 卡池统计数据
         :param assets: 资源服务
-        :return: no_fout_star
+        :param four_icon_limit: 只获取前若干个四星的图标
+        :return: 五星列表与四星列表
         """
-        count = 0
-        result = []
-        for item in data:
-            count += 1
-            if item.rank_type == "4":
-                if item.item_type == "角色":
-                    data = {
-                        "name": item.name,
-                        "icon": (await assets.avatar(roleToId(item.name)).icon()).as_uri(),
-                        "count": count,
-                        "type": "角色",
-                        "time": item.time,
-                    }
-                    result.append(FourStarItem.construct(**data))
-                elif item.item_type == "武器":
-                    data = {
-                        "name": item.name,
-                        "icon": (await assets.weapon(weaponToId(item.name)).icon()).as_uri(),
-                        "count": count,
-                        "type": "武器",
-                        "time": item.time,
-                    }
-                    result.append(FourStarItem.construct(**data))
-                count = 0
-        result.reverse()
-        return result, count
+        all_five = [
+            FiveStarItem.construct(**item.dict(), icon=await self.get_icon(assets, item.type, item.name))
+            for item in reversed(pool_summary.five)
+        ]
+        all_four = []
+        for index, item in enumerate(reversed(pool_summary.four)):
+            icon = ""
+            if four_icon_limit is None or index < four_icon_limit:
+                icon = await self.get_icon(assets, item.type, item.name)
+            all_four.append(FourStarItem.construct(**item.dict(), icon=icon))
+        return all_five, all_four
+
+    async def get_up_pool_list(self, up_pool: UpPoolSummary, assets: AssetsService) -> List[dict]:
+        """将 UP 池统计转换为渲染使用的数据"""
+        return [
+            {
+                "name": item["name"],
+                "icon": await self.get_icon(assets, item["type"], item["name"]),
+                "count": item["count"],
+                "rank_type": item["rank_type"],
+            }
+            for item in up_pool.to_list()
+        ]
 
     @staticmethod
     def get_301_pool_data(total: int, all_five: List[FiveStarItem], no_five_star: int, no_four_star: int):
@@ -480,16 +615,15 @@ class GachaLog:
         :param assets: 资源服务
         :return: 分析数据
         """
-        gacha_log, status = await self.load_history_info(str(user_id), str(client.uid))
-        if not status:
+        if not self.storage.exists(str(user_id), str(client.uid)):
             raise GachaLogNotFound
         pool_name = GACHA_TYPE_LIST[pool]
-        data = gacha_log.item_list[pool_name]
-        total = len(data)
+        pool_summary = (await self.load_summary(str(user_id), str(client.uid))).pools[pool_name]
+        total = pool_summary.total
         if total == 0:
             raise GachaLogNotFound
-        all_five, no_five_star = await self.get_all_5_star_items(data, assets, pool_name)
-        all_four, no_four_star = await self.get_all_4_star_items(data, assets)
+        all_five, all_four = await self.get_summary_star_items(pool_summary, assets, 18)
+        no_five_star, no_four_star = pool_summary.no_five_star, pool_summary.no_four_star
         summon_data = None
         if pool == BannerType.CHARACTER1:
             summon_data = self.get_301_pool_data(total, all_five, no_five_star, no_four_star)
@@ -500,8 +634,8 @@ class GachaLog:
         elif pool == BannerType.PERMANENT:
             summon_data = self.get_200_pool_data(total, all_five, all_four, no_five_star, no_four_star)
             pool_name = self.count_fortune(pool_name, summon_data)
-        last_time = data[0].time.strftime("%Y-%m-%d %H:%M")
-        first_time = data[-1].time.strftime("%Y-%m-%d %H:%M")
+        last_time = pool_summary.first_time.strftime("%Y-%m-%d %H:%M")
+        first_time = pool_summary.last_time.strftime("%Y-%m-%d %H:%M")
         return {
             "uid": client.uid,
             "allNum": total,
@@ -525,35 +659,23 @@ class GachaLog:
         :param group: 是否群组
         :return: 分析数据
         """
-        gacha_log, status = await self.load_history_info(str(user_id), str(client.uid))
-        if not status:
+        if not self.storage.exists(str(user_id), str(client.uid)):
             raise GachaLogNotFound
         pool_name = GACHA_TYPE_LIST[pool]
-        data = gacha_log.item_list[pool_name]
-        total = len(data)
-        if total == 0:
+        pool_summary = (await self.load_summary(str(user_id), str(client.uid))).pools[pool_name]
+        if pool_summary.total == 0:
             raise GachaLogNotFound
-        all_five, _ = await self.get_all_5_star_items(data, assets, pool_name)
-        all_four, _ = await self.get_all_4_star_items(data, assets)
-        pool_data = []
-        up_pool_data = [Pool(**i) for i in get_pool_by_id(pool.value)]
-        for up_pool in up_pool_data:
-            for item in all_five:
-                up_pool.parse(item)
-            for item in all_four:
-                up_pool.parse(item)
-            up_pool.count_item(data)
-        for up_pool in up_pool_data:
-            pool_data.append(
-                {
-                    "count": up_pool.count,
-                    "list": up_pool.to_list(),
-                    "name": up_pool.name,
-                    "start": up_pool.start.strftime("%Y-%m-%d"),
-                    "end": up_pool.end.strftime("%Y-%m-%d"),
-                }
-            )
-        pool_data = [i for i in pool_data if i["count"] > 0]
+        pool_data = [
+            {
+                "count": up_pool.count,
+                "list": await self.get_up_pool_list(up_pool, assets),
+                "name": up_pool.name,
+                "start": up_pool.start.strftime("%Y-%m-%d"),
+                "end": up_pool.end.strftime("%Y-%m-%d"),
+            }
+            for up_pool in pool_summary.up_pools
+            if up_pool.count > 0
+        ]
         return {
             "uid": client.uid,
             "typeName": pool_name,
@@ -568,32 +690,18 @@ class GachaLog:
         :param assets: 资源服务
         :return: 分析数据
         """
-        gacha_log, status = await self.load_history_info(str(user_id), str(client.uid))
-        if not status:
+        if not self.storage.exists(str(user_id), str(client.uid)):
             raise GachaLogNotFound
-        pools = []
-        for pool_name, items in gacha_log.item_list.items():
-            pool = Pool(
-                five=[pool_name],
-                four=[],
-                name=pool_name,
-                to=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                **{"from": "2020-09-28 00:00:00"},
-            )
-            all_five, _ = await self.get_all_5_star_items(items, assets, pool_name)
-            for item in all_five:
-                pool.parse(item)
-            pool.count_item(items)
-            pools.append(pool)
+        summary = await self.load_summary(str(user_id), str(client.uid))
         pool_data = [
             {
-                "count": up_pool.count,
-                "list": up_pool.to_list(),
-                "name": up_pool.name,
-                "start": up_pool.start.strftime("%Y-%m-%d"),
-                "end": up_pool.end.strftime("%Y-%m-%d"),
+                "count": pool_summary.all_pool.count,
+                "list": await self.get_up_pool_list(pool_summary.all_pool, assets),
+                "name": pool_summary.all_pool.name,
+                "start": (pool_summary.all_pool.start or pool_summary.all_pool.from_time).strftime("%Y-%m-%d"),
+                "end": (pool_summary.all_pool.end or datetime.datetime.now()).strftime("%Y-%m-%d"),
             }
-            for up_pool in pools
+            for pool_summary in summary.pools.values()
         ]
         return {
             "uid": client.uid,
@@ -607,7 +715,7 @@ class GachaLog:
         """转换 paimone.moe 或 非小酋 导出 xlsx 数据为 UIGF 格式
         :param file: 导出的 xlsx 文件
         :param zh_dict:
-        :return: UIGF 格式数据
+        :return: UIGF 格式数据，`list` 为逐行读取的生成器
         """
 
         def from_paimon_moe(
@@ -657,7 +765,8 @@ class GachaLog:
                 uigf_gacha_type=uigf_gacha_type,
             )
 
-        wb = load_workbook(file)
+        # 只读模式按行读取，不会将整个工作簿载入内存
+        wb = load_workbook(file, read_only=True)
         wb_len = len(wb.worksheets)
 
         if wb_len == 6:
@@ -667,6 +776,7 @@ class GachaLog:
         elif wb_len == 4:
             import_type = ImportType.FXQ
         else:
+            wb.close()
             raise GachaLogFileError("xlsx 格式错误")
 
         paimonmoe_sheets = {
@@ -681,33 +791,34 @@ class GachaLog:
             UIGFGachaType.CHARACTER: "角色活动祈愿",
             UIGFGachaType.WEAPON: "武器活动祈愿",
         }
-        data = UIGFModel(info=UIGFInfo(export_app=import_type.value), list=[])
         if import_type == ImportType.PAIMONMOE:
             ws = wb["Information"]
             if ws["B2"].value != PAIMONMOE_VERSION:
+                wb.close()
                 raise PaimonMoeGachaLogFileError(file_version=ws["B2"].value, support_version=PAIMONMOE_VERSION)
-            count = 1
-            for gacha_type in paimonmoe_sheets:
-                ws = wb[paimonmoe_sheets[gacha_type]]
-                for row in ws.iter_rows(min_row=2, values_only=True):
-                    if row[0] is None:
-                        break
-                    data.list.append(from_paimon_moe(gacha_type, row[0], row[1], row[2], row[3], count))
-                    count += 1
-        elif import_type == ImportType.UIGF:
-            ws = wb["原始数据"]
-            type_map = {}
-            count = 0
-            for row in ws["1"]:
-                if row.value is None:
-                    break
-                type_map[row.value] = count
-                count += 1
+
+        def iter_rows(ws) -> Iterator[tuple]:
             for row in ws.iter_rows(min_row=2, values_only=True):
-                if row[0] is None:
+                if not row or row[0] is None:
                     break
-                data.list.append(
-                    from_uigf(
+                yield row
+
+        def iter_items() -> Iterator[UIGFItem]:
+            if import_type == ImportType.PAIMONMOE:
+                count = 1
+                for gacha_type in paimonmoe_sheets:
+                    for row in iter_rows(wb[paimonmoe_sheets[gacha_type]]):
+                        yield from_paimon_moe(gacha_type, row[0], row[1], row[2], row[3], count)
+                        count += 1
+            elif import_type == ImportType.UIGF:
+                ws = wb["原始数据"]
+                type_map = {}
+                for count, value in enumerate(next(ws.iter_rows(max_row=1, values_only=True), ())):
+                    if value is None:
+                        break
+                    type_map[value] = count
+                for row in iter_rows(ws):
+                    yield from_uigf(
                         row[type_map["uigf_gacha_type"]],
                         row[type_map["gacha_type"]],
                         row[type_map["item_type"]],
@@ -716,13 +827,37 @@ class GachaLog:
                         row[type_map["rank_type"]],
                         row[type_map["id"]],
                     )
-                )
-        else:
-            for gacha_type in fxq_sheets:
-                ws = wb[fxq_sheets[gacha_type]]
-                for row in ws.iter_rows(min_row=2, values_only=True):
-                    if row[0] is None:
-                        break
-                    data.list.append(from_fxq(gacha_type, row[2], row[1], row[0], row[3], row[6]))
+            else:
+                for gacha_type in fxq_sheets:
+                    for row in iter_rows(wb[fxq_sheets[gacha_type]]):
+                        yield from_fxq(gacha_type, row[2], row[1], row[0], row[3], row[6])
+
+        def iter_list() -> Iterator[Dict]:
+            try:
+                for item in iter_items():
+                    yield json.loads(item.json())
+            finally:
+                wb.close()
 
-        return json.loads(data.json())
+        return {"info": json.loads(UIGFInfo(export_app=import_type.value).json()), "list": iter_list()}
+
+    @staticmethod
+    def load_uigf_json(file: IO[bytes]) -> Dict:
+        """逐条读取 UIGF 格式的 JSON 文件
+        :param file: UIGF 格式的 JSON 文件
+        :return: UIGF 格式数据，`list` 为逐条读取的生成器，`info` 在读取完 `list` 后保证完整
+        """
+        info = {}
+
+        def iter_list() -> Iterator[Dict]:
+            reader = io.TextIOWrapper(file, encoding="utf-8")
+            try:
+                for key, value in iter_json_object(reader, "list"):
+                    if key == "list":
+                        yield value
+                    elif key == "info":
+                        info.update(value)
+            finally:
+                reader.detach()
+
+        return {"info": info, "list": iter_list()}
@@ -0,0 +1,285 @@
+"""抽卡记录的存储
+
+每个账号使用一个文件夹，每个卡池的记录以 JSON Lines 的形式追加写入，卡池中已有的记录 id 另存一份用于去重。
+新增记录不在末尾时只标记该卡池为无序，在导入结束时再统一整理（compact）。
+"""
+import contextlib
+import datetime
+import shutil
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set
+
+import aiofiles
+import ujson as json
+
+from modules.gacha_log.models import GachaItem, GachaLogInfo
+
+__all__ = ["GachaLogStorage", "POOL_FILE_NAMES"]
+
+POOL_FILE_NAMES = {
+    "角色祈愿": "character",
+    "武器祈愿": "weapon",
+    "常驻祈愿": "permanent",
+    "新手祈愿": "novice",
+}
+
+
+def _item_to_line(item: GachaItem) -> str:
+    return (
+        json.dumps(
+            {
+                "id": item.id,
+                "name": item.name,
+                "gacha_type": item.gacha_type,
+                "item_type": item.item_type,
+                "rank_type": item.rank_type,
+                "time": item.time.isoformat(),
+            },
+            ensure_ascii=False,
+        )
+        + "\n"
+    )
+
+
+def _line_to_item(line: str) -> GachaItem:
+    data = json.loads(line)
+    data["time"] = datetime.datetime.fromisoformat(data["time"])
+    # 写入前已经校验过，这里跳过 pydantic 的校验
+    return GachaItem.construct(**data)
+
+
+def _sort_key(item: GachaItem):
+    return item.time, item.id
+
+
+class GachaLogStorage:
+    """按卡池分段、追加写入的抽卡记录存储"""
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def account_path(self, user_id: str, uid: str) -> Path:
+        return self.path / f"{user_id}-{uid}"
+
+    def legacy_path(self, user_id: str, uid: str) -> Path:
+        """旧版本使用的单个 JSON 文件"""
+        return self.path / f"{user_id}-{uid}.json"
+
+    def _pool_path(self, user_id: str, uid: str, pool_name: str) -> Path:
+        return self.account_path(user_id, uid) / f"{POOL_FILE_NAMES[pool_name]}.jsonl"
+
+    def _ids_path(self, user_id: str, uid: str, pool_name: str) -> Path:
+        return self.account_path(user_id, uid) / f"{POOL_FILE_NAMES[pool_name]}.ids"
+
+    def _info_path(self, user_id: str, uid: str) -> Path:
+        return self.account_path(user_id, uid) / "info.json"
+
+    def _summary_path(self, user_id: str, uid: str) -> Path:
+        return self.account_path(user_id, uid) / "summary.json"
+
+    def _checkpoint_path(self, user_id: str, uid: str) -> Path:
+        return self.account_path(user_id, uid) / "checkpoint.json"
+
+    def exists(self, user_id: str, uid: str) -> bool:
+        return self._info_path(user_id, uid).exists() or self.legacy_path(user_id, uid).exists()
+
+    async def _migrate(self, user_id: str, uid: str):
+        """将旧版本的单个 JSON 文件转换为分段存储"""
+        legacy_path = self.legacy_path(user_id, uid)
+        async with aiofiles.open(legacy_path, "r", encoding="utf-8") as f:
+            gacha_log = GachaLogInfo.parse_raw(await f.read())
+        for pool_name, items in gacha_log.item_list.items():
+            await self.write_pool(user_id, uid, pool_name, items)
+        await self.save_info(gacha_log)
+        with contextlib.suppress(PermissionError):
+            legacy_path.rename(legacy_path.parent / f"{legacy_path.name}.bak")
+
+    async def _ensure_migrated(self, user_id: str, uid: str):
+        if not self._info_path(user_id, uid).exists() and self.legacy_path(user_id, uid).exists():
+            await self._migrate(user_id, uid)
+
+    async def load_info(self, user_id: str, uid: str) -> Optional[GachaLogInfo]:
+        """读取账号信息，不包含抽卡记录"""
+        await self._ensure_migrated(user_id, uid)
+        info_path = self._info_path(user_id, uid)
+        if not info_path.exists():
+            return None
+        async with aiofiles.open(info_path, "r", encoding="utf-8") as f:
+            data = json.loads(await f.read())
+        return GachaLogInfo(
+            user_id=data["user_id"],
+            uid=data["uid"],
+            update_time=data["update_time"],
+            import_type=data["import_type"],
+            item_list={pool_name: [] for pool_name in POOL_FILE_NAMES},
+        )
+
+    async def save_info(self, info: GachaLogInfo):
+        """保存账号信息，不包含抽卡记录"""
+        info_path = self._info_path(info.user_id, info.uid)
+        info_path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "user_id": info.user_id,
+            "uid": info.uid,
+            "update_time": info.update_time.isoformat(),
+            "import_type": info.import_type,
+        }
+        async with aiofiles.open(info_path, "w", encoding="utf-8") as f:
+            await f.write(json.dumps(data, ensure_ascii=False))
+
+    async def load_summary(self, user_id: str, uid: str) -> Optional[str]:
+        """读取预计算的统计数据"""
+        summary_path = self._summary_path(user_id, uid)
+        if not summary_path.exists():
+            return None
+        async with aiofiles.open(summary_path, "r", encoding="utf-8") as f:
+            return await f.read()
+
+    async def save_summary(self, user_id: str, uid: str, data: str):
+        """保存预计算的统计数据"""
+        summary_path = self._summary_path(user_id, uid)
+        summary_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = summary_path.with_name(f"{summary_path.name}.tmp")
+        async with aiofiles.open(temp_path, "w", encoding="utf-8") as f:
+            await f.write(data)
+        temp_path.replace(summary_path)
+
+    async def remove_summary(self, user_id: str, uid: str):
+        """删除预计算的统计数据，下次读取时重新计算"""
+        self._summary_path(user_id, uid).unlink(missing_ok=True)
+
+    async def load_checkpoint(self, user_id: str, uid: str) -> Dict[str, List[int]]:
+        """读取上次中断时各卡池未完成的翻页位置"""
+        checkpoint_path = self._checkpoint_path(user_id, uid)
+        if not checkpoint_path.exists():
+            return {}
+        async with aiofiles.open(checkpoint_path, "r", encoding="utf-8") as f:
+            try:
+                return json.loads(await f.read())
+            except ValueError:
+                return {}
+
+    async def save_checkpoint(self, user_id: str, uid: str, checkpoint: Dict[str, List[int]]):
+        """保存各卡池未完成的翻页位置"""
+        checkpoint_path = self._checkpoint_path(user_id, uid)
+        checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+        async with aiofiles.open(checkpoint_path, "w", encoding="utf-8") as f:
+            await f.write(json.dumps(checkpoint))
+
+    async def remove_checkpoint(self, user_id: str, uid: str):
+        self._checkpoint_path(user_id, uid).unlink(missing_ok=True)
+
+    async def iter_pool(
+        self, user_id: str, uid: str, pool_name: str, chunk_size: int = 64 * 1024
+    ) -> AsyncIterator[GachaItem]:
+        """按存储顺序逐条读取单个卡池的记录"""
+        await self._ensure_migrated(user_id, uid)
+        pool_path = self._pool_path(user_id, uid, pool_name)
+        if not pool_path.exists():
+            return
+        async with aiofiles.open(pool_path, "r", encoding="utf-8") as f:
+            # 按块读取，逐行读取时每一行都要切换一次线程
+            rest = ""
+            while chunk := await f.read(chunk_size):
+                lines = (rest + chunk).split("\n")
+                rest = lines.pop()
+                for line in lines:
+                    if line.strip():
+                        yield _line_to_item(line)
+            if rest.strip():
+                yield _line_to_item(rest)
+
+    async def load_pool(self, user_id: str, uid: str, pool_name: str) -> List[GachaItem]:
+        """读取单个卡池按时间排序后的记录"""
+        items = [item async for item in self.iter_pool(user_id, uid, pool_name)]
+        if not await self.is_sorted(user_id, uid, pool_name):
+            items.sort(key=_sort_key)
+        return items
+
+    async def load_ids(self, user_id: str, uid: str, pool_name: str) -> Set[str]:
+        """读取单个卡池中已有记录的 id"""
+        await self._ensure_migrated(user_id, uid)
+        ids_path = self._ids_path(user_id, uid, pool_name)
+        if not ids_path.exists():
+            return set()
+        async with aiofiles.open(ids_path, "r", encoding="utf-8") as f:
+            return set((await f.read()).split())
+
+    async def is_sorted(self, user_id: str, uid: str, pool_name: str) -> bool:
+        return not self._pool_path(user_id, uid, pool_name).with_suffix(".unsorted").exists()
+
+    async def _last_item(self, user_id: str, uid: str, pool_name: str) -> Optional[GachaItem]:
+        pool_path = self._pool_path(user_id, uid, pool_name)
+        if not pool_path.exists() or pool_path.stat().st_size == 0:
+            return None
+        with open(pool_path, "rb") as f:
+            # 从文件末尾向前查找最后一行
+            f.seek(0, 2)
+            position = f.tell() - 1
+            while position > 0:
+                f.seek(position - 1)
+                if f.read(1) == b"\n":
+                    break
+                position -= 1
+            f.seek(max(position, 0))
+            return _line_to_item(f.read().decode("utf-8"))
+
+    async def append(self, user_id: str, uid: str, pool_name: str, items: Iterable[GachaItem]):
+        """追加记录，调用方需保证记录未重复"""
+        items = sorted(items, key=_sort_key)
+        if not items:
+            return
+        pool_path = self._pool_path(user_id, uid, pool_name)
+        pool_path.parent.mkdir(parents=True, exist_ok=True)
+        if await self.is_sorted(user_id, uid, pool_name):
+            last_item = await self._last_item(user_id, uid, pool_name)
+            if last_item is not None and _sort_key(items[0]) < _sort_key(last_item):
+                pool_path.with_suffix(".unsorted").touch()
+        async with aiofiles.open(pool_path, "a", encoding="utf-8") as f:
+            await f.write("".join(_item_to_line(item) for item in items))
+        async with aiofiles.open(self._ids_path(user_id, uid, pool_name), "a", encoding="utf-8") as f:
+            await f.write("".join(f"{item.id}\n" for item in items))
+
+    async def write_pool(self, user_id: str, uid: str, pool_name: str, items: List[GachaItem]):
+        """覆盖写入单个卡池的全部记录"""
+        items = sorted(items, key=_sort_key)
+        pool_path = self._pool_path(user_id, uid, pool_name)
+        pool_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = pool_path.with_name(f"{pool_path.name}.tmp")
+        async with aiofiles.open(temp_path, "w", encoding="utf-8") as f:
+            await f.write("".join(_item_to_line(item) for item in items))
+        temp_path.replace(pool_path)
+        ids_path = self._ids_path(user_id, uid, pool_name)
+        ids_temp_path = ids_path.with_name(f"{ids_path.name}.tmp")
+        async with aiofiles.open(ids_temp_path, "w", encoding="utf-8") as f:
+            await f.write("".join(f"{item.id}\n" for item in items))
+        ids_temp_path.replace(ids_path)
+        pool_path.with_suffix(".unsorted").unlink(missing_ok=True)
+
+    async def compact(self, user_id: str, uid: str):
+        """将无序的卡池重新排序写入"""
+        for pool_name in POOL_FILE_NAMES:
+            if not await self.is_sorted(user_id, uid, pool_name):
+                await self.write_pool(user_id, uid, pool_name, await self.load_pool(user_id, uid, pool_name))
+
+    async def load(self, user_id: str, uid: str) -> Optional[GachaLogInfo]:
+        """读取账号的全部抽卡记录"""
+        info = await self.load_info(user_id, uid)
+        if info is None:
+            return None
+        for pool_name in POOL_FILE_NAMES:
+            info.item_list[pool_name] = await self.load_pool(user_id, uid, pool_name)
+        return info
+
+    async def remove(self, user_id: str, uid: str) -> bool:
+        """删除账号的全部抽卡记录"""
+        removed = False
+        account_path = self.account_path(user_id, uid)
+        if account_path.exists():
+            shutil.rmtree(account_path)
+            removed = True
+        legacy_path = self.legacy_path(user_id, uid)
+        if legacy_path.exists():
+            legacy_path.unlink()
+            removed = True
+        return removed
@@ -0,0 +1,196 @@
+"""抽卡记录分析数据的预计算
+
+导入抽卡记录时按顺序将新增记录累加到各卡池的统计中，分析命令只需读取统计结果。
+"""
+import datetime
+from hashlib import sha256
+from typing import Dict, List, Optional
+
+import ujson as json
+from pydantic import BaseModel
+
+from metadata.pool.pool_200 import POOL_200
+from metadata.pool.pool_301 import POOL_301
+from metadata.pool.pool_302 import POOL_302
+from modules.gacha_log.models import GachaItem
+
+__all__ = [
+    "FiveStarSummary",
+    "FourStarSummary",
+    "UpPoolSummary",
+    "PoolSummary",
+    "GachaLogSummary",
+    "SUMMARY_VERSION",
+    "check_avatar_up",
+    "build_pool_summary",
+    "update_pool_summary",
+]
+
+UP_POOL_DATA = {"角色祈愿": POOL_301, "武器祈愿": POOL_302, "常驻祈愿": POOL_200}
+ALL_POOL_FROM = datetime.datetime(2020, 9, 28)
+# 卡池数据变化后需要重新计算统计
+SUMMARY_VERSION = sha256(json.dumps(UP_POOL_DATA, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def check_avatar_up(name: str, gacha_time: datetime.datetime) -> bool:
+    if name in {"莫娜", "七七", "迪卢克", "琴"}:
+        return False
+    elif name == "刻晴":
+        start_time = datetime.datetime.strptime("2021-02-17 18:00:00", "%Y-%m-%d %H:%M:%S")
+        end_time = datetime.datetime.strptime("2021-03-02 15:59:59", "%Y-%m-%d %H:%M:%S")
+        if not (start_time < gacha_time < end_time):
+            return False
+    elif name == "提纳里":
+        start_time = datetime.datetime.strptime("2022-08-24 06:00:00", "%Y-%m-%d %H:%M:%S")
+        end_time = datetime.datetime.strptime("2022-09-09 17:59:59", "%Y-%m-%d %H:%M:%S")
+        if not (start_time < gacha_time < end_time):
+            return False
+    return True
+
+
+class FiveStarSummary(BaseModel):
+    name: str
+    count: int
+    type: str
+    isUp: bool
+    isBig: bool
+    time: datetime.datetime
+
+
+class FourStarSummary(BaseModel):
+    name: str
+    count: int
+    type: str
+    time: datetime.datetime
+
+
+class UpPoolItemSummary(BaseModel):
+    name: str
+    type: str
+    rank_type: int
+    count: int = 0
+    last_time: datetime.datetime
+
+
+class UpPoolSummary(BaseModel):
+    """单个 UP 池时间段内的统计，与 `Pool` 的计算方式相同"""
+
+    name: str
+    from_time: datetime.datetime
+    to_time: Optional[datetime.datetime]
+    count: int = 0
+    start: Optional[datetime.datetime] = None
+    end: Optional[datetime.datetime] = None
+    items: Dict[str, UpPoolItemSummary] = {}
+
+    def contains(self, time: datetime.datetime) -> bool:
+        return self.from_time <= time and (self.to_time is None or time <= self.to_time)
+
+    def add_item(self, item: GachaItem):
+        if self.contains(item.time):
+            self.count += 1
+            if self.start is None:
+                self.start = item.time
+            self.end = item.time
+
+    def add_star(self, name: str, item_type: str, rank_type: int, time: datetime.datetime):
+        if self.contains(time):
+            if (item := self.items.get(name)) is None:
+                item = self.items[name] = UpPoolItemSummary(
+                    name=name, type=item_type, rank_type=rank_type, last_time=time
+                )
+            item.count += 1
+            item.last_time = max(item.last_time, time)
+
+    def to_list(self) -> List[dict]:
+        """与 `Pool.to_list` 顺序一致：五星在前，同星级按最近一次获得时间倒序"""
+        five = sorted((i for i in self.items.values() if i.rank_type == 5), key=lambda x: x.last_time, reverse=True)
+        four = sorted((i for i in self.items.values() if i.rank_type == 4), key=lambda x: x.last_time, reverse=True)
+        return [{"name": i.name, "type": i.type, "count": i.count, "rank_type": i.rank_type} for i in five + four]
+
+
+class PoolSummary(BaseModel):
+    """单个卡池的统计"""
+
+    total: int = 0
+    five_total: int = 0
+    four_total: int = 0
+    no_five_star: int = 0
+    no_four_star: int = 0
+    first_time: Optional[datetime.datetime] = None
+    last_time: Optional[datetime.datetime] = None
+    last_id: str = ""
+    five: List[FiveStarSummary] = []
+    four: List[FourStarSummary] = []
+    up_pools: List[UpPoolSummary] = []
+    all_pool: UpPoolSummary
+
+
+class GachaLogSummary(BaseModel):
+    version: str = SUMMARY_VERSION
+    pools: Dict[str, PoolSummary] = {}
+
+
+def _new_pool_summary(pool_name: str) -> PoolSummary:
+    return PoolSummary(
+        up_pools=[
+            UpPoolSummary(
+                name="、".join(i["five"]),
+                from_time=datetime.datetime.strptime(i["from"], "%Y-%m-%d %H:%M:%S"),
+                to_time=datetime.datetime.strptime(i["to"], "%Y-%m-%d %H:%M:%S"),
+            )
+            for i in UP_POOL_DATA.get(pool_name, [])
+        ],
+        all_pool=UpPoolSummary(name=pool_name, from_time=ALL_POOL_FROM, to_time=None),
+    )
+
+
+def update_pool_summary(pool_name: str, summary: PoolSummary, items: List[GachaItem]) -> PoolSummary:
+    """将按时间排序且位于已有记录之后的新增记录累加到统计中"""
+    for item in items:
+        summary.total += 1
+        summary.no_five_star += 1
+        summary.no_four_star += 1
+        if summary.first_time is None:
+            summary.first_time = item.time
+        summary.last_time = item.time
+        summary.last_id = item.id
+        for up_pool in summary.up_pools:
+            up_pool.add_item(item)
+        summary.all_pool.add_item(item)
+        if item.rank_type == "5":
+            summary.five_total += 1
+            five = None
+            if item.item_type == "角色" and pool_name in {"角色祈愿", "常驻祈愿"}:
+                five = FiveStarSummary(
+                    name=item.name,
+                    count=summary.no_five_star,
+                    type="角色",
+                    isUp=check_avatar_up(item.name, item.time) if pool_name == "角色祈愿" else False,
+                    isBig=(not summary.five[-1].isUp) if summary.five and pool_name == "角色祈愿" else False,
+                    time=item.time,
+                )
+            elif item.item_type == "武器" and pool_name in {"武器祈愿", "常驻祈愿"}:
+                five = FiveStarSummary(
+                    name=item.name, count=summary.no_five_star, type="武器", isUp=False, isBig=False, time=item.time
+                )
+            if five is not None:
+                summary.five.append(five)
+                for up_pool in summary.up_pools:
+                    up_pool.add_star(five.name, five.type, 5, five.time)
+                summary.all_pool.add_star(five.name, five.type, 5, five.time)
+            summary.no_five_star = 0
+        elif item.rank_type == "4":
+            summary.four_total += 1
+            if item.item_type in {"角色", "武器"}:
+                four = FourStarSummary(name=item.name, count=summary.no_four_star, type=item.item_type, time=item.time)
+                summary.four.append(four)
+                for up_pool in summary.up_pools:
+                    up_pool.add_star(four.name, four.type, 4, four.time)
+            summary.no_four_star = 0
+    return summary
+
+
+def build_pool_summary(pool_name: str, items: List[GachaItem]) -> PoolSummary:
+    """根据卡池的全部记录计算统计"""
+    return update_pool_summary(pool_name, _new_pool_summary(pool_name), items)
@@ -1,11 +1,14 @@
 import asyncio
+import hashlib
 import re
+import time
 from abc import abstractmethod
 from asyncio import Queue
-from multiprocessing import Value
+from pathlib import Path
 from ssl import SSLZeroReturnError
-from typing import AsyncIterator, ClassVar, List, Optional, Tuple, Union
+from typing import AsyncIterator, Awaitable, Callable, ClassVar, Dict, Iterable, List, Optional, Tuple, TypeVar, Union
 
+import aiofiles
 import anyio
 import ujson as json
 from bs4 import BeautifulSoup
@@ -16,10 +19,75 @@ from pydantic import (
 )
 from typing_extensions import Self
 
-__all__ = ["Model", "WikiModel", "HONEY_HOST"]
+__all__ = ["Model", "WikiModel", "HONEY_HOST", "PageCache", "PageNotCachedError"]
 
 HONEY_HOST = URL("https://genshin.honeyhunterworld.com/")
 
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class PageNotCachedError(Exception):
+    """离线模式下页面没有缓存"""
+
+    def __init__(self, url: Union[URL, str]):
+        super().__init__(f"页面没有缓存 {url}")
+        self.url = url
+
+
+class PageCache:
+    """页面的本地缓存
+
+    保存页面内容与 ETag、Last-Modified，用于发起条件请求，以及在离线时重放刷新
+
+    Args:
+        path: 缓存文件夹
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def _path(self, url: Union[URL, str]) -> Path:
+        return self.path / hashlib.sha1(str(url).encode()).hexdigest()  # nosec
+
+    async def get(self, url: Union[URL, str]) -> Optional[Tuple[str, Dict[str, str]]]:
+        """读取页面内容与用于条件请求的请求头"""
+        path = self._path(url)
+        meta_path = path.with_suffix(".json")
+        if not path.exists() or not meta_path.exists():
+            return None
+        async with aiofiles.open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.loads(await f.read())
+        async with aiofiles.open(path, "r", encoding="utf-8") as f:
+            text = await f.read()
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return text, headers
+
+    async def set(self, url: Union[URL, str], response: Response):
+        self.path.mkdir(parents=True, exist_ok=True)
+        path = self._path(url)
+        async with aiofiles.open(path, "w", encoding="utf-8") as f:
+            await f.write(response.text)
+        meta = {
+            "url": str(url),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        async with aiofiles.open(path.with_suffix(".json"), "w", encoding="utf-8") as f:
+            await f.write(json.dumps(meta))
+
+
+class _Failure:
+    def __init__(self, exception: Exception):
+        self.exception = exception
+
+
+_DONE = object()
+
 
 class Model(PydanticBaseModel):
     """基类"""
@@ -45,8 +113,20 @@ class WikiModel(Model):
         rarity (:obj:`int`): 星级
 
         _client (:class:`httpx.AsyncClient`): 发起 http 请求的 client
+        concurrency (:obj:`int`): 同时爬取的页面数
+        request_interval (:obj:`float`): 对同一个网站发起两次请求之间的最短间隔，单位为秒
+        page_cache (:class:`PageCache`): 页面的本地缓存，为 None 时不缓存
+        offline (:obj:`bool`): 只从页面缓存中读取，不发起请求
     """
     _client: ClassVar[AsyncClient] = AsyncClient()
+    concurrency: ClassVar[int] = 8
+    request_interval: ClassVar[float] = 0.2
+    page_cache: ClassVar[Optional[PageCache]] = None
+    offline: ClassVar[bool] = False
+    _host_locks: ClassVar[Dict[str, asyncio.Lock]] = {}
+    _host_last_request: ClassVar[Dict[str, float]] = {}
+    # 一次刷新中页面没有变化时直接使用已经解析的结果，刷新结束后由 `clear_parsed` 清空
+    _parsed: ClassVar[Dict[str, "WikiModel"]] = {}
 
     id: str
     name: str
@@ -67,24 +147,106 @@ class WikiModel(Model):
         """
 
     @classmethod
-    async def _client_get(cls, url: Union[URL, str], retry_times: int = 5, sleep: float = 1) -> Response:
+    async def _throttle(cls, url: Union[URL, str]):
+        """等待到距离上次对同一个网站发起请求超过 request_interval 秒"""
+        host = URL(url).host
+        lock = cls._host_locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            wait = cls._host_last_request.get(host, 0) + cls.request_interval - time.monotonic()
+            if wait > 0:
+                await anyio.sleep(wait)
+            cls._host_last_request[host] = time.monotonic()
+
+    @classmethod
+    async def _client_get(
+        cls, url: Union[URL, str], retry_times: int = 5, sleep: float = 1, headers: Optional[Dict[str, str]] = None
+    ) -> Response:
         """用自己的 client 发起 get 请求的快捷函数
 
         Args:
             url: 发起请求的 url
             retry_times: 发生错误时的重复次数。不能小于 0 .
             sleep: 发生错误后等待重试的时间，单位为秒。
+            headers: 额外的请求头
         Returns:
             返回对应的请求
         Raises:
             请求所需要的异常
         """
         for _ in range(retry_times):
+            await cls._throttle(url)
             try:
-                return await cls._client.get(url, follow_redirects=True)
+                return await cls._client.get(url, headers=headers, follow_redirects=True)
             except (HTTPError, SSLZeroReturnError):
                 await anyio.sleep(sleep)
-        return await cls._client.get(url, follow_redirects=True)  # 防止 retry_times 等于 0 的时候无法发生请求
+        await cls._throttle(url)
+        # 防止 retry_times 等于 0 的时候无法发生请求
+        return await cls._client.get(url, headers=headers, follow_redirects=True)
+
+    @classmethod
+    async def _get_page(cls, url: Union[URL, str]) -> Tuple[str, bool]:
+        """获取页面内容，有页面缓存时发起条件请求
+
+        Args:
+            url: 页面的 url
+        Returns:
+            返回页面内容，以及页面是否有变化
+        Raises:
+            PageNotCachedError: 离线模式下页面没有缓存
+        """
+        cached = await cls.page_cache.get(url) if cls.page_cache is not None else None
+        if cls.offline:
+            if cached is None:
+                raise PageNotCachedError(url)
+            return cached[0], False
+        response = await cls._client_get(url, headers=cached[1] if cached else None)
+        if response.status_code == 304 and cached is not None:
+            return cached[0], False
+        if cls.page_cache is not None and response.is_success:
+            await cls.page_cache.set(url, response)
+        return response.text, True
+
+    @staticmethod
+    async def _iter_concurrently(
+        items: Iterable[T], func: Callable[[T], Awaitable[R]], concurrency: int
+    ) -> AsyncIterator[R]:
+        """以有限的并发对每一项执行 func，按完成的顺序返回结果
+
+        任一任务出错时取消其余任务并抛出该异常，提前停止迭代时同样会取消其余任务
+
+        Args:
+            items: 需要处理的项
+            func: 处理函数
+            concurrency: 同时执行的任务数
+        Returns:
+            返回每一项的处理结果
+        """
+        pending = iter(items)
+        results: Queue = Queue()
+
+        async def worker():
+            try:
+                for item in pending:  # 所有任务共用一个迭代器
+                    await results.put(await func(item))
+            except Exception as exc:  # pylint: disable=W0703
+                await results.put(_Failure(exc))
+            else:
+                await results.put(_DONE)
+
+        tasks = [asyncio.create_task(worker()) for _ in range(max(concurrency, 1))]
+        finished = 0
+        try:
+            while finished < len(tasks):
+                result = await results.get()
+                if result is _DONE:
+                    finished += 1
+                elif isinstance(result, _Failure):
+                    raise result.exception
+                else:
+                    yield result
+        finally:
+            for task in tasks:
+                task.cancel()
 
     @classmethod
     @abstractmethod
@@ -97,6 +259,11 @@ class WikiModel(Model):
             返回对应的 WikiModel
         """
 
+    @classmethod
+    def clear_parsed(cls):
+        """清空已经解析的结果，解析结果只在一次刷新中使用，不长期占用内存"""
+        WikiModel._parsed.clear()
+
     @classmethod
     async def _scrape(cls, url: Union[URL, str]) -> Self:
         """从 url 中爬取数据，并返回对应的 Model
@@ -106,8 +273,12 @@ class WikiModel(Model):
         Returns:
             返回对应的 WikiModel
         """
-        response = await cls._client_get(url)
-        return await cls._parse_soup(BeautifulSoup(response.text, "lxml"))
+        key = f"{cls.__name__}:{url}"
+        text, changed = await cls._get_page(url)
+        if not changed and key in cls._parsed:
+            return cls._parsed[key]
+        model = cls._parsed[key] = await cls._parse_soup(BeautifulSoup(text, "lxml"))
+        return model
 
     @classmethod
     async def get_by_id(cls, id_: str) -> Self:
@@ -145,26 +316,15 @@ class WikiModel(Model):
     async def full_data_generator(cls) -> AsyncIterator[Self]:
         """Model 生成器
 
-        这是一个异步生成器，该函数在使用时会爬取所有数据，并将其转为对应的 Model，然后存至一个队列中
-        当有需要时，再一个一个地迭代取出
+        这是一个异步生成器，该函数在使用时会以有限的并发爬取所有数据，并将其转为对应的 Model，
+        按爬取完成的顺序一个一个地返回。任一页面爬取失败时停止并抛出异常
 
         Returns:
             返回能爬到的所有的 WikiModel 所组成的 List
         """
-        queue: Queue[Self] = Queue()  # 存放 Model 的队列
-        signal = Value("i", 0)  # 一个用于异步任务同步的信号
-
-        async def task(u):
-            # 包装的爬虫任务
-            await queue.put(await cls._scrape(u))  # 爬取一条数据，并将其放入队列中
-            signal.value -= 1  # 信号量减少 1 ，说明该爬虫任务已经完成
-
-        for _, url in await cls.get_name_list(with_url=True):  # 遍历爬取所有需要爬取的页面
-            signal.value += 1  # 信号量增加 1 ，说明有一个爬虫任务被添加
-            asyncio.create_task(task(url))  # 创建一个爬虫任务
-
-        while signal.value > 0 or not queue.empty():  # 当还有未完成的爬虫任务或存放数据的队列不为空时
-            yield await queue.get()  # 取出并返回一个存放的 Model
+        urls = [url for _, url in await cls.get_name_list(with_url=True)]
+        async for model in cls._iter_concurrently(urls, cls._scrape, cls.concurrency):
+            yield model
 
     def __str__(self) -> str:
         return f"<{self.__class__.__name__} {super(WikiModel, self).__str__()}>"
@@ -194,29 +354,27 @@ class WikiModel(Model):
         Returns:
             返回对应的名称列表 或者 名称与url 的列表
         """
-        urls = cls.scrape_urls()
-        queue: Queue[Union[str, Tuple[str, URL]]] = Queue()  # 存放 Model 的队列
-        signal = Value("i", len(urls))  # 一个用于异步任务同步的信号，初始值为存放所需要爬取的页面数
 
-        async def task(page: URL):
+        async def task(page: URL) -> List[Union[str, Tuple[str, URL]]]:
             """包装的爬虫任务"""
-            response = await cls._client_get(page)
+            text, _ = await cls._get_page(page)
             # 从页面中获取对应的 chaos data (未处理的json格式字符串)
-            chaos_data = re.findall(r"sortable_data\.push\((.*)\);\s*sortable_cur_page", response.text)[0]
+            chaos_data = re.findall(r"sortable_data\.push\((.*)\);\s*sortable_cur_page", text)[0]
             json_data = json.loads(chaos_data)  # 转为 json
+            result = []
             for data in json_data:  # 遍历 json
                 data_name = re.findall(r">(.*)<", data[1])[0]  # 获取 Model 的名称
                 if with_url:  # 如果需要返回对应的 url
                     data_url = HONEY_HOST.join(re.findall(r"\"(.*?)\"", data[0])[0])
-                    await queue.put((data_name, data_url))
+                    result.append((data_name, data_url))
                 else:
-                    await queue.put(data_name)
-            signal.value = signal.value - 1  # 信号量减少 1 ，说明该爬虫任务已经完成
+                    result.append(data_name)
+            return result
 
-        for url in urls:  # 遍历需要爬出的页面
-            asyncio.create_task(task(url))  # 添加爬虫任务
-        while signal.value > 0 or not queue.empty():  # 当还有未完成的爬虫任务或存放数据的队列不为空时
-            yield await queue.get()  # 取出并返回一个存放的 Model
+        # 同一页面中的结果连续返回
+        async for items in cls._iter_concurrently(cls.scrape_urls(), task, cls.concurrency):
+            for item in items:
+                yield item
 
     @classmethod
     async def get_name_list(cls, *, with_url: bool = False) -> List[Union[str, Tuple[str, URL]]]:
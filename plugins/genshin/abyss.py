@@ -1,13 +1,13 @@
 """深渊数据查询"""
 import asyncio
+import itertools
 import re
-from datetime import datetime
-from functools import lru_cache, partial
-from typing import Any, Coroutine, List, Match, Optional, Tuple, Union
+from functools import lru_cache
+from typing import Any, Coroutine, Dict, List, Optional, Sequence, Tuple
 
-import ujson as json
 from arkowrapper import ArkoWrapper
 from genshin import Client
+from genshin.models import AbyssCharacter, AbyssRankCharacter, Floor, SpiralAbyss
 from pytz import timezone
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Message, Update
 from telegram.constants import ChatAction, ParseMode
@@ -26,25 +26,110 @@ from core.user.error import UserNotFoundError
 from metadata.genshin import game_id_to_role_id
 from utils.decorators.error import error_callable
 from utils.decorators.restricts import restricts
-from utils.helpers import async_re_sub, get_genshin_client, get_public_genshin_client
+from utils.helpers import get_genshin_client, get_public_genshin_client
 from utils.log import logger
 
 TZ = timezone("Asia/Shanghai")
 cmd_pattern = r"^/abyss\s*((?:\d+)|(?:all))?\s*(pre)?"
 msg_pattern = r"^深渊数据((?:查询)|(?:总览))(上期)?\D?(\d*)?.*?$"
 
-regex_01 = r"['\"]icon['\"]:\s*['\"](.*?)['\"]"
-regex_02 = r"['\"]side_icon['\"]:\s*['\"](.*?)['\"]"
-
-
-async def replace_01(match: Match, assets_service: AssetsService) -> str:
-    aid = game_id_to_role_id(re.findall(r"UI_AvatarIcon_(.*?).png", match.group(1))[0])
-    return (await assets_service.avatar(aid).icon()).as_uri()
+# 每层图片的 file_id 缓存时间，相同的渲染数据由模板渲染结果缓存复用
+FLOOR_CACHE_TTL = 15 * 24 * 60 * 60
+AVATAR_ICON_REGEX = re.compile(r"UI_AvatarIcon_(.*?)\.png")
+
+
+def icon_role_id(icon: str) -> Optional[int]:
+    return game_id_to_role_id(AVATAR_ICON_REGEX.findall(icon)[0])
+
+
+async def abyss_render_data(
+    abyss_data: SpiralAbyss, floors: Sequence[Floor], assets_service: AssetsService
+) -> Dict[str, Any]:
+    """生成深渊模板使用的数据
+
+    只包含需要渲染的楼层，所有角色的图标与侧视图标一次性从资源服务获取
+    :param abyss_data: 深渊数据
+    :param floors: 需要渲染的楼层
+    :param assets_service: 资源服务
+    :return: 模板数据
+    """
+    ranks = {
+        name: list(getattr(abyss_data.ranks, name))
+        for name in (
+            "most_played",
+            "most_kills",
+            "strongest_strike",
+            "most_damage_taken",
+            "most_bursts_used",
+            "most_skills_used",
+        )
+    }
+    characters = [
+        character
+        for floor in floors
+        for chamber in floor.chambers
+        for battle in chamber.battles
+        for character in battle.characters
+    ]
+    icon_ids = {icon_role_id(character.icon) for character in itertools.chain(characters, *ranks.values())}
+    side_ids = {icon_role_id(character.icon) for character in itertools.chain(*ranks.values())}
+    icon_ids, side_ids = list(icon_ids), list(side_ids)
+    paths = await asyncio.gather(
+        *(assets_service.avatar(i).icon() for i in icon_ids), *(assets_service.avatar(i).side() for i in side_ids)
+    )
+    icons = {i: path.as_uri() for i, path in zip(icon_ids, paths)}
+    side_icons = {i: path.as_uri() for i, path in zip(side_ids, paths[len(icon_ids) :])}
+
+    def character_data(character: AbyssCharacter) -> Dict[str, Any]:
+        return {
+            "id": character.id,
+            "name": character.name,
+            "rarity": character.rarity,
+            "level": character.level,
+            "icon": icons[icon_role_id(character.icon)],
+        }
 
+    def rank_data(character: AbyssRankCharacter) -> Dict[str, Any]:
+        role_id = icon_role_id(character.icon)
+        return {
+            "id": character.id,
+            "rarity": character.rarity,
+            "value": character.value,
+            "icon": icons[role_id],
+            "side_icon": side_icons[role_id],
+        }
 
-async def replace_02(match: Match, assets_service: AssetsService) -> str:
-    aid = game_id_to_role_id(re.findall(r"UI_AvatarIcon_Side_(.*?).png", match.group(1))[0])
-    return (await assets_service.avatar(aid).side()).as_uri()
+    return {
+        "max_floor": abyss_data.max_floor,
+        "total_battles": abyss_data.total_battles,
+        "total_wins": abyss_data.total_wins,
+        "total_stars": abyss_data.total_stars,
+        "ranks": {name: [rank_data(i) for i in value] for name, value in ranks.items()},
+        "floors": [
+            {
+                "floor": floor.floor,
+                "stars": floor.stars,
+                "max_stars": floor.max_stars,
+                "chambers": [
+                    {
+                        "chamber": chamber.chamber,
+                        "stars": chamber.stars,
+                        "max_stars": chamber.max_stars,
+                        "battles": [
+                            {
+                                "half": battle.half,
+                                "timestamp": battle.timestamp.astimezone(TZ).strftime("%Y-%m-%d %H:%M:%S"),
+                                "characters": [character_data(i) for i in battle.characters],
+                            }
+                            for battle in chamber.battles
+                        ],
+                    }
+                    for chamber in floor.chambers
+                ],
+            }
+            for floor in floors
+        ],
+    }
 
 
 @lru_cache
@@ -199,17 +284,7 @@ class Abyss(Plugin, BasePlugin):
 
     async def get_rendered_pic(
         self, client: Client, uid: int, floor: int, total: bool, previous: bool
-    ) -> Union[
-        Tuple[
-            Union[BaseException, Any],
-            Union[BaseException, Any],
-            Union[BaseException, Any],
-            Union[BaseException, Any],
-            Union[BaseException, Any],
-        ],
-        List[RenderResult],
-        None,
-    ]:
+    ) -> Optional[List[RenderResult]]:
         """
         获取渲染后的图片
 
@@ -221,14 +296,8 @@ class Abyss(Plugin, BasePlugin):
             previous (bool): 是否为上期
 
         Returns:
-            bytes格式的图片
+            按总览、楼层顺序排列的渲染结果，没有对应楼层的数据时为 None
         """
-
-        def json_encoder(value):
-            if isinstance(value, datetime):
-                return value.astimezone(TZ).strftime("%Y-%m-%d %H:%M:%S")
-            return value
-
         abyss_data = await client.get_spiral_abyss(uid, previous=previous, lang="zh-cn")
 
         if not abyss_data.unlocked:
@@ -238,82 +307,43 @@ class Abyss(Plugin, BasePlugin):
         if (total or (floor > 0)) and not abyss_data.floors[0].chambers[0].battles:
             raise AbyssNotFoundError
 
+        if total:
+            floors = [i for i in abyss_data.floors if i.floor >= 9]
+        elif floor > 0:
+            floors = [i for i in abyss_data.floors if i.floor == floor]
+            if not floors:
+                return None
+        else:
+            floors = []
+        need_overview = total or floor < 1
+
         start_time = abyss_data.start_time.astimezone(TZ)
         time = start_time.strftime("%Y年%m月") + ("上" if start_time.day <= 15 else "下")
         stars = [i.stars for i in filter(lambda x: x.floor > 8, abyss_data.floors)]
         total_stars = f"{sum(stars)} ({'-'.join(map(str, stars))})"
 
-        render_data = {}
-        result = await async_re_sub(
-            regex_01, partial(replace_01, assets_service=self.assets_service), abyss_data.json(encoder=json_encoder)
-        )
-        result = await async_re_sub(regex_02, partial(replace_02, assets_service=self.assets_service), result)
-
-        render_data["time"] = time
-        render_data["stars"] = total_stars
-        render_data["uid"] = uid
-        render_data["floor_colors"] = {
-            1: "#374952",
-            2: "#374952",
-            3: "#55464B",
-            4: "#55464B",
-            5: "#55464B",
-            6: "#1D2A5D",
-            7: "#1D2A5D",
-            8: "#1D2A5D",
-            9: "#292B58",
-            10: "#382024",
-            11: "#252550",
-            12: "#1D2A4A",
+        data = await abyss_render_data(abyss_data, floors, self.assets_service)
+        render_data = {
+            "time": time,
+            "stars": total_stars,
+            "uid": uid,
+            "data": data,
+            "floor_colors": {
+                1: "#374952",
+                2: "#374952",
+                3: "#55464B",
+                4: "#55464B",
+                5: "#55464B",
+                6: "#1D2A5D",
+                7: "#1D2A5D",
+                8: "#1D2A5D",
+                9: "#292B58",
+                10: "#382024",
+                11: "#252550",
+                12: "#1D2A4A",
+            },
         }
-        if total:
-            avatars = await client.get_genshin_characters(uid, lang="zh-cn")
-            render_data["avatar_data"] = {i.id: i.constellation for i in avatars}
-            data = json.loads(result)
-            render_data["data"] = data
-
-            render_inputs: List[Tuple[int, Coroutine[Any, Any, RenderResult]]] = []
-
-            def overview_task():
-                return -1, self.template_service.render(
-                    "genshin/abyss/overview.html", render_data, viewport={"width": 750, "height": 580}
-                )
-
-            def floor_task(floor_index: int):
-                floor_d = data["floors"][floor_index]
-                return (
-                    floor_d["floor"],
-                    self.template_service.render(
-                        "genshin/abyss/floor.html",
-                        {
-                            **render_data,
-                            "floor": floor_d,
-                            "total_stars": f"{floor_d['stars']}/{floor_d['max_stars']}",
-                        },
-                        viewport={"width": 690, "height": 500},
-                        full_page=True,
-                        ttl=15 * 24 * 60 * 60,
-                    ),
-                )
-
-            render_inputs.append(overview_task())
-
-            for i, f in enumerate(data["floors"]):
-                if f["floor"] >= 9:
-                    render_inputs.append(floor_task(i))
-
-            render_group_inputs = list(map(lambda x: x[1], sorted(render_inputs, key=lambda x: x[0])))
-
-            return await asyncio.gather(*render_group_inputs)
-
-        elif floor < 1:
-            render_data["data"] = json.loads(result)
-            return [
-                await self.template_service.render(
-                    "genshin/abyss/overview.html", render_data, viewport={"width": 750, "height": 580}
-                )
-            ]
-        else:
+        if floor > 0:
             num_dic = {
                 "0": "",
                 "1": "一",
@@ -330,15 +360,31 @@ class Abyss(Plugin, BasePlugin):
                 render_data["floor-num"] = num
             else:
                 render_data["floor-num"] = f"十{num_dic.get(str(floor % 10))}"
-            floors = json.loads(result)["floors"]
-            if (floor_data := list(filter(lambda x: x["floor"] == floor, floors))) is None:
-                return None
+        if floors:
             avatars = await client.get_genshin_characters(uid, lang="zh-cn")
             render_data["avatar_data"] = {i.id: i.constellation for i in avatars}
-            render_data["floor"] = floor_data[0]
-            render_data["total_stars"] = f"{floor_data[0]['stars']}/{floor_data[0]['max_stars']}"
-            return [
-                await self.template_service.render(
-                    "genshin/abyss/floor.html", render_data, viewport={"width": 690, "height": 500}
+
+        def floor_task(floor_d: Dict[str, Any]) -> Coroutine[Any, Any, RenderResult]:
+            return self.template_service.render(
+                "genshin/abyss/floor.html",
+                {
+                    **render_data,
+                    "floor": floor_d,
+                    "total_stars": f"{floor_d['stars']}/{floor_d['max_stars']}",
+                },
+                viewport={"width": 690, "height": 500},
+                full_page=True,
+                ttl=FLOOR_CACHE_TTL,
+            )
+
+        render_inputs: List[Coroutine[Any, Any, RenderResult]] = []
+        if need_overview:
+            render_inputs.append(
+                self.template_service.render(
+                    "genshin/abyss/overview.html", render_data, viewport={"width": 750, "height": 580}
                 )
-            ]
+            )
+        render_inputs.extend(floor_task(floor_d) for floor_d in data["floors"])
+        results = await asyncio.gather(*render_inputs)
+
+        return results
@@ -334,15 +334,16 @@ class SetUserCookies(Plugin.Conversation, BasePlugin.Conversation):
                     return ConversationHandler.END
                 await self.user_service.add_user(user_db)
             else:
+                if add_user_command_data.region not in (RegionEnum.HYPERION, RegionEnum.HOYOLAB):
+                    await message.reply_text("数据错误")
+                    return ConversationHandler.END
+                # user 是 UserService 缓存中的对象，修改后立即保存，保存时缓存会失效
                 user_db = add_user_command_data.user
                 user_db.region = add_user_command_data.region
                 if add_user_command_data.region == RegionEnum.HYPERION:
                     user_db.yuanshen_uid = add_user_command_data.game_uid
-                elif add_user_command_data.region == RegionEnum.HOYOLAB:
-                    user_db.genshin_uid = add_user_command_data.game_uid
                 else:
-                    await message.reply_text("数据错误")
-                    return ConversationHandler.END
+                    user_db.genshin_uid = add_user_command_data.game_uid
                 await self.user_service.update_user(user_db)
             if add_user_command_data.cookies_database_data is None:
                 await self.cookies_service.add_cookies(
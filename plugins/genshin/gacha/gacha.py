@@ -151,6 +151,8 @@ class Gacha(Plugin, BasePlugin):
             banner = self.banner_cache.get(gacha_base_info.gacha_id)
             if banner is None:
                 banner = await self.handle.de_banner(gacha_base_info.gacha_id, gacha_base_info.gacha_type)
+                # 编译结果缓存在卡池中，所有用户共用
+                banner.compile()
                 self.banner_cache.setdefault(gacha_base_info.gacha_id, banner)
             return banner
 
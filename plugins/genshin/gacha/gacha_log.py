@@ -116,9 +116,10 @@ class GachaLogPlugin(Plugin.Conversation, BasePlugin.Conversation):
         try:
             out = BytesIO()
             await (await document.get_file()).download_to_memory(out=out)
+            out.seek(0)
             if file_type == "json":
-                # bytesio to json
-                data = json.loads(out.getvalue().decode("utf-8"))
+                # 导入时逐条读取
+                data = self.gacha_log.load_uigf_json(out)
             elif file_type == "xlsx":
                 data = self.gacha_log.convert_xlsx_to_uigf(out, self.zh_dict)
             else:
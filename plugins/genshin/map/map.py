@@ -1,6 +1,3 @@
-from os import sep
-
-from PIL import Image
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ChatAction
 from telegram.ext import CommandHandler, MessageHandler, filters, CallbackContext
@@ -56,12 +53,11 @@ class Map(Plugin, BasePlugin):
             await message.reply_text(text)
             return
         logger.info(f"用户: {user.full_name} [{user.id}] 使用 map 命令查询了 {resource_name}")
-        text = await self.map_helper.get_resource_map_mes(resource_name)
-        if "不知道" in text or "没有找到" in text:
+        text, image = await self.map_helper.get_resource_map_mes(resource_name)
+        if image is None:
             await message.reply_text(text, parse_mode="Markdown")
             return
-        img = Image.open(f"cache{sep}map.jpg")
-        if img.size[0] > 2048 or img.size[1] > 2048:
-            await message.reply_document(open(f"cache{sep}map.jpg", mode="rb+"), caption=text)
+        if image.width > 2048 or image.height > 2048:
+            await message.reply_document(image.data, caption=text, filename="map.jpg")
         else:
-            await message.reply_photo(open(f"cache{sep}map.jpg", mode="rb+"), caption=text)
+            await message.reply_photo(image.data, caption=text)
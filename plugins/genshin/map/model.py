@@ -1,18 +1,143 @@
+import asyncio
+import math
 import os
+import shutil
 import time
 from io import BytesIO
-from typing import Optional, List
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
 
 import httpx
 import ujson
 from PIL import Image, ImageMath
 
+from utils.cache import TTLCache
 from utils.helpers import REQUEST_HEADERS
 
-Image.MAX_IMAGE_PIXELS = None
-
 ZOOM = 0.5
 RESOURCE_ICON_OFFSET = (-int(150 * 0.5 * ZOOM), -int(150 * ZOOM))
+TILE_SIZE = 1024
+ICON_CONCURRENCY = 8
+
+
+class ResourceMapImage(NamedTuple):
+    """生成的资源点地图"""
+
+    data: bytes
+    width: int
+    height: int
+
+
+class MapTiles:
+    """切分为瓦片保存在硬盘中的地图
+
+    坐标为整张地图的像素坐标，查询时只读取与查询区域重叠的瓦片
+    :param path: 保存瓦片的文件夹
+    :param tile_size: 瓦片的边长
+    """
+
+    def __init__(self, path: Path, tile_size: int = TILE_SIZE):
+        self.path = path
+        self.tile_size = tile_size
+        self.width = 0
+        self.height = 0
+
+    def _tile_path(self, column: int, row: int) -> Path:
+        return self.path / f"{column}_{row}.jpg"
+
+    def add_slice(self, image: Image.Image, left: int, top: int):
+        """把一张地图切片切分为瓦片保存，与其他切片重叠的瓦片会合并
+        :param image: 地图切片
+        :param left: 切片左上角在整张地图中的横坐标
+        :param top: 切片左上角在整张地图中的纵坐标
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        size = self.tile_size
+        right, bottom = left + image.size[0], top + image.size[1]
+        for row in range(top // size, math.ceil(bottom / size)):
+            for column in range(left // size, math.ceil(right / size)):
+                x, y = column * size, row * size
+                path = self._tile_path(column, row)
+                if path.exists():
+                    with Image.open(path) as tile_file:
+                        tile = tile_file.convert("RGB")
+                else:
+                    tile = Image.new("RGB", (size, size))
+                box = (max(x, left), max(y, top), min(x + size, right), min(y + size, bottom))
+                tile.paste(
+                    image.crop((box[0] - left, box[1] - top, box[2] - left, box[3] - top)), (box[0] - x, box[1] - y)
+                )
+                tile.save(path, format="JPEG", quality=90)
+        self.width = max(self.width, right)
+        self.height = max(self.height, bottom)
+
+    def compose(self, box: Tuple[int, int, int, int]) -> Image.Image:
+        """拼接与区域重叠的瓦片，区域超出地图的部分为黑色
+        :param box: 区域的左上角与右下角坐标
+        :return: 区域的图片
+        """
+        x_start, y_start, x_end, y_end = box
+        size = self.tile_size
+        image = Image.new("RGB", (x_end - x_start, y_end - y_start))
+        for row in range(max(y_start, 0) // size, math.ceil(min(y_end, self.height) / size)):
+            for column in range(max(x_start, 0) // size, math.ceil(min(x_end, self.width) / size)):
+                path = self._tile_path(column, row)
+                if not path.exists():
+                    continue
+                with Image.open(path) as tile:
+                    image.paste(tile, (column * size - x_start, row * size - y_start))
+        return image
+
+
+class ResourcePoints:
+    """按资源类型分组的资源点
+
+    更新时与上次的资源点列表比较，只修改有变化的资源类型
+    """
+
+    def __init__(self):
+        self._points: Dict[int, dict] = {}
+        self._labels: Dict[str, Dict[int, Tuple[int, int]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def get(self, label_id: str) -> List[Tuple[int, int]]:
+        """资源类型的所有资源点坐标"""
+        return list(self._labels.get(label_id, {}).values())
+
+    def _remove(self, point: dict):
+        label = str(point["label_id"])
+        points = self._labels.get(label)
+        if points is not None:
+            points.pop(point["id"], None)
+            if not points:
+                del self._labels[label]
+
+    def update(self, point_list: Iterable[dict]) -> Set[str]:
+        """更新资源点
+        :param point_list: 全部资源点
+        :return: 资源点有变化的资源类型
+        """
+        points = {point["id"]: point for point in point_list}
+        changed = set()
+        for point_id, point in self._points.items():
+            if point_id not in points:
+                self._remove(point)
+                changed.add(str(point["label_id"]))
+        for point_id, point in points.items():
+            old = self._points.get(point_id)
+            position = (point["x_pos"], point["y_pos"])
+            if old is not None:
+                if old["label_id"] == point["label_id"] and (old["x_pos"], old["y_pos"]) == position:
+                    continue
+                self._remove(old)
+                changed.add(str(old["label_id"]))
+            label = str(point["label_id"])
+            self._labels.setdefault(label, {})[point_id] = position
+            changed.add(label)
+        self._points = points
+        return changed
 
 
 class MapHelper:
@@ -25,7 +150,11 @@ class MapHelper:
         self._output_dir = os.path.join(self._current_dir, cache_dir_name)
         self._resources_icon_dir = os.path.join(self._current_dir, "resources", "icon")
         self._cache_dir = os.path.join(self._current_dir, "cache")
-        self._map_dir = os.path.join(self._cache_dir, "map_icon.jpg")
+        self._map_tiles_dir = Path(self._cache_dir) / "map_tiles"
+        self._lock = asyncio.Lock()
+        self._map_cache: TTLCache[str, Tuple[int, ResourceMapImage]] = TTLCache(ttl=7 * 24 * 60 * 60, maxsize=64)
+        """生成的地图与资源点数量，按资源类型缓存，资源点或地图更新时删除"""
+        self._map_slices: List[str] = []
         self.client = httpx.AsyncClient(headers=REQUEST_HEADERS, timeout=10.0)
         self.all_resource_type: dict = {}
         """这个字典保存所有资源类型
@@ -62,6 +191,9 @@ class MapHelper:
             "display_state": 1
         }
         """
+        self.resource_points = ResourcePoints()
+        """按资源类型分组的资源点
+        """
         self.date: str = ""
         """记录上次更新"all_resource_point_list"的日期
         """
@@ -70,8 +202,8 @@ class MapHelper:
         """center
         """
 
-        self.map_icon: Optional[Image] = None
-        """map_icon
+        self.map_tiles: Optional[MapTiles] = None
+        """切分为瓦片的地图
         """
 
     async def download_icon(self, url):
@@ -97,13 +229,21 @@ class MapHelper:
         return resp.json()
 
     async def init_point_list_and_map(self):
-        await self.up_label_and_point_list()
-        await self.up_map()
-
-    async def up_map(self):
-        """更新地图文件 并按照资源点的范围自动裁切掉不需要的地方
-        裁切地图需要最新的资源点位置，所以要先调用 up_label_and_point_list 再更新地图
-        :return: None
+        async with self._lock:
+            if self.date == time.strftime("%d") and self.map_tiles is not None:
+                return
+            changed = await self.up_label_and_point_list()
+            # 资源点已经更新，即使之后更新地图失败，也不能再使用这些资源类型的旧地图
+            for label_id in changed:
+                self._map_cache.pop(label_id)
+            if await self.up_map():
+                self._map_cache.clear()
+            # 两步都成功后才记录更新日期，失败时下次查询会重新更新
+            self.date = time.strftime("%d")
+
+    async def up_map(self) -> bool:
+        """更新地图文件，逐张下载地图切片并切分为瓦片保存到硬盘，地图切片没有变化时跳过
+        :return: 地图是否有更新
         """
         map_info = await self.download_json(self.MAP_URL)
         map_info = map_info["data"]["info"]["detail"]
@@ -111,96 +251,112 @@ class MapHelper:
 
         map_url_list = map_info["slices"][0]
         origin = map_info["origin"]
+        map_slices = [i["url"] for i in map_url_list]
+        if self.map_tiles is not None and map_slices == self._map_slices and origin == self.center:
+            return False
 
-        x_start = map_info["total_size"][1]
-        y_start = map_info["total_size"][1]
-        x_end = 0
-        y_end = 0
-        for resource_point in self.all_resource_point_list:
-            x_pos = resource_point["x_pos"] + origin[0]
-            y_pos = resource_point["y_pos"] + origin[1]
-            x_start = min(x_start, x_pos)
-            y_start = min(y_start, y_pos)
-            x_end = max(x_end, x_pos)
-            y_end = max(y_end, y_pos)
-
-        x_start -= 200
-        y_start -= 200
-        x_end += 200
-        y_end += 200
-
-        self.center = [origin[0] - x_start, origin[1] - y_start]
-        x = int(x_end - x_start)
-        y = int(y_end - y_start)
-        self.map_icon = Image.new("RGB", (x, y))
+        loop = asyncio.get_running_loop()
+        self._map_tiles_dir.mkdir(parents=True, exist_ok=True)
+        map_tiles = MapTiles(self._map_tiles_dir / time.strftime("%Y%m%d%H%M%S"))
         x_offset = 0
         for i in map_url_list:
             map_url = i["url"]
             map_icon = await self.download_icon(map_url)
-            self.map_icon.paste(map_icon, (int(-x_start) + x_offset, int(-y_start)))
+            await loop.run_in_executor(None, map_tiles.add_slice, map_icon, x_offset, 0)
             x_offset += map_icon.size[0]
 
-    async def up_label_and_point_list(self):
+        # 上一份瓦片可能还在被正在生成的地图使用，只删除更早的
+        previous = self.map_tiles
+        self.center = origin
+        self.map_tiles = map_tiles
+        self._map_slices = map_slices
+        for path in self._map_tiles_dir.iterdir():
+            if path not in (map_tiles.path, previous and previous.path):
+                shutil.rmtree(path, ignore_errors=True)
+        return True
+
+    async def up_label_and_point_list(self) -> Set[str]:
         """更新label列表和资源点列表
-        :return:
+        :return: 资源点有变化的资源类型
         """
         label_data = await self.download_json(self.LABEL_URL)
+        sublists = []
         for label in label_data["data"]["tree"]:
             self.all_resource_type[str(label["id"])] = label
             for sublist in label["children"]:
                 self.all_resource_type[str(sublist["id"])] = sublist
                 self.can_query_type_list[sublist["name"]] = str(sublist["id"])
-                await self.up_icon_image(sublist)
+                sublists.append(sublist)
             label["children"] = []
+        semaphore = asyncio.Semaphore(ICON_CONCURRENCY)
+        await asyncio.gather(*(self.up_icon_image(sublist, semaphore) for sublist in sublists))
         test = await self.download_json(self.POINT_LIST_URL)
         self.all_resource_point_list = test["data"]["point_list"]
-        self.date = time.strftime("%d")
+        return self.resource_points.update(self.all_resource_point_list)
 
-    async def up_icon_image(self, sublist: dict):
+    async def up_icon_image(self, sublist: dict, semaphore: Optional[asyncio.Semaphore] = None):
         """检查是否有图标，没有图标下载保存到本地
         :param sublist:
+        :param semaphore: 限制同时下载的图标数
         :return:
         """
         icon_id = sublist["id"]
         icon_path = os.path.join(self._cache_dir, f"{icon_id}.png")
 
         if not os.path.exists(icon_path):
-            icon_url = sublist["icon"]
-            icon = await self.download_icon(icon_url)
-            icon = icon.resize((150, 150))
-
-            box_alpha = Image.open(f"resources{os.sep}icon{os.sep}box_alpha.png").getchannel("A")
-            box = Image.open(f"resources{os.sep}icon{os.sep}box.png")
-
-            try:
-                icon_alpha = icon.getchannel("A")
-                icon_alpha = ImageMath.eval("convert(a*b/256, 'L')", a=icon_alpha, b=box_alpha)
-            except ValueError:
-                # 米游社的图有时候会没有alpha导致报错，这时候直接使用box_alpha当做alpha就行
-                icon_alpha = box_alpha
-
-            icon2 = Image.new("RGBA", (150, 150), "#00000000")
-            icon2.paste(icon, (0, -10))
-
-            bg = Image.new("RGBA", (150, 150), "#00000000")
-            bg.paste(icon2, mask=icon_alpha)
-            bg.paste(box, mask=box)
-
-            with open(icon_path, "wb") as icon_file:
-                bg.save(icon_file)
-
-    async def get_resource_map_mes(self, name):
+            if semaphore is None:
+                icon = await self.download_icon(sublist["icon"])
+            else:
+                async with semaphore:
+                    icon = await self.download_icon(sublist["icon"])
+            # 图片处理会阻塞，在线程中运行
+            await asyncio.get_running_loop().run_in_executor(None, self.save_icon_image, icon, icon_path)
+
+    @staticmethod
+    def save_icon_image(icon: Image.Image, icon_path: str):
+        """给图标加上边框后保存"""
+        icon = icon.resize((150, 150))
+
+        box_alpha = Image.open(f"resources{os.sep}icon{os.sep}box_alpha.png").getchannel("A")
+        box = Image.open(f"resources{os.sep}icon{os.sep}box.png")
+
+        try:
+            icon_alpha = icon.getchannel("A")
+            icon_alpha = ImageMath.eval("convert(a*b/256, 'L')", a=icon_alpha, b=box_alpha)
+        except ValueError:
+            # 米游社的图有时候会没有alpha导致报错，这时候直接使用box_alpha当做alpha就行
+            icon_alpha = box_alpha
+
+        icon2 = Image.new("RGBA", (150, 150), "#00000000")
+        icon2.paste(icon, (0, -10))
+
+        bg = Image.new("RGBA", (150, 150), "#00000000")
+        bg.paste(icon2, mask=icon_alpha)
+        bg.paste(box, mask=box)
+
+        # 先写入临时文件，避免其他请求读取到不完整的图标
+        with open(f"{icon_path}.tmp", "wb") as icon_file:
+            bg.save(icon_file, format="PNG")
+        os.replace(f"{icon_path}.tmp", icon_path)
+
+    async def get_resource_map_mes(self, name) -> Tuple[str, Optional[ResourceMapImage]]:
         if self.date != time.strftime("%d"):
             await self.init_point_list_and_map()
         if name not in self.can_query_type_list:
-            return f"派蒙还不知道 {name} 在哪里呢，可以发送 `/map list` 查看资源列表"
+            return f"派蒙还不知道 {name} 在哪里呢，可以发送 `/map list` 查看资源列表", None
         resource_id = self.can_query_type_list[name]
-        map_res = ResourceMap(self.all_resource_point_list, self.map_icon, self.center, resource_id)
-        count = map_res.get_resource_count()
-        if not count:
-            return f"派蒙没有找到 {name} 的位置，可能米游社wiki还没更新"
-        map_res.gen_jpg()
-        return f"派蒙一共找到 {name} 的 {count} 个位置点\n* 数据来源于米游社wiki"
+        if (cached := self._map_cache.get(resource_id)) is None:
+            map_res = ResourceMap(
+                self.resource_points.get(resource_id), self.map_tiles, self.center, resource_id, self._cache_dir
+            )
+            count = map_res.get_resource_count()
+            if not count:
+                return f"派蒙没有找到 {name} 的位置，可能米游社wiki还没更新", None
+            image = await asyncio.get_running_loop().run_in_executor(None, map_res.gen_jpg)
+            self._map_cache.set(resource_id, (count, image))
+        else:
+            count, image = cached
+        return f"派蒙一共找到 {name} 的 {count} 个位置点\n* 数据来源于米游社wiki", image
 
     def get_resource_list_mes(self):
         temp = {list_id: [] for list_id in self.all_resource_type if self.all_resource_type[list_id]["depth"] == 1}
@@ -223,51 +379,53 @@ class MapHelper:
 
 
 class ResourceMap:
-    def __init__(self, all_resource_point_list: List[dict], map_icon: Image, center: List[float], resource_id: int):
-        self.all_resource_point_list = all_resource_point_list
+    def __init__(
+        self,
+        points: List[Tuple[int, int]],
+        map_tiles: MapTiles,
+        center: List[float],
+        resource_id: str,
+        icon_dir: Optional[str] = None,
+    ):
+        self.points = points
         self.resource_id = resource_id
+        self.icon_dir = icon_dir
         self.center = center
-        self.map_image = map_icon.copy()
-        self.map_size = self.map_image.size
+        self.map_tiles = map_tiles
         # 地图要要裁切的左上角和右下角坐标
         # 这里初始化为地图的大小
-        self.x_start = self.map_size[0]
-        self.y_start = self.map_size[1]
+        self.x_start = map_tiles.width
+        self.y_start = map_tiles.height
         self.x_end = 0
         self.y_end = 0
-        resource_icon = Image.open(self.get_icon_path())
-        self.resource_icon = resource_icon.resize((int(150 * ZOOM), int(150 * ZOOM)))
         self.resource_xy_list = self.get_resource_point_list()
 
     def get_icon_path(self):
         # 检查有没有图标，有返回正确图标，没有返回默认图标
-        icon_path = os.path.join(f"resources{os.sep}icon", f"{self.resource_id}.png")
-        if os.path.exists(icon_path):
-            return icon_path
+        for icon_dir in (self.icon_dir, f"resources{os.sep}icon"):
+            if icon_dir is None:
+                continue
+            icon_path = os.path.join(icon_dir, f"{self.resource_id}.png")
+            if os.path.exists(icon_path):
+                return icon_path
         return os.path.join(f"resources{os.sep}icon{os.sep}0.png")
 
     def get_resource_point_list(self):
-        temp_list = []
-        for resource_point in self.all_resource_point_list:
-            if str(resource_point["label_id"]) == self.resource_id:
-                # 获取xy坐标，然后加上中心点的坐标完成坐标转换
-                x = resource_point["x_pos"] + self.center[0]
-                y = resource_point["y_pos"] + self.center[1]
-                temp_list.append((int(x), int(y)))
-        return temp_list
-
-    def paste(self):
+        # 获取xy坐标，然后加上中心点的坐标完成坐标转换
+        return [(int(x + self.center[0]), int(y + self.center[1])) for x, y in self.points]
+
+    def paste(self, map_image: Image.Image):
+        with Image.open(self.get_icon_path()) as icon:
+            resource_icon = icon.resize((int(150 * ZOOM), int(150 * ZOOM)))
         for x, y in self.resource_xy_list:
             # 把资源图片贴到地图上
             # 这时地图已经裁切过了，要以裁切后的地图左上角为中心再转换一次坐标
             x -= self.x_start
             y -= self.y_start
-            self.map_image.paste(
-                self.resource_icon, (x + RESOURCE_ICON_OFFSET[0], y + RESOURCE_ICON_OFFSET[1]), self.resource_icon
-            )
+            map_image.paste(resource_icon, (x + RESOURCE_ICON_OFFSET[0], y + RESOURCE_ICON_OFFSET[1]), resource_icon)
 
     def crop(self):
-        # 把大地图裁切到只保留资源图标位置
+        # 计算只保留资源图标位置的区域
         for x, y in self.resource_xy_list:
             # 找出4个方向最远的坐标，用于后边裁切
             self.x_start = min(x, self.x_start)
@@ -291,16 +449,14 @@ class ResourceMap:
             self.y_start = center - 500
             self.y_end = center + 500
 
-        self.map_image = self.map_image.crop((self.x_start, self.y_start, self.x_end, self.y_end))
-
-    def gen_jpg(self):
-        if not self.resource_xy_list:
-            return "没有这个资源的信息"
-        if not os.path.exists("cache"):
-            os.mkdir("cache")  # 查找 cache 目录 (缓存目录) 是否存在，如果不存在则创建
+    def gen_jpg(self) -> ResourceMapImage:
+        """只拼接资源点所在区域的瓦片并贴上资源图标，会阻塞，需要在线程中运行"""
         self.crop()
-        self.paste()
-        self.map_image.save(f"cache{os.sep}map.jpg", format="JPEG")
+        map_image = self.map_tiles.compose((self.x_start, self.y_start, self.x_end, self.y_end))
+        self.paste(map_image)
+        buffer = BytesIO()
+        map_image.save(buffer, format="JPEG")
+        return ResourceMapImage(buffer.getvalue(), *map_image.size)
 
     def get_resource_count(self):
         return len(self.resource_xy_list)
@@ -36,7 +36,7 @@ from utils.bot import get_args
 from utils.decorators.error import error_callable
 from utils.decorators.restricts import restricts
 from utils.enkanetwork import RedisCache
-from utils.helpers import url_to_file
+from utils.helpers import urls_to_files
 from utils.log import logger
 from utils.models.base import RegionEnum
 from utils.patch.aiohttp import AioHttpTimeoutException
@@ -346,22 +346,17 @@ class RenderTemplate:
 
     async def cache_images(self) -> None:
         """缓存所有图片到本地"""
-        # TODO: 并发下载所有资源
         c = self.character
-        # 角色
-        c.image.banner.url = await url_to_file(c.image.banner.url)
-
-        # 技能
-        for item in c.skills:
-            item.icon.url = await url_to_file(item.icon.url)
-
-        # 命座
-        for item in c.constellations:
-            item.icon.url = await url_to_file(item.icon.url)
-
-        # 装备，包括圣遗物和武器
-        for item in c.equipments:
-            item.detail.icon.url = await url_to_file(item.detail.icon.url)
+        images = [
+            c.image.banner,  # 角色
+            *(item.icon for item in c.skills),  # 技能
+            *(item.icon for item in c.constellations),  # 命座
+            *(item.detail.icon for item in c.equipments),  # 装备，包括圣遗物和武器
+        ]
+        urls = [image.url for image in images]
+        files = await urls_to_files(urls)
+        for image, url in zip(images, urls):
+            image.url = files[url]
 
     def find_weapon(self) -> Union[Equipments, None]:
         """在 equipments 数组中找到武器，equipments 数组包含圣遗物和武器"""
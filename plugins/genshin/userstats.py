@@ -21,7 +21,7 @@ from core.template.services import TemplateService
 from core.user.error import UserNotFoundError
 from utils.decorators.error import error_callable
 from utils.decorators.restricts import restricts
-from utils.helpers import url_to_file, get_genshin_client, get_public_genshin_client
+from utils.helpers import urls_to_files, get_genshin_client, get_public_genshin_client
 from utils.log import logger
 
 
@@ -130,10 +130,9 @@ class UserStatsPlugins(Plugin, BasePlugin):
     @staticmethod
     async def cache_images(data: GenshinUserStats) -> None:
         """缓存所有图片到本地"""
-        # TODO: 并发下载所有资源
-
         # 探索地区
+        files = await urls_to_files(url for item in data.explorations for url in (item.icon, item.cover))
         for item in data.explorations:
             item.__config__.allow_mutation = True
-            item.icon = await url_to_file(item.icon)
-            item.cover = await url_to_file(item.cover)
+            item.icon = files[item.icon]
+            item.cover = files[item.cover]
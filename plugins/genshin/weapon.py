@@ -54,12 +54,8 @@ class WeaponPlugin(Plugin, BasePlugin):
             return
         weapon_name = weaponToName(weapon_name)
         logger.info(f"用户 {user.full_name}[{user.id}] 查询武器命令请求 || 参数 weapon_name={weapon_name}")
-        weapons_list = await self.wiki_service.get_weapons_list()
-        for weapon in weapons_list:
-            if weapon.name == weapon_name:
-                weapon_data = weapon
-                break
-        else:
+        weapon_data = await self.wiki_service.get_weapons(weapon_name)
+        if weapon_data is None:
             reply_message = await message.reply_text(
                 f"没有找到 {weapon_name}", reply_markup=InlineKeyboardMarkup(self.KEYBOARD)
             )
@@ -70,7 +66,7 @@ class WeaponPlugin(Plugin, BasePlugin):
         await message.reply_chat_action(ChatAction.TYPING)
 
         async def input_template_data(_weapon_data: Weapon):
-            if weapon.rarity > 2:
+            if _weapon_data.rarity > 2:
                 bonus = _weapon_data.stats[-1].bonus
                 if "%" in bonus:
                     bonus = str(round(float(bonus.rstrip("%")))) + "%"
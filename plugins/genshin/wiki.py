@@ -14,8 +14,9 @@ class Wiki(Plugin):
 
     @handler(CommandHandler, command="refresh_wiki", block=False)
     @bot_admins_rights_check
-    async def refresh_wiki(self, update: Update, _: CallbackContext):
+    async def refresh_wiki(self, update: Update, context: CallbackContext):
         message = update.effective_message
+        offline = "offline" in (context.args or [])
         await message.reply_text("正在刷新Wiki缓存，请稍等")
-        await self.wiki_service.refresh_wiki()
+        await self.wiki_service.refresh_wiki(offline=offline)
         await message.reply_text("刷新Wiki缓存成功")
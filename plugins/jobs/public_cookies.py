@@ -25,3 +25,8 @@ class PublicCookies(Plugin):
         logger.info("正在刷新公共Cookies池")
         await self.public_cookies_service.refresh()
         logger.success("刷新公共Cookies池成功")
+
+    @job.run_repeating(interval=datetime.timedelta(hours=1), name="PublicCookiesRevalidate")
+    async def revalidate(self, _: CallbackContext):
+        logger.debug("正在检查公共Cookies池")
+        await self.public_cookies_service.revalidate()
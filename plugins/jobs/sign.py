@@ -1,7 +1,11 @@
+import asyncio
 import datetime
+import random
+import time
+from typing import Dict, List, Optional, Tuple
 
 from aiohttp import ClientConnectorError
-from genshin import GenshinException, AlreadyClaimed, InvalidCookies
+from genshin import GenshinException, AlreadyClaimed, InvalidCookies, types
 from httpx import TimeoutException
 from telegram.constants import ParseMode
 from telegram.error import BadRequest, Forbidden
@@ -9,18 +13,87 @@ from telegram.ext import CallbackContext
 
 from core.base.redisdb import RedisDB
 from core.cookies import CookiesService
+from core.cookies.error import CookiesNotFoundError
+from core.cookies.models import Cookies
 from core.plugin import Plugin, job
-from core.sign.models import SignStatusEnum
+from core.sign.models import Sign, SignStatusEnum
 from core.sign.services import SignServices
 from core.user import UserService
+from core.user.models import User
 from plugins.genshin.sign import SignSystem, NeedChallenge
 from plugins.system.errorhandler import notice_chat_id
 from plugins.system.sign_status import SignStatus
-from utils.helpers import get_genshin_client
+from utils.helpers import create_genshin_client
 from utils.log import logger
+from utils.models.base import RegionEnum
+
+
+class TokenBucket:
+    """令牌桶，每秒补充 `rate` 个令牌，最多积攒 `capacity` 个"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class SignProgress:
+    """统计签到进度，定期输出吞吐量与预计剩余时间"""
+
+    def __init__(self, title: str, total: int, interval: float = 60):
+        self.title = title
+        self.total = total
+        self.interval = interval
+        self.finished = 0
+        self._start = self._last_report = time.monotonic()
+
+    def done(self):
+        self.finished += 1
+        if time.monotonic() - self._last_report >= self.interval:
+            self.report()
+
+    def report(self):
+        now = time.monotonic()
+        self._last_report = now
+        elapsed = now - self._start
+        speed = self.finished / elapsed if elapsed > 0 else 0
+        eta = (self.total - self.finished) / speed if speed > 0 else 0
+        logger.info(
+            "%s进度 %s/%s 用时 %s 速度 %.2f 个/分钟 预计剩余 %s",
+            self.title,
+            self.finished,
+            self.total,
+            datetime.timedelta(seconds=int(elapsed)),
+            speed * 60,
+            datetime.timedelta(seconds=int(eta)),
+        )
 
 
 class SignJob(Plugin):
+    # 同时签到的账号数
+    CONCURRENCY = 16
+    # 各服务器每秒发起的签到数与允许的突发数
+    REGION_RATE = {RegionEnum.HYPERION: (0.5, 2), RegionEnum.HOYOLAB: (2, 5)}
+    # 取得令牌前随机等待的最长秒数，避免请求集中在同一时刻
+    REGION_JITTER = {RegionEnum.HYPERION: 10, RegionEnum.HOYOLAB: 3}
+    # 每积累多少条状态写入一次数据库
+    BATCH_SIZE = 100
+    # 每次从数据库读取的签到记录数
+    PAGE_SIZE = 1000
+
     def __init__(
         self,
         sign_service: SignServices = None,
@@ -33,73 +106,135 @@ class SignJob(Plugin):
         self.user_service = user_service
         self.sign_system = SignSystem(redis)
 
+    @staticmethod
+    def sign_statuses(job_name: str) -> List[Optional[SignStatusEnum]]:
+        """需要签到的签到状态，None 表示从未签到。Cookie无效、通知失败与触发验证码的用户不再自动签到"""
+        if job_name == "SignJob":
+            return [SignStatusEnum.STATUS_SUCCESS, SignStatusEnum.ALREADY_CLAIMED]
+        return [None, SignStatusEnum.GENSHIN_EXCEPTION, SignStatusEnum.TIMEOUT_ERROR, SignStatusEnum.BAD_REQUEST]
+
+    async def sign_one(
+        self,
+        context: CallbackContext,
+        sign_db: Sign,
+        user: User,
+        cookies: Optional[Cookies],
+        buckets: Dict[RegionEnum, TokenBucket],
+        title: str,
+    ) -> bool:
+        """签到并通知用户
+        :return: 是否需要保存签到状态
+        """
+        user_id = sign_db.user_id
+        try:
+            if cookies is None:
+                raise CookiesNotFoundError(user_id)
+            client = create_genshin_client(user, cookies)
+            region = RegionEnum.HYPERION if client.region == types.Region.CHINESE else RegionEnum.HOYOLAB
+            await asyncio.sleep(random.uniform(0, self.REGION_JITTER[region]))  # nosec
+            await buckets[region].acquire()
+            text = await self.sign_system.start_sign(client, is_raise=True, title=title)
+            sign_db.status = SignStatusEnum.STATUS_SUCCESS
+        except InvalidCookies:
+            text = "自动签到执行失败，Cookie无效"
+            sign_db.status = SignStatusEnum.INVALID_COOKIES
+        except AlreadyClaimed:
+            text = "今天旅行者已经签到过了~"
+            sign_db.status = SignStatusEnum.ALREADY_CLAIMED
+        except GenshinException as exc:
+            text = f"自动签到执行失败，API返回信息为 {str(exc)}"
+            sign_db.status = SignStatusEnum.GENSHIN_EXCEPTION
+        except TimeoutException:
+            text = "签到失败了呜呜呜 ~ 服务器连接超时 服务器熟啦 ~ "
+            sign_db.status = SignStatusEnum.TIMEOUT_ERROR
+        except ClientConnectorError as exc:
+            logger.warning(f"aiohttp 请求错误 {repr(exc)}")
+            text = "签到失败了呜呜呜 ~ 链接服务器发生错误 服务器熟啦 ~ "
+            sign_db.status = SignStatusEnum.TIMEOUT_ERROR
+        except NeedChallenge:
+            text = "签到失败，触发验证码风控，自动签到自动关闭"
+            sign_db.status = SignStatusEnum.NEED_CHALLENGE
+        except Exception as exc:
+            logger.error(f"执行自动签到时发生错误 用户UID[{user_id}]")
+            logger.exception(exc)
+            text = "签到失败了呜呜呜 ~ 执行自动签到时发生错误"
+        if sign_db.chat_id < 0:
+            text = f'<a href="tg://user?id={sign_db.user_id}">NOTICE {sign_db.user_id}</a>\n\n{text}'
+        try:
+            await context.bot.send_message(sign_db.chat_id, text, parse_mode=ParseMode.HTML)
+        except BadRequest as exc:
+            logger.error(f"执行自动签到时发生错误 用户UID[{user_id}]")
+            logger.exception(exc)
+            sign_db.status = SignStatusEnum.BAD_REQUEST
+        except Forbidden as exc:
+            logger.error(f"执行自动签到时发生错误 用户UID[{user_id}]")
+            logger.exception(exc)
+            sign_db.status = SignStatusEnum.FORBIDDEN
+        except Exception as exc:
+            logger.error(f"执行自动签到时发生错误 用户UID[{user_id}]")
+            logger.exception(exc)
+            return False
+        sign_db.time_updated = datetime.datetime.now()
+        return True
+
     @job.run_daily(time=datetime.time(hour=0, minute=1, second=0), name="SignJob")
     async def sign(self, context: CallbackContext):
+        title = "自动签到" if context.job.name == "SignJob" else "自动重新签到"
         logger.info("正在执行自动签到" if context.job.name == "SignJob" else "正在执行自动重签")
-        sign_list = await self.sign_service.get_all()
-        for sign_db in sign_list:
-            user_id = sign_db.user_id
-            if sign_db.status in [
-                SignStatusEnum.INVALID_COOKIES,
-                SignStatusEnum.FORBIDDEN,
-                SignStatusEnum.NEED_CHALLENGE,
-            ]:
-                continue
-            if context.job.name == "SignJob":
-                if sign_db.status not in [SignStatusEnum.STATUS_SUCCESS, SignStatusEnum.ALREADY_CLAIMED]:
-                    continue
-            elif context.job.name == "SignAgainJob" and sign_db.status in [
-                SignStatusEnum.STATUS_SUCCESS,
-                SignStatusEnum.ALREADY_CLAIMED,
-            ]:
-                continue
+        statuses = self.sign_statuses(context.job.name)
+        queue: "asyncio.Queue[Optional[Tuple[Sign, User, Optional[Cookies]]]]" = asyncio.Queue(self.CONCURRENCY * 4)
+        buckets = {region: TokenBucket(rate, capacity) for region, (rate, capacity) in self.REGION_RATE.items()}
+        progress = SignProgress(title, await self.sign_service.count(statuses))
+        pending: List[Sign] = []
+
+        async def producer():
             try:
-                client = await get_genshin_client(user_id)
-                text = await self.sign_system.start_sign(
-                    client, is_sleep=True, is_raise=True, title="自动签到" if context.job.name == "SignJob" else "自动重新签到"
-                )
-                sign_db.status = SignStatusEnum.STATUS_SUCCESS
-            except InvalidCookies:
-                text = "自动签到执行失败，Cookie无效"
-                sign_db.status = SignStatusEnum.INVALID_COOKIES
-            except AlreadyClaimed:
-                text = "今天旅行者已经签到过了~"
-                sign_db.status = SignStatusEnum.ALREADY_CLAIMED
-            except GenshinException as exc:
-                text = f"自动签到执行失败，API返回信息为 {str(exc)}"
-                sign_db.status = SignStatusEnum.GENSHIN_EXCEPTION
-            except TimeoutException:
-                text = "签到失败了呜呜呜 ~ 服务器连接超时 服务器熟啦 ~ "
-                sign_db.status = SignStatusEnum.TIMEOUT_ERROR
-            except ClientConnectorError as exc:
-                logger.warning(f"aiohttp 请求错误 {repr(exc)}")
-                text = "签到失败了呜呜呜 ~ 链接服务器发生错误 服务器熟啦 ~ "
-                sign_db.status = SignStatusEnum.TIMEOUT_ERROR
-            except NeedChallenge:
-                text = "签到失败，触发验证码风控，自动签到自动关闭"
-                sign_db.status = SignStatusEnum.NEED_CHALLENGE
-            except Exception as exc:
-                logger.error(f"执行自动签到时发生错误 用户UID[{user_id}]")
-                logger.exception(exc)
-                text = "签到失败了呜呜呜 ~ 执行自动签到时发生错误"
-            if sign_db.chat_id < 0:
-                text = f'<a href="tg://user?id={sign_db.user_id}">NOTICE {sign_db.user_id}</a>\n\n{text}'
+                async for page in self.sign_service.iter_with_accounts(statuses, self.PAGE_SIZE):
+                    for item in page:
+                        await queue.put(item)
+            finally:
+                for _ in range(self.CONCURRENCY):
+                    await queue.put(None)
+
+        async def flush():
+            if not pending:
+                return
+            signs = pending.copy()
+            pending.clear()
             try:
-                await context.bot.send_message(sign_db.chat_id, text, parse_mode=ParseMode.HTML)
-            except BadRequest as exc:
-                logger.error(f"执行自动签到时发生错误 用户UID[{user_id}]")
-                logger.exception(exc)
-                sign_db.status = SignStatusEnum.BAD_REQUEST
-            except Forbidden as exc:
-                logger.error(f"执行自动签到时发生错误 用户UID[{user_id}]")
+                await self.sign_service.update_many(signs)
+            except Exception as exc:  # pylint: disable=W0703
+                logger.error("保存签到状态时发生错误")
                 logger.exception(exc)
-                sign_db.status = SignStatusEnum.FORBIDDEN
-            except Exception as exc:
-                logger.error(f"执行自动签到时发生错误 用户UID[{user_id}]")
+
+        async def worker():
+            while (item := await queue.get()) is not None:
+                sign_db, user, cookies = item
+                try:
+                    if await self.sign_one(context, sign_db, user, cookies, buckets, title):
+                        pending.append(sign_db)
+                        if len(pending) >= self.BATCH_SIZE:
+                            await flush()
+                except Exception as exc:  # pylint: disable=W0703
+                    logger.error(f"执行自动签到时发生错误 用户UID[{sign_db.user_id}]")
+                    logger.exception(exc)
+                progress.done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.CONCURRENCY)]
+        try:
+            try:
+                await producer()
+            except Exception as exc:  # pylint: disable=W0703
+                logger.error("读取需要签到的用户时发生错误")
                 logger.exception(exc)
-                continue
-            sign_db.time_updated = datetime.datetime.now()
-            await self.sign_service.update(sign_db)
+            # 生产者结束或出错时都会放入结束标记，等待已经取出的用户签到完成
+            await asyncio.gather(*workers)
+        finally:
+            # 任务被取消时一并取消工作协程，已经完成的签到仍然保存
+            for task in workers:
+                task.cancel()
+            await flush()
+            progress.report()
         logger.info("执行自动签到完成" if context.job.name == "SignJob" else "执行自动重签完成")
         if context.job.name == "SignJob":
             context.job_queue.run_once(self.sign, when=60, name="SignAgainJob")
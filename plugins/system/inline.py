@@ -20,6 +20,9 @@ from core.wiki import WikiService
 from utils.decorators.error import error_callable
 from utils.log import logger
 
+# Telegram 每页最多显示 50 个 inline 结果
+INLINE_SEARCH_AMOUNT = 50
+
 
 class Inline(Plugin):
     """Inline模块"""
@@ -144,7 +147,7 @@ class Inline(Plugin):
                         )
                     )
             else:
-                simple_search_results = await self.search_service.search(args[0])
+                simple_search_results = await self.search_service.search(args[0], INLINE_SEARCH_AMOUNT)
                 if simple_search_results:
                     results_list.append(
                         InlineQueryResultArticle(
@@ -0,0 +1,35 @@
+from telegram import Update
+from telegram.ext import CommandHandler, CallbackContext
+
+from core.cookies import PublicCookiesService
+from core.plugin import Plugin, handler
+from utils.decorators.admins import bot_admins_rights_check
+from utils.log import logger
+from utils.models.base import RegionEnum
+
+
+class PublicCookiesStatus(Plugin):
+    def __init__(self, public_cookies_service: PublicCookiesService = None):
+        self.public_cookies_service = public_cookies_service
+
+    @handler(CommandHandler, command="public_cookies_status", block=False)
+    @bot_admins_rights_check
+    async def public_cookies_status(self, update: Update, _: CallbackContext):
+        user = update.effective_user
+        logger.info(f"用户 {user.full_name}[{user.id}] public_cookies_status 命令请求")
+        message = update.effective_message
+        health = await self.public_cookies_service.get_health()
+        names = {
+            "pool": "池中数量",
+            "verified": "已验证",
+            "benched": "暂停使用",
+            "success": "验证成功",
+            "too_many_requests": "查询频繁",
+            "challenge": "触发验证码",
+            "error": "其他错误",
+        }
+        text = "<b>公共Cookies池统计信息</b>\n"
+        for region, title in ((RegionEnum.HYPERION, "国服"), (RegionEnum.HOYOLAB, "国际服")):
+            text += f"\n<b>{title}</b>\n"
+            text += "\n".join(f"{name}: <code>{health[region][key]}</code>" for key, name in names.items()) + "\n"
+        await message.reply_text(text, parse_mode="html", quote=True)
@@ -1,19 +1,30 @@
-from telegram import Update
+import asyncio
+from typing import Optional
 
+from telegram import Message, Update
+from telegram.ext import CallbackContext
+
+from core.base.assets import AssetsService
 from core.plugin import Plugin, handler
 from metadata.scripts.honey import update_honey_metadata
 from metadata.scripts.metadatas import update_metadata_from_ambr, update_metadata_from_github
 from metadata.scripts.paimon_moe import update_paimon_moe_zh
+from utils.bot import get_args
 from utils.decorators.admins import bot_admins_rights_check
 from utils.log import logger
 
 
 class MetadataPlugin(Plugin):
+    def __init__(self, assets_service: AssetsService = None):
+        self.assets_service = assets_service
+        self._prefetch_task: Optional[asyncio.Task] = None
+
     @handler.command("refresh_metadata")
     @bot_admins_rights_check
-    async def refresh(self, update: Update, _) -> None:
+    async def refresh(self, update: Update, context: CallbackContext) -> None:
         user = update.effective_user
         message = update.effective_message
+        args = get_args(context)
 
         logger.info(f"用户 {user.full_name}[{user.id}] 刷新[bold]metadata[/]缓存命令", extra={"markup": True})
 
@@ -25,4 +36,32 @@ class MetadataPlugin(Plugin):
         await update_metadata_from_ambr()
         logger.info("正在从 honey 上获取元数据")
         await update_honey_metadata()
-        await msg.edit_text("正在刷新元数据，请耐心等待...\n完成！")
+        # 预下载全部图标耗时较长，只在 `/refresh_metadata icon` 时在后台进行
+        if "icon" not in args or self.assets_service is None:
+            await msg.edit_text("正在刷新元数据，请耐心等待...\n完成！")
+            return
+        if self._prefetch_task is not None and not self._prefetch_task.done():
+            await msg.edit_text("正在刷新元数据，请耐心等待...\n完成！\n图标正在预下载中，请勿重复操作")
+            return
+        await msg.edit_text("正在刷新元数据，请耐心等待...\n完成！\n正在后台预下载图标")
+        self._prefetch_task = asyncio.create_task(self._prefetch(msg))
+
+    async def _prefetch(self, msg: Message):
+        """在后台预下载图标，完成后更新消息"""
+        last_percent = 0
+
+        async def _progress(done: int, total: int):
+            nonlocal last_percent
+            percent = done * 100 // total
+            if percent - last_percent >= 10 or done == total:
+                last_percent = percent
+                await msg.edit_text(f"正在刷新元数据，请耐心等待...\n完成！\n正在预下载图标 {done}/{total}")
+
+        try:
+            success, failed = await self.assets_service.prefetch(progress=_progress)
+        except Exception as exc:  # pylint: disable=W0703
+            logger.error("预下载图标失败")
+            logger.exception(exc)
+            await msg.edit_text("正在刷新元数据，请耐心等待...\n完成！\n图标预下载失败，请查看日志")
+            return
+        await msg.edit_text(f"正在刷新元数据，请耐心等待...\n完成！\n图标预下载完成，成功 {success} 个，失败 {failed} 个")
@@ -36,6 +36,14 @@ class SearchPlugin(Plugin):
                 logger.info("条目数据正在自动保存")
                 await self.search.save_entry()
                 logger.success("条目数据自动保存成功")
+        statistics = self.search.get_cache_statistics()
+        logger.info(
+            "搜索结果缓存 数量[%s] 命中[%s] 未命中[%s] 命中率[%.2f%%]",
+            statistics["size"],
+            statistics["hits"],
+            statistics["misses"],
+            statistics["hit_rate"] * 100,
+        )
 
     @handler.command("save_entry", block=False)
     @bot_admins_rights_check
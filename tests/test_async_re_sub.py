@@ -0,0 +1,78 @@
+"""async_re_sub 的测试
+
+没有分组时结果应与 re.sub 一致，有分组时只替换第一个分组的内容。
+"""
+import asyncio
+import logging
+import re
+from typing import Match
+
+import pytest
+
+from utils.helpers import async_re_sub
+
+LOGGER = logging.getLogger(__name__)
+
+
+async def upper(match: Match) -> str:
+    await asyncio.sleep(0)
+    return match.group(0).upper()
+
+
+@pytest.mark.asyncio
+async def test_same_as_re_sub():
+    cases = [
+        (r"aa", "aaaaa"),  # 可能重叠的匹配只替换不重叠的部分
+        (r"a|ab", "abab"),
+        (r"x*", "abc"),  # 空匹配
+        (r"\d+", "no digits"),
+    ]
+    for pattern, string in cases:
+        expected = re.sub(pattern, lambda m: m.group(0).upper() or "-", string)
+        assert await async_re_sub(pattern, lambda m: m.group(0).upper() or "-", string) == expected
+    assert await async_re_sub(r"aa", upper, "aaaaa") == "AAAAa"
+    assert await async_re_sub(r"(\d+)", "0", "a1b22c333", count=2) == "a0b0c333"
+
+
+@pytest.mark.asyncio
+async def test_group():
+    string = '{"icon": "a.png", "side_icon": "b.png"}'
+    result = await async_re_sub(r"['\"]icon['\"]:\s*['\"](.*?)['\"]", lambda m: "file:///" + m.group(1), string)
+    assert result == '{"icon": "file:///a.png", "side_icon": "b.png"}'
+    # 可选的分组没有参与匹配时保留原文
+    assert await async_re_sub(r"a(b)?", lambda m: "X", "ac ab") == "ac aX"
+
+
+@pytest.mark.asyncio
+async def test_duplicate_matches():
+    calls = []
+
+    async def repl(match: Match) -> str:
+        calls.append(match.group(1))
+        await asyncio.sleep(0)
+        return match.group(1) * 2
+
+    assert await async_re_sub(r"<(\w+)>", repl, "<a><b><a><a>") == "<aa><bb><aa><aa>"
+    # 相同的匹配内容只调用一次
+    assert sorted(calls) == ["a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_repl_raises():
+    cancelled = []
+
+    async def repl(match: Match) -> str:
+        if match.group(0) == "b":
+            raise ValueError(match.group(0))
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(match.group(0))
+            raise
+        return match.group(0)
+
+    with pytest.raises(ValueError):
+        await async_re_sub(r"\w", repl, "abc")
+    await asyncio.sleep(0)
+    # 其他仍在执行的替换被取消
+    assert sorted(cancelled) == ["a", "c"]
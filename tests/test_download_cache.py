@@ -0,0 +1,84 @@
+"""下载缓存的测试
+
+同时请求同一个 url 只下载一次，下载失败不会留下文件，超过大小上限时删除最久未使用的文件，
+最近使用过的文件不会被删除。
+"""
+import asyncio
+import logging
+import os
+import time
+
+import pytest
+from httpx import AsyncClient, MockTransport, Response
+
+from utils.download import DownloadCache
+from utils.error import UrlResourcesNotFoundError
+
+LOGGER = logging.getLogger(__name__)
+
+
+def create_cache(path, requests, **kwargs) -> DownloadCache:
+    async def handler(request):
+        requests.append(str(request.url))
+        await asyncio.sleep(0.01)
+        if request.url.path.startswith("/missing"):
+            return Response(404)
+        return Response(200, content=b"x" * 100)
+
+    return DownloadCache(path, client=AsyncClient(transport=MockTransport(handler)), **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_single_flight(tmp_path):
+    requests = []
+    cache = create_cache(tmp_path, requests)
+    urls = [f"https://example.com/{i % 5}.png" for i in range(50)]
+    files = await cache.prefetch(urls)
+    assert len(files) == 5
+    assert sorted(requests) == sorted(set(urls))
+    assert all(path.read_bytes() == b"x" * 100 for path in files.values())
+    await asyncio.gather(*(cache.get(url) for url in urls))
+    assert len(requests) == 5
+
+
+@pytest.mark.asyncio
+async def test_failed_download(tmp_path):
+    cache = create_cache(tmp_path, [])
+    with pytest.raises(UrlResourcesNotFoundError):
+        await cache.get("https://example.com/missing.png")
+    assert not os.listdir(tmp_path)
+    # 批量下载时一个资源失败不影响其他资源
+    files = await cache.prefetch(["https://example.com/missing.png", "https://example.com/1.png"])
+    assert files["https://example.com/missing.png"] is None
+    assert files["https://example.com/1.png"].exists()
+
+
+@pytest.mark.asyncio
+async def test_evict(tmp_path):
+    (tmp_path / "map_icon.jpg").write_bytes(b"0" * 1000)
+    requests = []
+    cache = create_cache(tmp_path, requests, max_size=500, grace_period=0)
+    first = await cache.get("https://example.com/first.png")
+    os.utime(first, (time.time() - 60, time.time() - 60))
+    for i in range(4):
+        await cache.get(f"https://example.com/{i}.png")
+    await cache.get("https://example.com/first.png")  # 最近使用过的文件不会被删除
+    await cache.get("https://example.com/last.png")
+    assert first.exists()
+    assert requests.count("https://example.com/first.png") == 1
+    assert not cache.path_of("https://example.com/0.png").exists()
+    assert cache.size() == sum(path.stat().st_size for path in tmp_path.glob("*.png")) <= 500
+    # 不是由下载缓存保存的文件不会被删除
+    assert (tmp_path / "map_icon.jpg").exists()
+
+
+@pytest.mark.asyncio
+async def test_evict_grace_period(tmp_path):
+    cache = create_cache(tmp_path, [], max_size=500)
+    old = await cache.get("https://example.com/old.png")
+    os.utime(old, (time.time() - 120, time.time() - 120))
+    files = await cache.prefetch(f"https://example.com/{i}.png" for i in range(6))
+    # 刚交给调用方的文件可能还在使用，超过大小上限时也只删除较早使用的文件
+    assert not old.exists()
+    assert all(path.exists() for path in files.values())
+    assert cache.size() == 600
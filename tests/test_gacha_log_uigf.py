@@ -0,0 +1,110 @@
+"""抽卡记录导入导出的基准测试
+
+合成一个包含 10 万条记录的账号，记录 UIGF 导入导出的耗时与内存峰值，
+逐条读写时内存峰值应与记录数量无关。
+"""
+import datetime
+import io
+import json
+import logging
+import random
+import time
+import tracemalloc
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import pytest
+
+from modules.gacha_log.log import GachaLog
+
+LOGGER = logging.getLogger(__name__)
+
+UID = 100000001
+WISH_COUNT = 100_000
+# 文件约 20 MB，逐条读写时内存峰值应远小于文件大小
+MEMORY_LIMIT = 4 * 1024 * 1024
+
+
+def generate_uigf(count: int) -> bytes:
+    """生成包含 count 条记录的 UIGF 文件"""
+    rand = random.Random(count)
+    pools = ("301", "302", "200")
+    items = []
+    wish_time = datetime.datetime(2020, 9, 28)
+    for index in range(count):
+        wish_time += datetime.timedelta(minutes=1)
+        value = rand.random()
+        if value < 0.016:
+            rank_type, item_type, name = "5", "角色", "刻晴"
+        elif value < 0.13:
+            rank_type, item_type, name = ("4", "角色", "香菱") if value < 0.07 else ("4", "武器", "祭礼剑")
+        else:
+            rank_type, item_type, name = "3", "武器", "黎明神剑"
+        gacha_type = pools[index % len(pools)]
+        items.append(
+            {
+                "id": str(1600000000000000000 + index),
+                "name": name,
+                "count": "1",
+                "gacha_type": gacha_type,
+                "item_id": "",
+                "item_type": item_type,
+                "rank_type": rank_type,
+                "time": wish_time.strftime("%Y-%m-%d %H:%M:%S"),
+                "uigf_gacha_type": gacha_type,
+            }
+        )
+    data = {"info": {"uid": str(UID), "export_app": "UIGF"}, "list": items}
+    return json.dumps(data, ensure_ascii=False, indent=4).encode("utf-8")
+
+
+@pytest.fixture(scope="module")
+def uigf_file() -> bytes:
+    return generate_uigf(WISH_COUNT)
+
+
+@contextmanager
+def measure(name: str):
+    """记录耗时与内存峰值"""
+    result = SimpleNamespace(peak=0)
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        _, result.peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        LOGGER.info("%s: %.2fs, 内存峰值 %.2f MB", name, time.perf_counter() - start, result.peak / 1024 / 1024)
+
+
+def test_load_uigf_json(uigf_file):
+    with measure("读取 UIGF 文件") as result:
+        data = GachaLog.load_uigf_json(io.BytesIO(uigf_file))
+        count = sum(1 for _ in data["list"])
+    assert count == WISH_COUNT
+    assert data["info"]["uid"] == str(UID)
+    assert result.peak < MEMORY_LIMIT
+
+
+@pytest.mark.asyncio
+async def test_import_export(tmp_path, uigf_file):
+    gacha_log = GachaLog(tmp_path)
+    client = SimpleNamespace(uid=UID)
+
+    with measure("导入"):
+        new_num = await gacha_log.import_gacha_log_data(1, client, gacha_log.load_uigf_json(io.BytesIO(uigf_file)))
+    assert new_num == WISH_COUNT
+
+    # 只有新增的记录会保留在内存中，重复导入时内存占用主要是已有记录的 id
+    with measure("重复导入"):
+        new_num = await gacha_log.import_gacha_log_data(1, client, gacha_log.load_uigf_json(io.BytesIO(uigf_file)))
+    assert new_num == 0
+
+    with measure("导出") as result:
+        path = await gacha_log.gacha_log_to_uigf("1", str(UID))
+    assert result.peak < MEMORY_LIMIT
+
+    with open(path, "rb") as f:
+        exported = json.load(f)
+    assert len(exported["list"]) == WISH_COUNT
+    assert {i["id"] for i in exported["list"]} == {i["id"] for i in json.loads(uigf_file)["list"]}
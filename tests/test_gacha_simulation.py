@@ -0,0 +1,130 @@
+"""批量抽卡模拟的统计一致性测试与基准测试
+
+批量模拟与 `BannerSystem` 使用不同的随机数，无法逐抽比较，
+这里比较两者“抽到目标物品所需抽数”的分布，使用双样本 KS 检验。
+"""
+import logging
+import random
+import time
+from typing import List
+
+import pytest
+
+from modules.gacha.banner import BannerType, GachaBanner
+from modules.gacha.player.banner import PlayerGachaBannerInfo
+from modules.gacha.simulation import GachaSimulation
+from modules.gacha.system import BannerSystem
+
+np = pytest.importorskip("numpy")
+LOGGER = logging.getLogger(__name__)
+
+CHARACTER_BANNER = GachaBanner(
+    banner_type=BannerType.EVENT,
+    wish_max_progress=1,
+    rate_up_items5=[10000089],
+    fallback_items5_pool1=[10000003, 10000016, 10000035, 10000041, 10000042, 10000089],
+    rate_up_items4=[10000023, 10000025, 10000032],
+    fallback_items4_pool1=[10000014, 10000020, 10000023, 10000025, 10000031, 10000032, 10000036],
+    fallback_items4_pool2=[11401, 12401, 13401, 14401, 15401],
+)
+WEAPON_BANNER = GachaBanner(
+    banner_type=BannerType.WEAPON,
+    wish_max_progress=2,
+    weight4=((1, 600), (7, 600), (10, 10000)),
+    weight5=((1, 70), (62, 70), (90, 10000)),
+    event_chance5=75,
+    event_chance4=75,
+    rate_up_items5=[11509, 12504],
+    fallback_items5_pool2=[11501, 11502, 11509, 12501, 12502, 12504, 13502, 14502, 15502],
+    rate_up_items4=[11401, 12401, 13401, 14401, 15401],
+    fallback_items4_pool1=[10000014, 10000020, 10000023],
+    fallback_items4_pool2=[11401, 11402, 12401, 12402, 13401, 14401, 15401],
+)
+STANDARD_BANNER = GachaBanner(
+    banner_type=BannerType.STANDARD,
+    fallback_items5_pool1=[10000003, 10000016, 10000035, 10000041, 10000042],
+    fallback_items5_pool2=[11501, 11502, 12501, 12502, 13502, 13505, 14501, 14502, 15501, 15502],
+    fallback_items4_pool1=[10000014, 10000020, 10000023, 10000025, 10000031, 10000032, 10000036],
+    fallback_items4_pool2=[11401, 11402, 12401, 12402, 13401, 14401, 15401],
+)
+
+
+def scalar_pulls(banner: GachaBanner, target_item: int, copies: int, players: int, wish_item_id: int = 0) -> List[int]:
+    """使用 `BannerSystem` 逐抽模拟，返回每位玩家抽到目标物品所需的抽数"""
+    system = BannerSystem()
+    compiled = banner.compile()
+    result = []
+    for _ in range(players):
+        info = PlayerGachaBannerInfo(wish_item_id=wish_item_id)
+        obtained = count = 0
+        while obtained < copies:
+            count += 1
+            obtained += system.do_pull(compiled, info) == target_item
+        result.append(count)
+    return result
+
+
+def ks_statistic(sample1, sample2) -> float:
+    """双样本 KS 检验的统计量"""
+    sample1, sample2 = np.sort(sample1), np.sort(sample2)
+    values = np.concatenate([sample1, sample2])
+    cdf1 = np.searchsorted(sample1, values, side="right") / len(sample1)
+    cdf2 = np.searchsorted(sample2, values, side="right") / len(sample2)
+    return float(np.max(np.abs(cdf1 - cdf2)))
+
+
+@pytest.mark.parametrize(
+    "banner, target_item, copies, wish_item_id",
+    [
+        (CHARACTER_BANNER, 10000089, 1, 0),
+        (CHARACTER_BANNER, 10000023, 2, 0),
+        (WEAPON_BANNER, 11509, 1, 11509),
+        (STANDARD_BANNER, 10000014, 1, 0),
+    ],
+    ids=["character5", "character4", "weapon_epitomized", "standard_pool_balance"],
+)
+def test_statistical_equivalence(banner: GachaBanner, target_item: int, copies: int, wish_item_id: int):
+    random.seed(target_item)
+    scalar = scalar_pulls(banner, target_item, copies, 2000, wish_item_id)
+    result = GachaSimulation(banner, players=20000, seed=target_item).run(
+        target_item, copies, max_pulls=5000, wish_item_id=wish_item_id
+    )
+    assert result.success_rate == 1
+    statistic = ks_statistic(scalar, result.pulls)
+    # 显著性水平 0.001 时的临界值
+    critical = 1.95 * np.sqrt((len(scalar) + result.players) / (len(scalar) * result.players))
+    LOGGER.info(
+        "逐抽平均 %.2f 批量平均 %.2f KS 统计量 %.4f 临界值 %.4f",
+        np.mean(scalar),
+        result.mean,
+        statistic,
+        critical,
+    )
+    assert statistic < critical
+
+
+def test_benchmark():
+    players = 200
+    random.seed(0)
+    start = time.perf_counter()
+    scalar = scalar_pulls(CHARACTER_BANNER, 10000089, 7, players)
+    scalar_time = (time.perf_counter() - start) / players
+
+    simulation = GachaSimulation(CHARACTER_BANNER, players=20000, seed=0)
+    start = time.perf_counter()
+    result = simulation.run(10000089, 7, max_pulls=2000)
+    vector_time = (time.perf_counter() - start) / result.players
+
+    LOGGER.info(
+        "满命所需抽数 逐抽平均 %.1f 批量平均 %.1f 分位数 %s",
+        np.mean(scalar),
+        result.mean,
+        result.percentiles(),
+    )
+    LOGGER.info(
+        "每位玩家耗时 逐抽 %.2fms 批量 %.4fms 加速 %.0f 倍",
+        scalar_time * 1000,
+        vector_time * 1000,
+        scalar_time / vector_time,
+    )
+    assert vector_time < scalar_time
@@ -0,0 +1,129 @@
+"""搜索索引的一致性测试与基准测试
+
+索引只对候选条目计算分数，搜索结果应与对全部条目计算分数的结果一致，
+且条目数量增加时搜索耗时基本不变。
+"""
+import heapq
+import logging
+import random
+import time
+from typing import List
+
+import pytest
+
+from core.search.index import SearchIndex
+from core.search.models import BaseEntry, StrategyEntry, WeaponEntry
+from core.search.services import SearchServices
+
+LOGGER = logging.getLogger(__name__)
+
+NAMES = ["天空之刃", "护摩之杖", "雾切之回光", "狼的末路", "和璞鸢", "薙草之稻光", "磐岩结绿", "斫峰之刃", "西风剑", "祭礼弓", "钟离", "雷电将军"]
+# 常用汉字范围内的随机文字，模拟条目的描述
+CHARS = [chr(code) for code in range(0x4E00, 0x4E00 + 3000)]
+QUERIES = ["天空", "护摩之杖", "雾切", "雷电", "西风", "钟", "祭礼弓", "和璞鸢", "不存在的条目"]
+
+
+def generate_entries(count: int) -> List[BaseEntry]:
+    rand = random.Random(count)
+    entries: List[BaseEntry] = []
+    for index in range(count):
+        title = rand.choice(NAMES) + "".join(rand.choice(CHARS) for _ in range(rand.randint(1, 3)))
+        tags = ["".join(rand.choice(CHARS) for _ in range(rand.randint(2, 4))) for _ in range(3)]
+        if index % 2:
+            entries.append(
+                WeaponEntry(
+                    key=f"weapon:{index}",
+                    title=title,
+                    tags=tags,
+                    description="".join(rand.choice(CHARS) for _ in range(60)),
+                )
+            )
+        else:
+            entries.append(StrategyEntry(key=f"strategy:{index}", title=title, tags=tags, description=f"{title} 角色攻略"))
+    # 与搜索文本完全相同的标题与标签
+    entries.append(WeaponEntry(key="weapon:exact", title="护摩之杖", tags=["护摩"], description="护摩之杖的故事"))
+    entries.append(StrategyEntry(key="strategy:exact", title="雷电将军", tags=["雷电", "雷神"], description="攻略"))
+    return entries
+
+
+def brute_force(entries: List[BaseEntry], query: str, amount: int) -> List[float]:
+    return heapq.nlargest(amount, (entry.compare_to_query(query) for entry in entries))
+
+
+def indexed(index: SearchIndex, query: str, amount: int) -> List[float]:
+    return heapq.nlargest(amount, (entry.compare_to_query(query) for entry in index.candidates(query)))
+
+
+@pytest.mark.parametrize("count", [100, 2000])
+def test_same_top_scores(count):
+    entries = generate_entries(count)
+    index = SearchIndex()
+    index.extend(entries)
+    for query in QUERIES:
+        expected = [score for score in brute_force(entries, query, 5) if score > 0]
+        assert indexed(index, query, len(expected)) == expected, query
+
+
+def test_upsert_and_remove():
+    index = SearchIndex()
+    index.extend(generate_entries(10))
+    index.add(WeaponEntry(key="weapon:exact", title="雾切之回光", tags=["雾切"], description=""))
+    assert index.get("weapon:exact").title == "雾切之回光"
+    assert "weapon:exact" not in {entry.key for entry in index.candidates("护摩")}
+    assert "weapon:exact" in {entry.key for entry in index.candidates("雾切")}
+    index.remove("weapon:exact")
+    assert "weapon:exact" not in {entry.key for entry in index.candidates("雾切")}
+    assert len(index) == 11
+
+
+@pytest.mark.parametrize("count", [1000, 8000])
+def test_latency(count):
+    entries = generate_entries(count)
+    index = SearchIndex()
+    index.extend(entries)
+    start = time.perf_counter()
+    for query in QUERIES:
+        indexed(index, query, 5)
+    index_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for query in QUERIES:
+        brute_force(entries, query, 5)
+    brute_force_time = time.perf_counter() - start
+    LOGGER.info("%s 个条目: 索引 %.2f ms 遍历 %.2f ms", count, index_time * 1000, brute_force_time * 1000)
+    # 候选数量有上限，只对候选计算分数
+    for query in QUERIES:
+        assert len(index.candidates(query)) <= index.shortlist_size + 1
+    assert index_time * 10 < brute_force_time
+
+
+@pytest.mark.asyncio
+async def test_search_cache_invalidation():
+    search = SearchServices()
+    await search.add_entry(WeaponEntry(key="weapon:1", title="护摩之杖", tags=["护摩"], description=""))
+    first = await search.search("护摩")
+    assert first == await search.search("护摩")
+    assert isinstance(first, tuple)
+    await search.add_entry(WeaponEntry(key="weapon:2", title="护摩之杖·改", tags=["护摩之杖"], description=""))
+    assert len(await search.search("护摩")) == 2
+    statistics = search.get_cache_statistics()
+    assert statistics["hits"] == 1 and statistics["misses"] == 2
+
+
+@pytest.mark.asyncio
+async def test_search_inline_amount():
+    entries = generate_entries(2000)
+    search = SearchServices()
+    for entry in entries:
+        await search.add_entry(entry)
+    for query in QUERIES:
+        # 与 inline 查询相同的调用方式，数目超过候选数量上限时结果仍与遍历全部条目一致
+        result = await search.search(query, 80)
+        scores = [entry.compare_to_query(query) for entry in result]
+        expected = brute_force(entries, query, len(result))
+        assert scores[:5] == expected[:5], query
+        assert len(result) <= 80
+    # 未指定数目时只返回按分数排序的候选条目
+    result = await search.search("护摩之杖")
+    assert 0 < len(result) <= search._index.shortlist_size + 1
+    scores = [entry.compare_to_query("护摩之杖") for entry in result]
+    assert scores == sorted(scores, reverse=True)
@@ -0,0 +1,97 @@
+"""用户信息与Cookies缓存的测试
+
+缓存中的对象被修改后，保存失败、中途放弃或通过其他服务保存时，缓存都应失效，之后读取到数据库中的数据。
+"""
+import copy
+import logging
+
+import pytest
+from genshin import InvalidCookies
+
+from core.cookies import services as cookies_services
+from core.cookies.models import CookiesStatusEnum, HyperionCookie
+from core.cookies.services import CookiesService, PublicCookiesService
+from core.user.models import User
+from core.user.services import UserService
+from utils.models.base import RegionEnum
+
+LOGGER = logging.getLogger(__name__)
+
+
+class FakeUserRepository:
+    def __init__(self):
+        self.users = {1: User(id=1, user_id=1, yuanshen_uid=100000001, region=RegionEnum.HYPERION)}
+        self.fail = False
+
+    async def get_by_user_id(self, user_id: int) -> User:
+        return copy.deepcopy(self.users[user_id])
+
+    async def update_user(self, user: User):
+        if self.fail:
+            raise RuntimeError("update failed")
+        self.users[user.user_id] = copy.deepcopy(user)
+
+
+class FakeCookiesRepository:
+    def __init__(self):
+        self.cookies = {1: HyperionCookie(id=1, user_id=1, cookies={"ltuid": "1"}, status=None)}
+
+    async def get_cookies(self, user_id: int, region: RegionEnum) -> HyperionCookie:
+        return copy.deepcopy(self.cookies[user_id])
+
+    async def update_cookies_ex(self, cookies: HyperionCookie, region: RegionEnum):
+        self.cookies[cookies.user_id] = copy.deepcopy(cookies)
+
+
+class FakePublicCookiesCache:
+    def __init__(self):
+        self.removed = []
+
+    async def delete_public_cookies(self, uid: int, region: RegionEnum):
+        self.removed.append(uid)
+
+
+class InvalidClient:
+    def __init__(self, *_, **__):
+        pass
+
+    async def get_record_card(self):
+        raise InvalidCookies({"retcode": -100})
+
+
+@pytest.mark.asyncio
+async def test_failed_update_user():
+    repository = FakeUserRepository()
+    service = UserService(repository)
+    user = await service.get_user_by_id(1)
+    assert user is await service.get_user_by_id(1)
+    # 修改缓存中的对象后保存失败，之后读取到的是数据库中的数据
+    user.region = RegionEnum.HOYOLAB
+    repository.fail = True
+    with pytest.raises(RuntimeError):
+        await service.update_user(user)
+    assert (await service.get_user_by_id(1)).region == RegionEnum.HYPERION
+
+
+@pytest.mark.asyncio
+async def test_update_user():
+    service = UserService(FakeUserRepository())
+    user = await service.get_user_by_id(1)
+    user.genshin_uid = 600000001
+    await service.update_user(user)
+    new_user = await service.get_user_by_id(1)
+    assert new_user is not user and new_user.genshin_uid == 600000001
+
+
+@pytest.mark.asyncio
+async def test_public_cookies_verify_invalidates_cache(monkeypatch):
+    repository = FakeCookiesRepository()
+    cookies_service = CookiesService(repository)
+    public_cookies_service = PublicCookiesService(repository, FakePublicCookiesCache(), cookies_service)
+    cookies = await cookies_service.get_cookies(1, RegionEnum.HYPERION)
+    monkeypatch.setattr(cookies_services.genshin, "Client", InvalidClient)
+    assert not await public_cookies_service._verify(1, cookies, RegionEnum.HYPERION)
+    # 验证时修改的状态通过 CookiesService 保存，缓存失效后读取到保存的数据
+    new_cookies = await cookies_service.get_cookies(1, RegionEnum.HYPERION)
+    assert new_cookies is not cookies
+    assert new_cookies.status == CookiesStatusEnum.INVALID_COOKIES
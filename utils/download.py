@@ -0,0 +1,214 @@
+"""图片等资源的本地下载缓存
+
+同一个 url 只会下载一次，同时发起的下载会等待同一个请求完成。
+文件先写入临时文件再重命名，缓存文件超过大小上限时按最近使用时间删除。
+"""
+import asyncio
+import hashlib
+import os
+import re
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+import aiofiles
+from httpx import AsyncClient, Limits, UnsupportedProtocol
+
+from utils.error import UrlResourcesNotFoundError
+from utils.log import logger
+
+try:
+    import h2  # noqa: F401  pylint: disable=W0611
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+__all__ = ("DownloadCache",)
+
+TEMP_SUFFIX = ".tmp"
+# 缓存文件夹中还有其他模块保存的文件，只管理以 url 的 sha1 命名的文件
+CACHE_FILE_PATTERN = re.compile(r"^[0-9a-f]{40}(\.[^.]*)?$")
+TEMP_FILE_PATTERN = re.compile(r"^[0-9a-f]{40}(\.[^.]*)?\.[0-9a-f]{32}\.tmp$")
+
+
+class DownloadCache:
+    """资源下载缓存
+
+    :param path: 缓存文件夹
+    :param max_size: 缓存文件的总大小上限，单位为字节
+    :param concurrency: 同时下载的文件数
+    :param headers: 请求头
+    :param client: 发起请求的 client，默认创建一个共用的 client
+    :param grace_period: 最近使用过的文件在这段时间内不会被删除，避免删除正在渲染的页面使用的文件，单位为秒
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        max_size: int = 1024 * 1024 * 1024,
+        concurrency: int = 8,
+        headers: Optional[Dict[str, str]] = None,
+        client: Optional[AsyncClient] = None,
+        grace_period: float = 60,
+    ):
+        self.path = path
+        self.max_size = max_size
+        self.concurrency = concurrency
+        self.headers = headers
+        self._client = client
+        self.grace_period = grace_period
+        self._downloads: Dict[str, "asyncio.Future[Optional[Path]]"] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._size: Optional[int] = None
+        self._size_lock: Optional[asyncio.Lock] = None
+        self._evicting = False
+
+    @property
+    def client(self) -> AsyncClient:
+        if self._client is None:
+            self._client = AsyncClient(
+                headers=self.headers,
+                http2=HTTP2_AVAILABLE,
+                limits=Limits(max_connections=self.concurrency * 2, max_keepalive_connections=self.concurrency),
+                follow_redirects=True,
+            )
+        return self._client
+
+    def path_of(self, url: str) -> Path:
+        """url 对应的缓存文件路径"""
+        _, extension = os.path.splitext(os.path.basename(url))
+        return self.path / (hashlib.sha1(url.encode()).hexdigest() + extension)  # nosec
+
+    async def get(self, url: str) -> Optional[Path]:
+        """获取 url 对应的本地文件，没有缓存时下载
+        :param url: 资源的 url
+        :return: 本地文件路径，url 的协议不支持时为 None
+        """
+        path = self.path_of(url)
+        if path.exists():
+            self._touch(path)
+            return path
+        future = self._downloads.get(url)
+        if future is None:
+            future = self._downloads[url] = asyncio.ensure_future(self._download(url, path))
+            future.add_done_callback(lambda _: self._downloads.pop(url, None))
+        # 一个请求被取消时不影响其他等待同一个下载的请求
+        return await asyncio.shield(future)
+
+    async def prefetch(self, urls: Iterable[str]) -> Dict[str, Optional[Path]]:
+        """并发下载多个资源
+        :param urls: 资源的 url
+        :return: url 与对应的本地文件路径，下载失败的 url 对应 None
+        """
+        urls = list(dict.fromkeys(urls))
+        results = await asyncio.gather(*(self.get(url) for url in urls), return_exceptions=True)
+        paths: Dict[str, Optional[Path]] = {}
+        # 一个资源下载失败时不影响其他资源
+        for url, result in zip(urls, results):
+            if isinstance(result, BaseException):
+                if not isinstance(result, Exception):
+                    raise result
+                logger.error("下载 url[%s] 失败", url, exc_info=result)
+                result = None
+            paths[url] = result
+        return paths
+
+    async def _download(self, url: str, path: Path) -> Optional[Path]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            try:
+                response = await self.client.get(url)
+            except UnsupportedProtocol:
+                logger.error("连接不支持 url[%s]", url)
+                return None
+        if response.status_code != 200:
+            logger.error("请求出现错误 url[%s] status_code[%s]", url, response.status_code)
+            raise UrlResourcesNotFoundError(url)
+        self.path.mkdir(parents=True, exist_ok=True)
+        loop = asyncio.get_running_loop()
+        # 统计与删除文件需要遍历整个文件夹，放到线程池中执行，避免阻塞事件循环
+        if self._size is None:
+            if self._size_lock is None:
+                self._size_lock = asyncio.Lock()
+            async with self._size_lock:
+                await loop.run_in_executor(None, self.size)
+        # 写入完成后再重命名，中途出错不会留下不完整的文件
+        temp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}{TEMP_SUFFIX}")
+        try:
+            async with aiofiles.open(temp_path, mode="wb") as f:
+                await f.write(response.content)
+            os.replace(temp_path, path)
+        finally:
+            if temp_path.exists():
+                temp_path.unlink()
+        logger.debug("下载 url[%s] 到 file_dir[%s]", url, path)
+        self._size += len(response.content)
+        # 正在删除时不重复删除，删除时会重新统计大小
+        if self._size > self.max_size and not self._evicting:
+            self._evicting = True
+            try:
+                await loop.run_in_executor(None, self.evict)
+            finally:
+                self._evicting = False
+        return path
+
+    @staticmethod
+    def _touch(path: Path):
+        """更新文件的修改时间，作为最近使用时间"""
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _files(self, pattern: "re.Pattern" = CACHE_FILE_PATTERN):
+        if not self.path.exists():
+            return []
+        return [entry for entry in os.scandir(self.path) if entry.is_file() and pattern.match(entry.name)]
+
+    def size(self) -> int:
+        """缓存文件的总大小，第一次调用时统计，之后随下载与删除更新"""
+        if self._size is None:
+            self.remove_temp_files()
+            self._size = sum(entry.stat().st_size for entry in self._files())
+        return self._size
+
+    def evict(self, target: Optional[int] = None):
+        """按最近使用时间删除文件，直到缓存文件的总大小小于 target，`grace_period` 内使用过的文件不会被删除
+        :param target: 目标大小，默认为大小上限的 80%，避免每次下载都要删除文件
+        """
+        if target is None:
+            target = self.max_size * 4 // 5
+        deadline = time.time() - self.grace_period
+        entries = sorted(((entry.stat(), entry.path) for entry in self._files()), key=lambda x: x[0].st_mtime)
+        size = sum(stat.st_size for stat, _ in entries)
+        removed = 0
+        for stat, path in entries:
+            if size <= target or stat.st_mtime > deadline:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= stat.st_size
+            removed += 1
+        self._size = size
+        logger.info("下载缓存删除了 %s 个文件，当前大小 %.2f MB", removed, size / 1024 / 1024)
+
+    def remove_temp_files(self, max_age: float = 3600) -> int:
+        """删除进程中断后残留的临时文件
+        :param max_age: 临时文件的最短保留时间，单位为秒
+        :return: 删除的文件数
+        """
+        now = time.time()
+        removed = 0
+        for entry in self._files(TEMP_FILE_PATTERN):
+            try:
+                if now - entry.stat().st_mtime > max_age:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
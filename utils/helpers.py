@@ -1,28 +1,29 @@
 from __future__ import annotations
 
+import asyncio
 import hashlib
 import os
 import re
 from asyncio import create_subprocess_shell
 from asyncio.subprocess import PIPE
-from inspect import iscoroutinefunction
+from inspect import isawaitable
 from pathlib import Path
-from typing import Awaitable, Callable, Match, Optional, Pattern, Tuple, TypeVar, Union, cast
+from typing import Awaitable, Callable, Dict, Iterable, Match, Optional, Pattern, Tuple, TypeVar, Union, cast
 
-import aiofiles
 import genshin
-import httpx
 from genshin import Client, types
-from httpx import UnsupportedProtocol
 from typing_extensions import ParamSpec
 
 from core.base.redisdb import RedisDB
 from core.bot import bot
 from core.config import config
+from core.cookies.models import Cookies
 from core.cookies.services import CookiesService, PublicCookiesService
 from core.error import ServiceNotFoundError
+from core.user.models import User
 from core.user.services import UserService
-from utils.error import UrlResourcesNotFoundError
+from utils.cache import TTLCache
+from utils.download import DownloadCache
 from utils.log import logger
 from utils.models.base import RegionEnum
 
@@ -38,6 +39,7 @@ current_dir = os.getcwd()
 cache_dir = os.path.join(current_dir, "cache")
 if not os.path.exists(cache_dir):
     os.mkdir(cache_dir)
+download_cache = DownloadCache(Path(cache_dir), headers=REQUEST_HEADERS)
 
 cookies_service = bot.services.get(CookiesService)
 cookies_service = cast(CookiesService, cookies_service)
@@ -50,6 +52,9 @@ redis_db = cast(RedisDB, redis_db)
 genshin_cache: Optional[genshin.RedisCache] = None
 if redis_db and config.genshin_ttl:
     genshin_cache = genshin.RedisCache(redis_db.client, ttl=config.genshin_ttl)
+genshin_clients: TTLCache[Tuple[int, RegionEnum, bool], Tuple[User, Optional[Cookies], Client]] = TTLCache(
+    ttl=10 * 60, maxsize=4096
+)
 
 REGION_MAP = {
     "1": RegionEnum.HYPERION,
@@ -68,30 +73,22 @@ def sha1(text: str) -> str:
     return _sha1.hexdigest()
 
 
+def _file_path(path: Optional[Path], return_path: bool) -> str:
+    if path is None:
+        return ""
+    return str(path) if return_path else path.as_uri()
+
+
 async def url_to_file(url: str, return_path: bool = False) -> str:
-    url_sha1 = sha1(url)
-    url_file_name = os.path.basename(url)
-    _, extension = os.path.splitext(url_file_name)
-    temp_file_name = url_sha1 + extension
-    file_dir = os.path.join(cache_dir, temp_file_name)
-    if not os.path.exists(file_dir):
-        async with httpx.AsyncClient(headers=REQUEST_HEADERS) as client:
-            try:
-                data = await client.get(url)
-            except UnsupportedProtocol:
-                logger.error("连接不支持 url[%s]", url)
-                return ""
-        if data.is_error:
-            logger.error("请求出现错误 url[%s] status_code[%s]", url, data.status_code)
-            raise UrlResourcesNotFoundError(url)
-        if data.status_code != 200:
-            logger.error("url_to_file 获取url[%s] 错误 status_code[%s]", url, data.status_code)
-            raise UrlResourcesNotFoundError(url)
-        async with aiofiles.open(file_dir, mode="wb") as f:
-            await f.write(data.content)
-    logger.debug("url_to_file 获取url[%s] 并下载到 file_dir[%s]", url, file_dir)
-
-    return file_dir if return_path else Path(file_dir).as_uri()
+    path = await download_cache.get(url)
+    logger.debug("url_to_file 获取url[%s] 并下载到 file_dir[%s]", url, path)
+    return _file_path(path, return_path)
+
+
+async def urls_to_files(urls: Iterable[str], return_path: bool = False) -> Dict[str, str]:
+    """并发下载多个资源，返回 url 与对应的本地文件"""
+    paths = await download_cache.prefetch(urls)
+    return {url: _file_path(path, return_path) for url, path in paths.items()}
 
 
 async def get_genshin_client(user_id: int, region: Optional[RegionEnum] = None, need_cookie: bool = True) -> Client:
@@ -105,14 +102,33 @@ async def get_genshin_client(user_id: int, region: Optional[RegionEnum] = None,
     cookies = None
     if need_cookie:
         cookies = await cookies_service.get_cookies(user_id, region)
-        cookies = cookies.cookies
+    # 用户信息与Cookies均来自缓存时复用已创建的 Client，修改后服务返回新的对象，Client 随之重新创建
+    key = (user_id, region, need_cookie)
+    cached = genshin_clients.get(key)
+    if cached is not None and cached[0] is user and cached[1] is cookies:
+        return cached[2]
+    client = create_genshin_client(user, cookies, region)
+    genshin_clients.set(key, (user, cookies, client))
+    return client
+
+
+def create_genshin_client(user: User, cookies: Optional[Cookies], region: Optional[RegionEnum] = None) -> Client:
+    """使用已经读取的用户信息与Cookies创建 Client，不查询数据库
+    :param user: 用户信息
+    :param cookies: 用户在该服务器的Cookies，不需要Cookies时为 None
+    :param region: 服务器，默认为用户绑定的服务器
+    :return: Client
+    """
+    if region is None:
+        region = user.region
+    cookies_data = cookies.cookies if cookies is not None else None
     if region == RegionEnum.HYPERION:
         uid = user.yuanshen_uid
-        client = genshin.Client(cookies=cookies, game=types.Game.GENSHIN, region=types.Region.CHINESE, uid=uid)
+        client = genshin.Client(cookies=cookies_data, game=types.Game.GENSHIN, region=types.Region.CHINESE, uid=uid)
     elif region == RegionEnum.HOYOLAB:
         uid = user.genshin_uid
         client = genshin.Client(
-            cookies=cookies, game=types.Game.GENSHIN, region=types.Region.OVERSEAS, lang="zh-cn", uid=uid
+            cookies=cookies_data, game=types.Game.GENSHIN, region=types.Region.OVERSEAS, lang="zh-cn", uid=uid
         )
     else:
         raise TypeError("region is not RegionEnum.NULL")
@@ -182,6 +198,9 @@ async def async_re_sub(
 ) -> str:
     """
     一个支持 repl 参数为 async 函数的 re.sub
+
+    只替换第一个分组（没有分组时为整个匹配）的内容。相同的匹配内容只调用一次 repl，
+    所有 async 的替换并发执行
     Args:
         pattern (str | Pattern): 正则对象
         repl (str | Callable[[Match], str] | Callable[[Match], Awaitable[str]]): 替换后的文本或函数
@@ -192,29 +211,48 @@ async def async_re_sub(
     Returns:
         返回经替换后的字符串
     """
-    result = ""
-    temp = string
-    if count != 0:
-        for _ in range(count):
-            match = re.search(pattern, temp, flags=flags)
-            replaced = None
-            if iscoroutinefunction(repl):
-                # noinspection PyUnresolvedReferences,PyCallingNonCallable
-                replaced = await repl(match)
-            elif callable(repl):
-                # noinspection PyCallingNonCallable
-                replaced = repl(match)
-            result += temp[: match.span(1)[0]] + (replaced or repl)
-            temp = temp[match.span(1)[1] :]
+    if not isinstance(pattern, re.Pattern):
+        pattern = re.compile(pattern, flags)
+    group = 1 if pattern.groups else 0
+    matches = []
+    for match in pattern.finditer(string):
+        if match.group(group) is None:
+            # 可选的分组没有参与匹配时不替换
+            continue
+        matches.append(match)
+        if len(matches) == count:
+            break
+    if not matches:
+        return string
+
+    # 相同的匹配内容使用同一个替换结果
+    unique: Dict[str, Match] = {}
+    for match in matches:
+        unique.setdefault(match.group(group), match)
+    if callable(repl):
+        replaced = [repl(match) for match in unique.values()]
+        if any(isawaitable(i) for i in replaced):
+            tasks = [asyncio.ensure_future(i if isawaitable(i) else _as_awaitable(i)) for i in replaced]
+            try:
+                replaced = await asyncio.gather(*tasks)
+            finally:
+                # 有替换失败时取消其他仍在执行的替换
+                for task in tasks:
+                    task.cancel()
+        replacements = {key: value or "" for key, value in zip(unique, replaced)}
     else:
-        while match := re.search(pattern, temp, flags=flags):
-            replaced = None
-            if iscoroutinefunction(repl):
-                # noinspection PyUnresolvedReferences,PyCallingNonCallable
-                replaced = await repl(match)
-            elif callable(repl):
-                # noinspection PyCallingNonCallable
-                replaced = repl(match)
-            result += temp[: match.span(1)[0]] + (replaced or repl)
-            temp = temp[match.span(1)[1] :]
-    return result + temp
+        replacements = dict.fromkeys(unique, repl)
+
+    result = []
+    last = 0
+    for match in matches:
+        start, end = match.span(group)
+        result.append(string[last:start])
+        result.append(replacements[match.group(group)])
+        last = end
+    result.append(string[last:])
+    return "".join(result)
+
+
+async def _as_awaitable(value: T) -> T:
+    return value